@@ -0,0 +1,43 @@
+"""
+Measures StormClient.get_artist_albums throughput against the local Spotify stand-in.
+
+    python -m benchmarks.bench_artist_albums --artists 200 --latency 0.05 --workers 1 4 8 16
+"""
+import argparse
+import time
+
+from storm.storm_client import StormClient, SpotifyTokenManager
+from benchmarks.fake_spotify import FakeSpotifyServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--artists", type=int, default=100)
+    parser.add_argument("--albums-per-artist", type=int, default=60)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    artists = [f"artist{i:06d}" for i in range(args.artists)]
+
+    with FakeSpotifyServer(albums_per_artist=args.albums_per_artist, latency=args.latency) as server:
+
+        # The stand-in does not check tokens
+        token_manager = SpotifyTokenManager(lambda: {"access_token": "bench", "expires_at": time.time() + 3600})
+
+        for workers in args.workers:
+            client = StormClient("bench", workers=workers, api_prefix=server.prefix, token_manager=token_manager)
+
+            server.request_count = 0
+            start = time.perf_counter()
+            albums = client.get_artist_albums(artists)
+            elapsed = time.perf_counter() - start
+
+            print(
+                f"workers={workers:>3} | artists={len(artists)} | albums={len(albums)} | "
+                f"requests={server.request_count} | {elapsed:.2f}s | {len(artists) / elapsed:.1f} artists/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+pytest-benchmark scenarios over a seeded StormDB and the local Spotify stand-in.
+
+    invoke bench                                  # results in benchmarks/results/<commit>.json
+    pytest-benchmark compare benchmarks/results/*.json
+
+Runs against mongomock unless STORM_BENCH_MONGO_URI points at a server (a throwaway
+database is created and dropped there). STORM_BENCH_ARTISTS sizes the seeded catalog
+and STORM_BENCH_LATENCY adds seconds to every stand-in response.
+Named bench_* so the regular test run doesn't collect it.
+"""
+import os
+import subprocess
+import sys
+import time
+import uuid
+import mongomock
+import pandas as pd
+import pytest
+
+from pymongo import MongoClient
+from sklearn.cluster import KMeans
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from storm.db import StormDB
+from storm.filters import StormFilterEngine
+from storm.instrumentation import MONGO_LISTENER
+from storm.modeling import StormTrackClusterizer, FeatureSelector
+from storm.runner import StormRunner
+from storm.storm_client import StormClient, StormUserClient, SpotifyTokenManager
+from storm.weatherboy import WeatherBoy
+from benchmarks.fake_spotify import FakeSpotifyServer
+from benchmarks.seed import seed_storm_db
+
+ARTISTS = int(os.getenv("STORM_BENCH_ARTISTS", 100))
+LATENCY = float(os.getenv("STORM_BENCH_LATENCY", 0))
+MONGO_URI = os.getenv("STORM_BENCH_MONGO_URI")
+
+MODEL_FEATURES = ["danceability", "energy", "acousticness", "instrumentalness", "valence", "tempo"]
+MODEL_CLUSTERS = 4
+MODEL_FRIENDLY_NAME = "{cluster_number} - Bench"
+
+
+def _storm_db(stale_fraction: float=0.0):
+    """
+    A freshly seeded database and its summary, each in its own database.
+    """
+    name = f"storm_bench_{uuid.uuid4().hex[:8]}"
+    os.environ["mongo_db"] = name
+    client = MongoClient(MONGO_URI, event_listeners=[MONGO_LISTENER]) if MONGO_URI else mongomock.MongoClient()
+
+    sdb = StormDB(mongo_client=client, ensure_indexes=MONGO_URI is not None)
+    return sdb, seed_storm_db(sdb, artists=ARTISTS, stale_fraction=stale_fraction)
+
+
+def _drop(sdb: StormDB):
+    sdb._mc.drop_database(sdb._db.name)
+
+
+@pytest.fixture(scope="module")
+def seeded():
+    sdb, summary = _storm_db()
+    yield sdb, summary
+    _drop(sdb)
+
+
+@pytest.fixture(scope="module")
+def spotify():
+    with FakeSpotifyServer(albums_per_artist=10, latency=LATENCY) as server:
+        yield server
+
+
+@pytest.fixture(scope="module")
+def clients(spotify):
+    # The stand-in does not check tokens
+    token_manager = SpotifyTokenManager(lambda: {"access_token": "bench", "expires_at": time.time() + 3600})
+    sc = StormClient("bench", api_prefix=spotify.prefix, token_manager=token_manager, rate_limit=10000)
+    suc = StormUserClient("bench", api_prefix=spotify.prefix, token_manager=token_manager)
+
+    return sc, suc
+
+
+@pytest.fixture(scope="module")
+def model(seeded, tmp_path_factory):
+    """
+    A clustering pipeline fitted on the seeded features, registered in a temporary models directory.
+    """
+    sdb, summary = seeded
+    directory = str(tmp_path_factory.mktemp("models"))
+    features = pd.DataFrame.from_records(sdb.get_track_info(summary["tracks"], {"_id": 1, **{x: 1 for x in MODEL_FEATURES}}))
+
+    pipeline = Pipeline([
+        ("features", FeatureSelector(MODEL_FEATURES)),
+        ("scale", StandardScaler()),
+        ("kmeans", KMeans(MODEL_CLUSTERS, n_init=1, random_state=0)),
+    ]).fit(features)
+
+    return directory, StormTrackClusterizer.register_model("bench", pipeline, MODEL_CLUSTERS, directory=directory)
+
+
+def _add_playlists(server: FakeSpotifyServer, summary: dict):
+    for playlist_id, tracks in summary["playlists"].items():
+        server.add_playlist(playlist_id, tracks)
+    for i in range(MODEL_CLUSTERS):
+        server.add_playlist(f"benchcluster{i}", [], name=MODEL_FRIENDLY_NAME.format(cluster_number=i))
+
+
+# Startup, each round a fresh interpreter
+STARTUP = {
+    "import_storm": "import storm",
+    "import_cli": "import storm.cli",
+    "import_runner": "from storm.runner import StormRunner",
+    "import_modeling": "from storm.modeling import StormTrackClusterizer",
+}
+
+
+@pytest.mark.parametrize("scenario", list(STARTUP))
+def test_cold_start(benchmark, scenario):
+    benchmark.group = "startup"
+
+    benchmark.pedantic(subprocess.run, args=([sys.executable, "-c", STARTUP[scenario]],), kwargs={"check": True},
+                       rounds=5, iterations=1)
+
+
+# Read endpoints
+READ_ENDPOINTS = {
+    "get_config": lambda sdb, s: sdb.get_config(s["storm_name"]),
+    "get_last_run": lambda sdb, s: sdb.get_last_run(s["storm_name"], ["run_date", "input_tracks", "storm_artists"]),
+    "get_runs_by_storm": lambda sdb, s: sdb.get_runs_by_storm(s["storm_name"]),
+    "get_known_artist_ids": lambda sdb, s: sdb.get_known_artist_ids(),
+    "get_artists_for_album_collection": lambda sdb, s: list(sdb.get_artists_for_album_collection(s["run_date"], s["artists"])),
+    "get_artists_by_genres": lambda sdb, s: sdb.get_artists_by_genres(["genre0"]),
+    "get_blacklist": lambda sdb, s: sdb.get_blacklist(f"{s['storm_name']}_blacklist"),
+    "get_albums_by_release_date": lambda sdb, s: sdb.get_albums_by_release_date(s["start_date"], s["run_date"]),
+    "get_albums_for_track_collection": lambda sdb, s: list(sdb.get_albums_for_track_collection()),
+    "get_albums_from_artists_by_date": lambda sdb, s: sdb.get_albums_from_artists_by_date(s["artists"], s["start_date"], s["run_date"]),
+    "get_album_info": lambda sdb, s: sdb.get_album_info(s["albums"]),
+    "get_tracks_for_feature_collection": lambda sdb, s: sdb.get_tracks_for_feature_collection(),
+    "get_tracks_from_albums": lambda sdb, s: sdb.get_tracks_from_albums(s["albums"][:1000]),
+    "get_track_info": lambda sdb, s: sdb.get_track_info(s["tracks"]),
+    "get_track_artists_map": lambda sdb, s: sdb.get_track_artists_map(s["tracks"][:1000], resolved=True),
+    "get_tracks_from_artists": lambda sdb, s: sdb.get_tracks_from_artists(s["artists"], s["start_date"], s["run_date"]),
+    "get_eligible_tracks": lambda sdb, s: list(sdb.get_eligible_tracks(s["artists"], s["start_date"], s["run_date"])),
+    "get_delivered_track_uids": lambda sdb, s: sdb.get_delivered_track_uids(s["storm_name"], s["tracks"][:1000], s["start_date"]),
+}
+
+
+@pytest.mark.parametrize("endpoint", list(READ_ENDPOINTS))
+def test_read_endpoint(benchmark, seeded, endpoint):
+    sdb, summary = seeded
+    benchmark.group = "db_read"
+
+    benchmark(READ_ENDPOINTS[endpoint], sdb, summary)
+
+
+# Filtering
+def test_apply_track_filters(benchmark, seeded):
+    sdb, summary = seeded
+    config = sdb.get_config(summary["storm_name"])
+    benchmark.group = "filters"
+
+    engine = StormFilterEngine(sdb, config["filters"])
+    storm_artists, removed_artists = engine.apply_artist_filters(summary["artists"])
+    records = list(sdb.get_eligible_tracks(storm_artists, "0000-00-00", summary["run_date"],
+                                           fields={**engine.required_track_fields(), "album_id": 1}))
+    eligible = [x["_id"] for x in records]
+
+    storm_tracks, _ = benchmark(engine.apply_track_filters, eligible, storm_artists, removed_artists, track_records=records)
+    assert 0 < len(storm_tracks) <= len(eligible)
+
+
+def test_filter_rereleases(benchmark, seeded, clients):
+    sdb, summary = seeded
+    sc, suc = clients
+    benchmark.group = "filters"
+
+    runner = StormRunner(summary["storm_name"], sdb=sdb, sc=sc, suc=suc)
+
+    def filter_rereleases():
+        runner.run_record["storm_tracks"] = list(summary["tracks"])
+        runner.filter_rereleases()
+        return runner.run_record["storm_tracks"]
+
+    assert len(benchmark(filter_rereleases)) > 0
+
+
+# Modeling
+def test_weatherboy_run(benchmark, seeded, spotify, clients, model):
+    sdb, summary = seeded
+    sc, suc = clients
+    directory, model_name = model
+    benchmark.group = "modeling"
+    _add_playlists(spotify, summary)
+
+    wb = WeatherBoy(sdb, model_name, model_dir=directory, friendly_name=MODEL_FRIENDLY_NAME, user_client=suc)
+    benchmark(wb.run, summary["tracks"])
+
+    assert sum(len(spotify.playlists[f"benchcluster{i}"]["tracks"]) for i in range(MODEL_CLUSTERS)) == len(summary["tracks"])
+
+
+# End to end
+@pytest.mark.parametrize("streaming", [False, True], ids=["batch", "streaming"])
+def test_runner_run(benchmark, monkeypatch, spotify, clients, model, streaming):
+    """
+    Full storm runs, each round on a freshly seeded database with a fifth of the artists due
+    for album collection so every collection stage talks to the stand-in.
+    """
+    sc, suc = clients
+    directory, model_name = model
+    benchmark.group = "runner"
+
+    # WeatherBoy writes cluster playlists as spotify_user_id, that client is the stand-in's here
+    monkeypatch.setattr("storm.weatherboy.get_user_client", lambda user_id, **kwargs: suc)
+    databases = []
+
+    def setup():
+        sdb, summary = _storm_db(stale_fraction=0.2)
+        databases.append((sdb, summary))
+        _add_playlists(spotify, summary)
+
+        runner = StormRunner(summary["storm_name"], model_name=model_name, model_friendly_name=MODEL_FRIENDLY_NAME,
+                             streaming=streaming, sdb=sdb, sc=sc, suc=suc, model_dir=directory)
+        return (runner,), {}
+
+    benchmark.pedantic(lambda runner: runner.Run(), setup=setup, rounds=3, iterations=1)
+
+    sdb, summary = databases[-1]
+    last_run = sdb.get_last_run(summary["storm_name"], ["run_date", "instrumentation"])
+    assert last_run["run_date"] == summary["run_date"]
+    stages = last_run["instrumentation"]["stages"]
+    assert "write_storm_tracks" in stages
+    assert sum(x["calls"] for stage in stages.values() for x in stage["api"].values()) > 0
+    for sdb, _ in databases:
+        _drop(sdb)
@@ -0,0 +1,332 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from typing import Dict, List
+
+
+class FakeSpotifyServer:
+    """
+    Local stand-in for the parts of the Spotify Web API that storm uses.
+    Serves deterministic synthetic catalog data so client throughput can be
+    measured without touching the real API. Playlists are held in memory,
+    added with add_playlist and rewritten by the playlist write endpoints.
+    """
+
+    def __init__(self, albums_per_artist: int=60, latency: float=0.0, rate_limit_every: int=0,
+                 retry_after: float=1, host: str="127.0.0.1", port: int=0):
+
+        self.albums_per_artist = albums_per_artist
+        self.latency = latency  # seconds added to every response
+        self.rate_limit_every = rate_limit_every  # every nth request is answered with a 429, 0 disables
+        self.retry_after = retry_after  # Retry-After sent with injected 429s
+        self.rate_limited_count = 0
+
+        self.request_count = 0
+        self.path_counts = Counter()  # requests per path
+        self.playlists = {}  # playlist id -> {"name", "snapshot", "tracks"}
+        self.playlist_writes = 0
+        self.missing_analysis = set()  # tracks audio-analysis answers 404 for
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def prefix(self) -> str:
+        """API base url to hand to the storm clients"""
+        return f"{self.url}/v1/"
+
+    @property
+    def token_url(self) -> str:
+        return f"{self.url}/api/token"
+
+    def start(self) -> "FakeSpotifyServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # Playlists
+    def add_playlist(self, playlist_id: str, tracks: List[str], name: str=None) -> None:
+        self.playlists[playlist_id] = {"name": playlist_id if name is None else name, "snapshot": 0, "tracks": list(tracks)}
+
+    def playlist(self, playlist_id: str) -> Dict:
+        playlist = self.playlists[playlist_id]
+        return {
+            "id": playlist_id,
+            "name": playlist["name"],
+            "description": "",
+            "owner": {"id": "bench"},
+            "snapshot_id": f"{playlist_id}-{playlist['snapshot']}",
+        }
+
+    def playlist_items(self, playlist_id: str, limit: int, offset: int) -> Dict:
+        tracks = self.playlists[playlist_id]["tracks"]
+        items = [{"track": {"id": x}} for x in tracks[offset : offset + limit]]
+        return self._page(items, len(tracks), limit, offset)
+
+    def write_playlist(self, playlist_id: str, method: str, body, params: Dict) -> Dict:
+        """
+        Replace (PUT uris), reorder (PUT range_start), add (POST, at position) and remove (DELETE).
+        """
+        playlist = self.playlists[playlist_id]
+        tracks = playlist["tracks"]
+        body = {"uris": body} if isinstance(body, list) else body or {}
+
+        if method == "PUT" and "range_start" in body:
+            start, length, before = body["range_start"], body.get("range_length", 1), body["insert_before"]
+            moved, rest = tracks[start : start + length], tracks[:start] + tracks[start + length:]
+            before = before if before <= start else before - length
+            tracks = rest[:before] + moved + rest[before:]
+        elif method == "DELETE":
+            removed = {x["uri"].split(":")[-1] for x in body.get("items", body.get("tracks", []))}
+            tracks = [x for x in tracks if x not in removed]
+        else:
+            added = [x.split(":")[-1] for x in body.get("uris") or params.get("uris", "").split(",") if x]
+            position = int(params.get("position", len(tracks))) if method == "POST" else 0
+            tracks = added if method == "PUT" else tracks[:position] + added + tracks[position:]
+
+        playlist["tracks"] = tracks
+        playlist["snapshot"] += 1
+        self.playlist_writes += 1
+        return {"snapshot_id": f"{playlist_id}-{playlist['snapshot']}"}
+
+    def user_playlists(self, limit: int, offset: int) -> Dict:
+        items = [{"id": k, "name": v["name"]} for k, v in self.playlists.items()]
+        return self._page(items[offset : offset + limit], len(items), limit, offset)
+
+    # Synthetic catalog
+    @staticmethod
+    def artist(artist_id: str) -> Dict:
+        seed = sum(map(ord, artist_id))
+        return {
+            "id": artist_id,
+            "name": f"Artist {artist_id}",
+            "genres": [f"genre{seed % 7}", f"genre{seed % 11}"],
+            "followers": {"href": None, "total": seed * 31 % 100000},
+            "popularity": seed % 100,
+        }
+
+    @staticmethod
+    def track(track_id: str) -> Dict:
+        artist_id = track_id.split("al")[0]
+        return {"id": track_id, "name": f"Track {track_id}", "artists": [{"id": artist_id, "name": artist_id}]}
+
+    def artist_albums(self, artist_id: str, limit: int, offset: int) -> Dict:
+        items = [
+            {
+                "album_type": "album" if i % 3 == 0 else "single",
+                "album_group": "album" if i % 3 == 0 else "single",
+                "id": f"{artist_id}al{i:04d}",
+                "name": f"Album {i} by {artist_id}",
+                "release_date": f"{2000 + i % 22}-{1 + i % 12:02d}-{1 + i % 28:02d}",
+                "artists": [{"id": artist_id, "name": artist_id}],
+                "total_tracks": 1 + i % 15,
+            }
+            for i in range(offset, min(offset + limit, self.albums_per_artist))
+        ]
+        return self._page(items, self.albums_per_artist, limit, offset)
+
+    def album_tracks(self, album_id: str, limit: int, offset: int) -> Dict:
+        total = 1 + sum(map(ord, album_id)) % 15
+        items = [
+            {
+                "id": f"{album_id}tr{i:02d}",
+                "name": f"Track {i} of {album_id}",
+                "artists": [{"id": album_id.split("al")[0], "name": album_id.split("al")[0]}],
+                "duration_ms": 120000 + 1000 * i,
+                "explicit": i % 4 == 0,
+                "track_number": i + 1,
+            }
+            for i in range(offset, min(offset + limit, total))
+        ]
+        return self._page(items, total, limit, offset)
+
+    @staticmethod
+    def audio_features(track_id: str) -> Dict:
+        seed = sum(map(ord, track_id))
+        return {
+            "id": track_id,
+            "danceability": (seed % 100) / 100,
+            "energy": (seed * 7 % 100) / 100,
+            "key": seed % 12,
+            "loudness": -(seed % 60) / 2,
+            "mode": seed % 2,
+            "speechiness": (seed * 3 % 100) / 100,
+            "acousticness": (seed * 11 % 100) / 100,
+            "instrumentalness": (seed * 13 % 100) / 100,
+            "liveness": (seed * 17 % 100) / 100,
+            "valence": (seed * 19 % 100) / 100,
+            "tempo": 60 + seed % 120,
+            "time_signature": 3 + seed % 2,
+            "duration_ms": 120000 + seed,
+        }
+
+    @staticmethod
+    def audio_analysis(track_id: str) -> Dict:
+        seed = sum(map(ord, track_id))
+        segments = [
+            {
+                "start": 0.25 * i,
+                "duration": 0.25,
+                "confidence": (seed + i) % 100 / 100,
+                "loudness_start": -20.0 + i % 5,
+                "loudness_max_time": 0.05,
+                "loudness_max": -10.0 + i % 5,
+                "loudness_end": 0.0,
+                "pitches": [((seed + i + j) % 10) / 10 for j in range(12)],
+                "timbre": [float((seed * (j + 1) + i) % 200 - 100) for j in range(12)],
+            }
+            for i in range(40 + seed % 20)
+        ]
+        sections = [
+            {
+                "start": 5.0 * i,
+                "duration": 5.0,
+                "confidence": 1.0,
+                "loudness": -10.0,
+                "tempo": 60 + seed % 120,
+                "tempo_confidence": 0.5,
+                "key": seed % 12,
+                "key_confidence": 0.5,
+                "mode": seed % 2,
+                "mode_confidence": 0.5,
+                "time_signature": 4,
+                "time_signature_confidence": 1.0,
+            }
+            for i in range(2)
+        ]
+        return {"meta": {"analyzer_version": "fake"}, "track": {"duration": 0.25 * len(segments)}, "bars": [], "beats": [],
+                "tatums": [], "sections": sections, "segments": segments}
+
+    @staticmethod
+    def _page(items: List, total: int, limit: int, offset: int) -> Dict:
+        return {
+            "items": items,
+            "total": total,
+            "limit": limit,
+            "offset": offset,
+            "next": "next" if offset + limit < total else None,
+        }
+
+    # Routing
+    def route(self, method: str, path: str, params: Dict, body: Dict=None) -> (int, Dict):
+        parts = [x for x in path.split("/") if x]
+        limit = int(params.get("limit", 20))
+        offset = int(params.get("offset", 0))
+
+        if method == "POST" and parts == ["api", "token"]:
+            return 200, {"access_token": "fake-token", "token_type": "Bearer", "expires_in": 3600}
+
+        if parts == ["v1", "me", "playlists"]:
+            return 200, self.user_playlists(limit, offset)
+
+        if parts[:2] == ["v1", "playlists"] and len(parts) >= 3 and parts[2] not in self.playlists:
+            return 404, {"error": {"status": 404, "message": "Invalid playlist Id"}}
+
+        if parts[:2] == ["v1", "playlists"] and len(parts) == 3:
+            return 200, self.playlist(parts[2])
+
+        if parts[:2] == ["v1", "playlists"] and len(parts) == 4 and parts[3] in ("tracks", "items"):
+            if method == "GET":
+                return 200, self.playlist_items(parts[2], limit, offset)
+            return 201 if method == "POST" else 200, self.write_playlist(parts[2], method, body, params)
+
+        if parts == ["v1", "artists"]:
+            return 200, {"artists": [self.artist(x) for x in params["ids"].split(",")]}
+
+        if parts == ["v1", "tracks"]:
+            return 200, {"tracks": [self.track(x) for x in params["ids"].split(",")]}
+
+        if parts[:2] == ["v1", "artists"] and len(parts) == 4 and parts[3] == "albums":
+            return 200, self.artist_albums(parts[2], limit, offset)
+
+        if parts[:2] == ["v1", "albums"] and len(parts) == 4 and parts[3] == "tracks":
+            return 200, self.album_tracks(parts[2], limit, offset)
+
+        if parts[:2] == ["v1", "audio-analysis"] and len(parts) == 3 and parts[2] in self.missing_analysis:
+            return 404, {"error": {"status": 404, "message": "analysis not found"}}
+
+        if parts[:2] == ["v1", "audio-analysis"] and len(parts) == 3:
+            return 200, self.audio_analysis(parts[2])
+
+        if parts == ["v1", "audio-features"]:
+            return 200, {"audio_features": [self.audio_features(x) for x in params["ids"].split(",")]}
+
+        return 404, {"error": {"status": 404, "message": f"{path} not faked"}}
+
+    def _build_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def _respond(self, method, body=None):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+
+                with server._lock:
+                    server.request_count += 1
+                    server.path_counts[parsed.path] += 1
+                    rate_limited = server.rate_limit_every > 0 and server.request_count % server.rate_limit_every == 0
+                    server.rate_limited_count += int(rate_limited)
+
+                if server.latency > 0:
+                    time.sleep(server.latency)
+
+                if rate_limited:
+                    status, body = 429, {"error": {"status": 429, "message": "API rate limit exceeded"}}
+                else:
+                    with server._lock:
+                        status, body = server.route(method, parsed.path, params, body)
+                payload = json.dumps(body).encode()
+
+                self.send_response(status)
+                if rate_limited:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length)
+                try:
+                    return json.loads(raw) if raw else None
+                except ValueError:
+                    return None  # form encoded token requests
+
+            def do_POST(self):
+                self._respond("POST", self._read_body())
+
+            def do_PUT(self):
+                self._respond("PUT", self._read_body())
+
+            def do_DELETE(self):
+                self._respond("DELETE", self._read_body())
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,187 @@
+"""
+Seeds a StormDB with a synthetic catalog for benchmarking.
+
+Ids follow the FakeSpotifyServer scheme (artist -> album -> track) so a seeded
+database and the stand-in describe the same catalog. Ratios mirror a real storm:
+artists average ~8 albums, most of them singles and EPs with a few full length
+albums, and their release dates are spread over the years before the run date.
+
+    python -m benchmarks.seed --artists 2000 --mongo-uri mongodb://localhost:27017 --db storm_bench
+"""
+import argparse
+import datetime as dt
+import os
+import numpy as np
+
+from typing import Dict, List
+
+from pymongo import MongoClient
+
+from storm.db import StormDB
+from benchmarks.fake_spotify import FakeSpotifyServer
+
+GENRES = [f"genre{i}" for i in range(11)]
+AUDIO_FEATURE_FILTERS = {"energy": "gte&&0.1", "speechiness": "lte&&0.9"}
+
+
+def storm_config(storm_name: str) -> Dict:
+    """
+    A storm config exercising every filter the runner supports.
+    Playlist ids are kept base62, as spotipy requires.
+    """
+    playlist = "".join(x for x in storm_name if x.isalnum())
+    return {
+        "name": storm_name,
+        "config": {
+            "user_id": "bench",
+            "great_targets": f"{playlist}great",
+            "good_targets": f"{playlist}good",
+            "full_storm_delivery": {"playlist": f"{playlist}delivery"},
+            "rolling_good": {"playlist": f"{playlist}rolling"},
+            "filters": {
+                "artist": {"genre": ["genre0", "genre1"], "blacklist": f"{storm_name}_blacklist"},
+                "track": {"artist_filter": "soft", "audio_features": AUDIO_FEATURE_FILTERS},
+            },
+        },
+    }
+
+
+def seed_storm_db(sdb: StormDB, artists: int=500, albums_per_artist: float=8, storm_name: str="bench_storm",
+                  run_date: str=None, days: int=730, stale_fraction: float=0.0, seed: int=0) -> Dict:
+    """
+    Writes artists, their albums and tracks (with audio features), a storm config,
+    a past run, input playlists and a blacklist into an empty StormDB.
+    stale_fraction of the artists are left due for album collection.
+    Returns a summary used by the benchmark scenarios: counts, the artist and track ids,
+    the playlists and the date window.
+    """
+    rng = np.random.default_rng(seed)
+    today = dt.datetime.now().strftime("%Y-%m-%d")
+    run_date = today if run_date is None else run_date
+    end = dt.datetime.strptime(run_date, "%Y-%m-%d")
+    start_date = (end - dt.timedelta(days=30)).strftime("%Y-%m-%d")
+
+    artist_ids = [f"artist{i:06d}" for i in range(artists)]
+    album_counts = 1 + rng.poisson(albums_per_artist - 1, artists)
+    collected = rng.random(artists) >= stale_fraction
+
+    artist_docs, album_docs, track_docs, feature_docs = {}, [], [], []
+    for artist_id, n_albums, is_collected in zip(artist_ids, album_counts, collected):
+        artist_docs[artist_id] = {
+            "_id": artist_id, "name": f"Artist {artist_id}", "last_updated": today, "albums": [],
+            "genres": rng.choice(GENRES, size=rng.integers(1, 4), replace=False).tolist(),
+            "total_followers": int(rng.integers(0, 1000000)), "popularity": int(rng.integers(0, 100)),
+        }
+        if is_collected:
+            artist_docs[artist_id]["album_last_collected"] = run_date
+
+        for j in range(n_albums):
+            album_id = f"{artist_id}al{j:04d}"
+            album_type = str(rng.choice(["single", "ep", "album"], p=[0.6, 0.2, 0.2]))
+            n_tracks = int({"single": rng.integers(1, 3), "ep": rng.integers(4, 7), "album": rng.integers(8, 16)}[album_type])
+            released = (end - dt.timedelta(days=int(rng.integers(0, days)))).strftime("%Y-%m-%d")
+
+            # Features and collaborators
+            album_artists = [artist_id]
+            if rng.random() < 0.1:
+                album_artists.append(artist_ids[rng.integers(0, artists)])
+
+            tracks = [f"{album_id}tr{k:02d}" for k in range(n_tracks)]
+            album_docs.append({"_id": album_id, "name": f"Album {j} by {artist_id}", "album_type": album_type,
+                               "album_group": album_type, "release_date": released, "artists": album_artists,
+                               "total_tracks": n_tracks, "tracks": tracks, "added_to_artists": True,
+                               "last_updated": today})
+
+            for k, track_id in enumerate(tracks):
+                features = FakeSpotifyServer.audio_features(track_id)
+                feature_docs.append(features)
+                track_docs.append({**{f: v for f, v in features.items() if f != "id"},
+                                   "_id": track_id, "name": f"Track {k} of {album_id}", "artists": album_artists,
+                                   "album_id": album_id, "explicit": bool(rng.random() < 0.2), "track_number": k + 1,
+                                   "audio_features": True, "last_updated": today})
+
+    # Album links as update_artist_albums leaves them
+    for album in album_docs:
+        for artist in dict.fromkeys(album["artists"]):
+            artist_docs[artist]["albums"].append(album["_id"])
+
+    # Inserted whole, in the shape the StormDB write endpoints leave documents in.
+    # Per document upserts make seeding large catalogs (and mongomock) crawl
+    sdb._artists.insert_many(list(artist_docs.values()))
+    sdb._albums.insert_many(album_docs)
+    sdb._tracks.insert_many(track_docs)
+    if sdb.feature_store is not None:
+        sdb.feature_store.append(feature_docs)
+
+    # Storm setup
+    sdb._storms.replace_one({"name": storm_name}, storm_config(storm_name), upsert=True)
+    sdb._blacklists.replace_one({"_id": f"{storm_name}_blacklist"},
+                                {"_id": f"{storm_name}_blacklist", "blacklist": artist_ids[:: max(artists // 50, 1)]},
+                                upsert=True)
+
+    config = storm_config(storm_name)["config"]
+    track_ids = [x["_id"] for x in track_docs]
+    playlists = {
+        config["great_targets"]: rng.choice(track_ids, size=min(200, len(track_ids)), replace=False).tolist(),
+        config["good_targets"]: rng.choice(track_ids, size=min(500, len(track_ids)), replace=False).tolist(),
+        config["full_storm_delivery"]["playlist"]: [],
+        config["rolling_good"]["playlist"]: [],
+    }
+
+    sdb.write_run_record(_past_run(storm_name, artist_ids, track_ids, playlists, start_date, rng), compact=True)
+
+    return {
+        "storm_name": storm_name,
+        "run_date": run_date,
+        "start_date": start_date,
+        "artists": artist_ids,
+        "albums": [x["_id"] for x in album_docs],
+        "tracks": track_ids,
+        "playlists": playlists,
+        "counts": {"artists": len(artist_docs), "albums": len(album_docs), "tracks": len(track_docs)},
+    }
+
+
+def _past_run(storm_name: str, artist_ids: List[str], track_ids: List[str], playlists: Dict[str, List[str]],
+              run_date: str, rng: np.random.Generator) -> Dict:
+    """
+    The storm's previous run, the runner starts from its artists and input tracks.
+    """
+    config = storm_config(storm_name)["config"]
+    delivered = rng.choice(track_ids, size=min(1000, len(track_ids)), replace=False).tolist()
+
+    return {
+        "config": config,
+        "storm_name": storm_name,
+        "run_date": run_date,
+        "start_date": run_date,
+        "playlists": list(playlists),
+        "input_tracks": playlists[config["great_targets"]] + playlists[config["good_targets"]],
+        "input_artists": artist_ids,
+        "eligible_tracks": track_ids,
+        "storm_artists": artist_ids,
+        "storm_albums": [],
+        "storm_tracks": delivered,
+        "storm_sample_tracks": [],
+        "removed_artists": [],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artists", type=int, default=500)
+    parser.add_argument("--albums-per-artist", type=float, default=8)
+    parser.add_argument("--storm-name", default="bench_storm")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="storm_bench")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["mongo_db"] = args.db
+    sdb = StormDB(mongo_client=MongoClient(args.mongo_uri))
+    summary = seed_storm_db(sdb, args.artists, args.albums_per_artist, args.storm_name, seed=args.seed)
+    print(summary["counts"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,27 @@
-from .db import StormDB
-from .runner import StormRunner
\ No newline at end of file
+import importlib
+
+# Public names and the submodules defining them. Submodules are imported on first access,
+# so `import storm` (and the CLI) doesn't pay for pymongo, spotipy, pandas or sklearn up front.
+_LAZY = {
+    "StormDB": "db",
+    "StormRunner": "runner",
+    "StormScheduler": "scheduler",
+    "StormClient": "storm_client",
+    "StormUserClient": "storm_client",
+    "WeatherBoy": "weatherboy",
+}
+
+__all__ = list(_LAZY)
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(f".{_LAZY[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
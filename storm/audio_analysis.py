@@ -0,0 +1,119 @@
+import logging
+import numpy as np
+from bson.binary import Binary
+
+from typing import List, Dict, Iterator
+
+l = logging.getLogger('storm.audio_analysis')
+
+# Columns of the packed matrices, in order
+SEGMENT_FIELDS = [
+    "start",
+    "duration",
+    "confidence",
+    "loudness_start",
+    "loudness_max_time",
+    "loudness_max",
+    "loudness_end",
+]
+SECTION_FIELDS = [
+    "start",
+    "duration",
+    "confidence",
+    "loudness",
+    "tempo",
+    "tempo_confidence",
+    "key",
+    "key_confidence",
+    "mode",
+    "mode_confidence",
+    "time_signature",
+    "time_signature_confidence",
+]
+PACKED_FORMAT = 1
+
+
+def _pack(matrix: np.ndarray) -> Binary:
+    return Binary(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+
+
+def _unpack(data: bytes, columns: int) -> np.ndarray:
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, columns)
+
+
+def pack_audio_analysis(track_id: str, analysis: Dict) -> Dict:
+    """
+    Packs an API audio analysis into a compact document: segment and section fields as
+    float32 matrices, segment pitches and timbre as (segments, 12) float32 matrices, all
+    stored as raw bytes. Missing values are NaN.
+    """
+    segments = analysis.get("segments", [])
+    sections = analysis.get("sections", [])
+
+    return {
+        "_id": track_id,
+        "format": PACKED_FORMAT,
+        "segment_count": len(segments),
+        "section_count": len(sections),
+        "segments": _pack([[x.get(f, np.nan) for f in SEGMENT_FIELDS] for x in segments]),
+        "pitches": _pack([x.get("pitches", [np.nan] * 12) for x in segments]),
+        "timbre": _pack([x.get("timbre", [np.nan] * 12) for x in segments]),
+        "sections": _pack([[x.get(f, np.nan) for f in SECTION_FIELDS] for x in sections]),
+    }
+
+
+def unpack_audio_analysis(document: Dict) -> Dict[str, np.ndarray]:
+    """
+    Matrices of a packed audio analysis document, read only views over its bytes.
+    """
+    return {
+        "segments": _unpack(document["segments"], len(SEGMENT_FIELDS)),
+        "pitches": _unpack(document["pitches"], 12),
+        "timbre": _unpack(document["timbre"], 12),
+        "sections": _unpack(document["sections"], len(SECTION_FIELDS)),
+    }
+
+
+def collect_audio_analysis(sdb, sc, batch_size: int=100, limit: int=None, max_attempts: int=None) -> Dict[str, int]:
+    """
+    Collects audio analysis for every track still missing it, limit tracks at most.
+    Each batch is requested concurrently (the client's workers) and written before the next
+    one starts, so an interrupted collection resumes from the tracks still unflagged.
+    Tracks the API returns nothing for get a failed attempt recorded, and are skipped once
+    they failed max_attempts times (see StormDB.get_tracks_for_audio_analysis).
+    Returns the number of tracks requested, stored and failed.
+    """
+    requested = 0
+    stored = 0
+    failed = 0
+    for batch in _batches(sdb.get_tracks_for_audio_analysis(max_attempts), batch_size, limit):
+
+        analysis = sc.get_track_audio_analysis(batch)
+        sdb.update_track_analysis(analysis)
+
+        collected = {x["id"] for x in analysis}
+        failures = [x for x in batch if x not in collected]
+        if len(failures) > 0:
+            sdb.record_track_analysis_failures(failures)
+
+        requested += len(batch)
+        stored += len(analysis)
+        failed += len(failures)
+        l.debug(f"Audio analysis stored for {stored}/{requested} tracks.")
+
+    return {"requested": requested, "stored": stored, "failed": failed}
+
+
+def _batches(ids: Iterator[str], size: int, limit: int=None) -> Iterator[List[str]]:
+    batch = []
+    for i, x in enumerate(ids):
+        if limit is not None and i >= limit:
+            break
+
+        batch.append(x)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if len(batch) > 0:
+        yield batch
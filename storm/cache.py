@@ -0,0 +1,88 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict
+
+from .db import StormDB
+from .storm_client import StormClient
+
+l = logging.getLogger('storm.cache')
+
+
+class TrackArtistResolver:
+    """
+    Resolves track -> artist ids, cheapest source first:
+    a size bounded in-process LRU, then Mongo (collected tracks and previously
+    resolved tracks), and only the remaining misses from the API in full batches.
+    API results are written back to Mongo and the LRU.
+    """
+
+    def __init__(self, sdb: StormDB, sc: StormClient, maxsize: int=100000):
+
+        self.sdb = sdb
+        self.sc = sc
+        self.maxsize = maxsize
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Tracks answered by each source
+        self.lru_hits = 0
+        self.db_hits = 0
+        self.api_misses = 0
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'lru_hits': self.lru_hits, 'db_hits': self.db_hits, 'api_misses': self.api_misses, 'size': len(self)}
+
+    def get_track_artists_map(self, tracks: List[str]) -> Dict[str, List[str]]:
+        """
+        Returns track -> artist ids for every track in tracks.
+        """
+        tracks = list(dict.fromkeys(tracks))
+        result = {}
+
+        with self._lock:
+            for track in tracks:
+                if track in self._cache:
+                    self._cache.move_to_end(track)
+                    result[track] = self._cache[track]
+            self.lru_hits += len(result)
+
+        missing = [x for x in tracks if x not in result]
+        if len(missing) > 0:
+            found = self.sdb.get_track_artists_map(missing, resolved=True)
+            self.db_hits += len(found)
+            self._store(found)
+            result.update(found)
+
+        missing = [x for x in missing if x not in result]
+        if len(missing) > 0:
+            l.debug(f"Resolving artists for {len(missing)} tracks from the API.")
+            fetched = self.sc.get_track_artists_map(missing)
+            self.api_misses += len(missing)
+            self.sdb.update_track_artists(fetched)
+            self._store(fetched)
+            result.update(fetched)
+
+        return result
+
+    def get_artists_from_tracks(self, tracks: List[str]) -> List[str]:
+        """
+        Unique artists across all of the tracks, same contract as StormClient.get_artists_from_tracks.
+        """
+        artists = set()
+        [artists.update(x) for x in self.get_track_artists_map(tracks).values()]
+
+        return sorted(artists)
+
+    def _store(self, track_artists: Dict[str, List[str]]) -> None:
+        with self._lock:
+            for track, artists in track_artists.items():
+                self._cache[track] = artists
+                self._cache.move_to_end(track)
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
@@ -0,0 +1,166 @@
+"""
+Storm's command line. Starts fast: each command imports the parts of storm it uses,
+so pymongo, spotipy, pandas and sklearn are only loaded by the commands that need them.
+
+    python -m storm run film_vg_instrumental_v2
+    python -m storm run-parallel --workers 4 --streaming
+    python -m storm compact-runs
+    python -m storm ensure-indexes --explain
+"""
+import argparse
+import logging
+import os
+import sys
+
+from typing import List
+
+from .helper import load_env
+
+# Make sure to add the models you want here
+STORM_CONFIG = {
+    'film_vg_instrumental_v2': {
+        'model_name': 'film_vg_instrumental__distinct__track_feature__8__d9a37891-b219-4fb6-b764-5028f189d117',
+        'model_friendly_name': '{cluster_number} - Film, VG and Instrumental'
+    },
+    'contemporary_lyrical_v2': {
+        'model_name': 'contemporary_lyrical__distinct__track_feature__8__8b53daac-aa99-4442-a5cb-e309dab7e468',
+        'model_friendly_name': '{cluster_number} - Contemporary Lyrical'
+    },
+}
+
+
+def setup_logging(level: str='info') -> None:
+    """
+    Logs the storm loggers to stdout at the level given (info or debug).
+    """
+    log_level = logging.DEBUG if level == 'debug' else logging.INFO
+
+    root = logging.getLogger("storm")
+    root.setLevel(log_level)
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setLevel(log_level)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+
+
+# Commands
+def run(storm_name: str, streaming: bool=False, metrics_path: str=None) -> None:
+    """
+    Runs a configured storm by name, with streaming collection runs as a resumable pipeline.
+    metrics_path exports the run's instrumentation, {storm_name} is filled in.
+    """
+    from .runner import StormRunner
+
+    StormRunner(storm_name, streaming=streaming, metrics_path=metrics_path, **STORM_CONFIG[storm_name]).Run()
+
+
+def run_all(streaming: bool=False, metrics_path: str=None) -> None:
+    """
+    Runs the configured storms one after another.
+    """
+    for storm_name in STORM_CONFIG:
+        run(storm_name, streaming=streaming, metrics_path=metrics_path)
+
+
+def run_parallel(workers: int=4, streaming: bool=False, metrics_path: str=None) -> None:
+    """
+    Runs the configured storms as one job, collecting shared artists once and delivering the storms in parallel.
+    """
+    from .scheduler import StormScheduler
+
+    StormScheduler(STORM_CONFIG, workers=workers, streaming=streaming, metrics_path=metrics_path).Run()
+
+
+def collect_audio_analysis(limit: int=None, workers: int=8, migrate: bool=False) -> None:
+    """
+    Collects audio analysis for tracks missing it, optionally first moving analysis
+    still embedded in track records into the packed audio_analysis collection.
+    """
+    from .audio_analysis import collect_audio_analysis
+    from .db import StormDB
+    from .storm_client import StormClient
+
+    sdb = StormDB()
+    if migrate:
+        sdb.migrate_track_analysis()
+
+    load_env()
+    sc = StormClient(os.getenv('spotify_user_id'), workers=workers)
+    print(collect_audio_analysis(sdb, sc, limit=limit))
+
+
+def compact_runs(storm_name: str=None) -> None:
+    """
+    Moves the bulky arrays of stored run records into run_chunks, for one storm or all of them.
+    """
+    from .db import StormDB
+
+    print(f"{StormDB().compact_runs(storm_name)} runs compacted.")
+
+
+def ensure_indexes(explain: bool=False) -> None:
+    """
+    Creates the Storm MongoDB indexes, optionally reporting which read endpoints still scan collections.
+    """
+    from .db import StormDB
+
+    sdb = StormDB()
+    sdb.ensure_indexes()
+
+    if explain:
+        for endpoint, plan in sdb.explain_read_endpoints().items():
+            flag = 'COLLSCAN' if plan['collscan'] else 'ok'
+            print(f"{endpoint:<40} {plan['collection']:<15} {flag:<8} {plan['stages']}")
+
+
+METRICS_HELP = "Exports the run's stage, API and Mongo metrics: Prometheus text for .prom, JSON otherwise."
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="storm", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log-level", choices=["info", "debug"], default="info")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("run", help="Runs a configured storm by name.")
+    command.add_argument("storm_name", choices=list(STORM_CONFIG))
+    command.add_argument("--streaming", action="store_true")
+    command.add_argument("--metrics-path", default=None, help=METRICS_HELP)
+    command.set_defaults(func=lambda args: run(args.storm_name, streaming=args.streaming, metrics_path=args.metrics_path))
+
+    command = commands.add_parser("run-all", help="Runs the configured storms one after another.")
+    command.add_argument("--streaming", action="store_true")
+    command.add_argument("--metrics-path", default=None, help=METRICS_HELP)
+    command.set_defaults(func=lambda args: run_all(streaming=args.streaming, metrics_path=args.metrics_path))
+
+    command = commands.add_parser("run-parallel", help="Runs the configured storms as one job.")
+    command.add_argument("--workers", type=int, default=4)
+    command.add_argument("--streaming", action="store_true")
+    command.add_argument("--metrics-path", default=None, help=METRICS_HELP)
+    command.set_defaults(func=lambda args: run_parallel(workers=args.workers, streaming=args.streaming,
+                                                        metrics_path=args.metrics_path))
+
+    command = commands.add_parser("collect-audio-analysis", help="Collects audio analysis for tracks missing it.")
+    command.add_argument("--limit", type=int, default=None)
+    command.add_argument("--workers", type=int, default=8)
+    command.add_argument("--migrate", action="store_true")
+    command.set_defaults(func=lambda args: collect_audio_analysis(limit=args.limit, workers=args.workers, migrate=args.migrate))
+
+    command = commands.add_parser("compact-runs", help="Moves the bulky arrays of stored run records into run_chunks.")
+    command.add_argument("--storm-name", default=None)
+    command.set_defaults(func=lambda args: compact_runs(args.storm_name))
+
+    command = commands.add_parser("ensure-indexes", help="Creates the Storm MongoDB indexes.")
+    command.add_argument("--explain", action="store_true")
+    command.set_defaults(func=lambda args: ensure_indexes(explain=args.explain))
+
+    return parser
+
+
+def main(argv: List[str]=None) -> int:
+    args = build_parser().parse_args(argv)
+
+    setup_logging(args.log_level)
+    args.func(args)
+    return 0
@@ -2,14 +2,22 @@ import logging
 import os
 from sys import getsizeof
 import json
+import hashlib
+import zlib
 from typing import Dict
-from pymongo import MongoClient
-import pandas as pd
-from tqdm import tqdm
+from pymongo import MongoClient, UpdateOne, UpdateMany, IndexModel, ASCENDING, DESCENDING
+from bson import ObjectId
+from bson.binary import Binary
 import numpy as np
 import datetime as dt
 
-from typing import List, Dict
+from typing import List, Dict, Iterator
+
+from .feature_store import FeatureStore
+from .helper import load_env
+from .instrumentation import MONGO_LISTENER
+from .audio_analysis import pack_audio_analysis, unpack_audio_analysis
+from .run_record import IdTable, IdSet
 
 l = logging.getLogger('storm.db')
 
@@ -22,9 +30,72 @@ class StormDB:
     needed for storm operations and machine learning.
     """
 
-    def __init__(self, mongo_client=None):
+    # Run record arrays kept in run_chunks when run records are compacted
+    RUN_CHUNKED_FIELDS = [
+        "input_tracks",
+        "input_artists",
+        "eligible_tracks",
+        "removed_tracks",
+        "storm_tracks",
+        "storm_tracks_uid",
+        "storm_artists",
+        "storm_albums",
+        "storm_sample_tracks",
+        "removed_artists",
+    ]
+
+    # run_chunks field holding a run's id table, see _write_run_id_table
+    RUN_ID_TABLE = "_id_table"
+
+    # delivered_tracks document (<storm>:<marker>) recording a storm's past runs were backfilled
+    DELIVERED_BACKFILL_MARKER = "__backfilled__"
+
+    # Failed audio analysis requests after which a track is no longer requested, see record_track_analysis_failures
+    AUDIO_ANALYSIS_ATTEMPTS = 3
+
+    # Characters dropped from track names in unique track keys
+    UNIQUE_NAME_TABLE = str.maketrans("", "", ",. ")
+
+    # Indexes backing the read endpoints, collection name -> {index name: keys}
+    INDEXES = {
+        "storm_metadata": {
+            "name": [("name", ASCENDING)],
+        },
+        "runs": {
+            "storm_name_run_date": [("storm_name", ASCENDING), ("run_date", DESCENDING)],
+        },
+        "artists": {
+            "genres": [("genres", ASCENDING)],
+            "album_last_collected": [("album_last_collected", ASCENDING)],
+        },
+        "albums": {
+            "release_date_id": [("release_date", ASCENDING), ("_id", ASCENDING)],
+            "artists_release_date": [("artists", ASCENDING), ("release_date", ASCENDING)],
+            "tracks": [("tracks", ASCENDING)],
+            "added_to_artists": [("added_to_artists", ASCENDING)],
+        },
+        "tracks": {
+            "album_id_id": [("album_id", ASCENDING), ("_id", ASCENDING)],
+            "last_updated": [("last_updated", ASCENDING)],
+            "audio_features": [("audio_features", ASCENDING)],
+            "audio_analysis_flag": [("audio_analysis_flag", ASCENDING)],
+        },
+        "tracks_unique": {
+            "dedup_date": [("dedup_date", DESCENDING)],
+        },
+        "run_chunks": {
+            "run_id_field_n": [("run_id", ASCENDING), ("field", ASCENDING), ("n", ASCENDING)],
+        },
+        "delivered_tracks": {
+            "storm_name_uid_last_delivered": [("storm_name", ASCENDING), ("uid", ASCENDING), ("last_delivered", ASCENDING)],
+        },
+    }
+
+    def __init__(self, mongo_client=None, write_chunk_size: int=1000, ensure_indexes: bool=False,
+                 feature_store: FeatureStore=None, run_chunk_size: int=50000):
 
         # Build mongo client and db
+        load_env()
         if mongo_client is None:
             self._mc = MongoClient(
                 os.getenv("mongo_host"),
@@ -32,6 +103,7 @@ class StormDB:
                 password=os.getenv("mongo_pass"),
                 authSource=os.getenv("mongo_db"),
                 authMechanism="SCRAM-SHA-256",
+                event_listeners=[MONGO_LISTENER],  # per collection metrics while a run is instrumented
             )
         else:
             self._mc = mongo_client
@@ -46,9 +118,131 @@ class StormDB:
         self._playlists = self._db["playlists"]
         self._runs = self._db["runs"]
         self._blacklists = self._db["blacklists"]
+        self._track_artists = self._db["track_artists"]  # API resolved artists for tracks not in tracks
+        self._checkpoints = self._db["pipeline_checkpoints"]
+        self._audio_analysis = self._db["audio_analysis"]  # packed sections and segments, keyed by track
+        self._delivered = self._db["delivered_tracks"]  # track uids each storm delivered, with dates
+        self._run_chunks = self._db["run_chunks"]  # compacted run record arrays
+        self._playlist_index = self._db["playlist_index"]  # users' playlist name -> id, see StormUserClient
+
+        # Number of operations sent per bulk_write round trip
+        self.write_chunk_size = write_chunk_size
+
+        # Values per compacted run record chunk
+        self.run_chunk_size = run_chunk_size
+
+        # Columnar copy of the audio features, kept up to date by update_track_features
+        if feature_store is None and os.getenv("storm_feature_store"):
+            feature_store = FeatureStore(os.getenv("storm_feature_store"))
+        self.feature_store = feature_store
+
+        if ensure_indexes:
+            self.ensure_indexes()
 
         l.debug("Storm MongoDB Backend Successfully Initialized.")
 
+    # Index management
+    def ensure_indexes(self) -> Dict[str, List[str]]:
+        """
+        Creates every index declared in StormDB.INDEXES, existing indexes are left as is.
+        Returns the index names per collection.
+        """
+        result = {}
+        for collection, indexes in self.INDEXES.items():
+            models = [IndexModel(keys, name=name) for name, keys in indexes.items()]
+            result[collection] = self._db[collection].create_indexes(models)
+            l.debug(f"Indexes ensured on {collection}: {result[collection]}")
+
+        return result
+
+    def _read_endpoint_queries(self) -> Dict[str, tuple]:
+        """
+        Representative (collection, query, projection) for each read endpoint,
+        values are placeholders since only the plan shape matters.
+        """
+        day = "2021-01-01"
+        return {
+            "get_config": ("storm_metadata", {"name": "storm"}, {"config": 1}),
+            "get_last_run": ("runs", {"storm_name": "storm"}, {"_id": 1, "run_date": 1}),
+            "get_runs_by_storm": ("runs", {"storm_name": "storm"}, {"config": 0}),
+            "get_artists_for_album_collection": (
+                "artists", {"album_last_collected": {"$not": {"$gte": day}}}, {"_id": 1}
+            ),
+            "get_artists_by_genres": ("artists", {"genres": {"$all": ["genre"]}}, {"_id": 1}),
+            "get_albums_by_release_date": ("albums", {"release_date": {"$gt": day, "$lte": day}}, {"_id": 1}),
+            "get_albums_for_track_collection": ("albums", {"tracks": {"$exists": False}}, {"_id": 1}),
+            "get_albums_from_artists_by_date": (
+                "albums", {"_id": {"$in": ["album"]}, "release_date": {"$gt": day, "$lte": day}}, {"_id": 1}
+            ),
+            "get_tracks_for_feature_collection": ("tracks", {"audio_features": None}, {"_id": 1, "audio_features": 1}),
+            "get_tracks_for_audio_analysis": (
+                "tracks",
+                {"audio_analysis_flag": {"$ne": True}, "audio_analysis_attempts": {"$not": {"$gte": self.AUDIO_ANALYSIS_ATTEMPTS}}},
+                {"_id": 1},
+            ),
+            "update_artist_albums": ("albums", {"added_to_artists": {"$ne": True}}, {"_id": 1, "artists": 1}),
+            "get_tracks_from_albums": ("tracks", {"album_id": {"$in": ["album"]}}, {"_id": 1}),
+            "get_eligible_tracks": (
+                "albums", {"artists": {"$in": ["artist"]}, "release_date": {"$gt": day, "$lte": day}}, {"_id": 1}
+            ),
+            "get_track_info": ("tracks", {"_id": {"$in": ["track"]}}, {"artists": 0, "audio_analysis": 0}),
+            "dedup_tracks_on_name": ("tracks", {"last_updated": {"$gte": day}}, {"_id": 1}),
+            "get_delivered_track_uids": (
+                "delivered_tracks", {"storm_name": "storm", "uid": {"$in": ["uid"]}, "last_delivered": {"$gt": day}}, {"_id": 0, "uid": 1}
+            ),
+        }
+
+    @staticmethod
+    def _plan_stages(plan: Dict) -> List[str]:
+        """
+        Flattens the stages of an explain() plan tree.
+        """
+        stages = [plan.get("stage")]
+        for key in ["inputStage", "queryPlan"]:
+            if key in plan:
+                stages.extend(StormDB._plan_stages(plan[key]))
+        for child in plan.get("inputStages", []):
+            stages.extend(StormDB._plan_stages(child))
+
+        return [x for x in stages if x is not None]
+
+    def explain_read_endpoints(self) -> Dict[str, Dict]:
+        """
+        Runs explain() on the query behind each read endpoint and flags collection scans.
+        Backends without explain support (e.g. mongomock) report stages as None.
+        """
+        result = {}
+        for endpoint, (collection, q, cols) in self._read_endpoint_queries().items():
+            try:
+                plan = self._db[collection].find(q, cols).explain()["queryPlanner"]["winningPlan"]
+                stages = self._plan_stages(plan)
+            except (NotImplementedError, AttributeError, KeyError):
+                stages = None
+
+            result[endpoint] = {
+                "collection": collection,
+                "stages": stages,
+                "collscan": None if stages is None else "COLLSCAN" in stages,
+            }
+            if result[endpoint]["collscan"]:
+                l.warning(f"{endpoint} runs a collection scan on {collection}.")
+
+        return result
+
+    def _bulk_write(self, collection, operations: List) -> Dict:
+        """
+        Sends write operations as unordered bulk_write batches of write_chunk_size.
+        Returns how many documents were matched, modified and upserted across all batches.
+        """
+        result = {"matched": 0, "modified": 0, "upserted": 0}
+        for i in range(0, len(operations), self.write_chunk_size):
+            r = collection.bulk_write(operations[i : i + self.write_chunk_size], ordered=False)
+            result["matched"] += r.matched_count
+            result["modified"] += r.modified_count
+            result["upserted"] += r.upserted_count
+
+        return result
+
     # Metadata Reading endpoints
     def get_config(self, storm_name: str) -> Dict:
         """
@@ -73,51 +267,191 @@ class StormDB:
 
         return [x["name"] for x in r]
 
-    def get_last_run(self, storm_name: str) -> Dict:
+    def get_last_run(self, storm_name: str, fields: List[str]=None) -> Dict:
         """
-        returns the run_record from last storm run under a given name
+        returns the run_record from last storm run under a given name,
+        optionally only the given fields. One indexed, sorted lookup.
         """
         q = {"storm_name": storm_name}
-        cols = {"_id": 0}
-        r = list(self._runs.find(q, cols))
+        cols = self._run_projection(fields, {})
+        r = list(self._runs.find(q, cols).sort([("run_date", DESCENDING), ("_id", DESCENDING)]).limit(1))
 
         if len(r) == 0:
             return None
-        elif len(r) > 0:
-            max_run_idx = np.argmax(
-                np.array([dt.datetime.strptime(x["run_date"], "%Y-%m-%d") for x in r])
-            )
-            return r[max_run_idx]
+        else:
+            run = self._expand_run(r[0], fields)
+            if fields is None or "_id" not in fields:
+                del run["_id"]
+            return run
 
-    def get_runs_by_storm(self, storm_name: str) -> List[Dict]:
+    def get_runs_by_storm(self, storm_name: str, fields: List[str]=None) -> List[Dict]:
         """
-        Will Return all run records for a storm (and all fields)
+        Will Return all run records for a storm (and all fields but config unless fields are given),
+        oldest first.
         """
 
         q = {"storm_name": storm_name}
-        cols = {"config": 0}
-        r = list(self._runs.find(q, cols))
+        cols = self._run_projection(fields, {"config": 0})
+        r = [self._expand_run(x, fields) for x in self._runs.find(q, cols).sort([("run_date", ASCENDING), ("_id", ASCENDING)])]
 
         if len(r) == 0:
             return None
         else:
             return r
 
+    @staticmethod
+    def _run_projection(fields: List[str], default: Dict) -> Dict:
+        """
+        Projection for run reads, the _id and compaction info are needed to expand compacted fields.
+        """
+        if fields is None:
+            return default if len(default) > 0 else None
+
+        return {"_id": 1, "compacted": 1, **{x: 1 for x in fields}}
+
+    def _expand_run(self, run: Dict, fields: List[str]=None) -> Dict:
+        """
+        Reads the compacted fields of a run record (the requested ones) back from their chunks.
+        """
+        compacted = run.pop("compacted", {})
+        for field in compacted:
+            if fields is None or field in fields:
+                run[field] = self._read_run_chunks(run["_id"], field)
+
+        return run
+
+    def _read_run_chunks(self, run_id, field: str) -> List:
+        """
+        Values of a compacted run field, JSON chunks or int32 codes into the run's id table.
+        """
+        q = {"run_id": run_id, "field": field}
+        values = []
+        table = None
+        for chunk in self._run_chunks.find(q).sort("n", ASCENDING):
+            data = zlib.decompress(chunk["data"])
+            if chunk.get("encoding") == "codes":
+                table = self._read_run_id_table(run_id) if table is None else table
+                values.extend(table.decode(np.frombuffer(data, dtype="<i4")))
+            else:
+                values.extend(json.loads(data))
+
+        return values
+
+    def _read_run_id_table(self, run_id) -> IdTable:
+        chunk = self._run_chunks.find_one({"_id": f"{run_id}:{self.RUN_ID_TABLE}:0"})
+        return IdTable.unpack(chunk["data"]) if chunk is not None else IdTable()
+
+    def _write_run_chunks(self, run_id, field: str, values: List) -> int:
+        """
+        Stores a run field as zlib compressed chunks of run_chunk_size values, returns the chunk count.
+        IdSets are stored as their int32 codes, the run's id table is written by _write_run_id_table.
+        """
+        self._run_chunks.delete_many({"run_id": run_id, "field": field})
+
+        if isinstance(values, IdSet):
+            encoding = "codes"
+            codes = values.codes.astype("<i4")
+            encode = lambda i: codes[i : i + self.run_chunk_size].tobytes()
+        else:
+            encoding = "json"
+            values = list(values)
+            encode = lambda i: json.dumps(values[i : i + self.run_chunk_size]).encode()
+
+        chunks = [
+            {
+                "_id": f"{run_id}:{field}:{n}",
+                "run_id": run_id,
+                "field": field,
+                "n": n,
+                "encoding": encoding,
+                "data": Binary(zlib.compress(encode(i))),
+            }
+            for n, i in enumerate(range(0, len(values), self.run_chunk_size))
+        ]
+        if len(chunks) > 0:
+            self._run_chunks.insert_many(chunks)
+
+        return len(chunks)
+
+    def _write_run_id_table(self, run_id, table: IdTable) -> None:
+        """
+        Stores the ids codes of a run's fields refer to, one chunk holding them all newline separated.
+        """
+        chunk = {"_id": f"{run_id}:{self.RUN_ID_TABLE}:0", "run_id": run_id, "field": self.RUN_ID_TABLE, "n": 0,
+                 "encoding": "ids", "data": Binary(table.pack())}
+        self._run_chunks.replace_one({"_id": chunk["_id"]}, chunk, upsert=True)
+
+    def _compact_run(self, run_record: Dict) -> Dict:
+        """
+        Moves the bulky array fields of a run record to chunks, returns the slim record to store.
+        """
+        run_record.setdefault("_id", ObjectId())
+        slim = {k: v for k, v in run_record.items() if k not in self.RUN_CHUNKED_FIELDS}
+        slim["compacted"] = {
+            field: self._write_run_chunks(run_record["_id"], field, run_record[field])
+            for field in self.RUN_CHUNKED_FIELDS
+            if field in run_record
+        }
+
+        tables = {id(x.table): x.table for x in run_record.values() if isinstance(x, IdSet)}
+        if len(tables) > 1:
+            raise ValueError("Run record fields use different id tables.")
+        for table in tables.values():
+            self._write_run_id_table(run_record["_id"], table)
+
+        return slim
+
+    @staticmethod
+    def _plain_run(run_record: Dict) -> Dict:
+        """
+        The run record with any IdSet fields as lists, as stored inline.
+        """
+        return {k: v.tolist() if isinstance(v, IdSet) else v for k, v in run_record.items()}
+
     # Metadata Write Endpoints
-    def write_run_record(self, run_record: Dict) -> None:
+    def write_run_record(self, run_record: Dict, compact: bool=False) -> None:
         """
-        Adds new run record (for use after storm run)
+        Adds new run record (for use after storm run).
+        Compacted records keep their bulky track and artist arrays in run_chunks,
+        IdSet fields (see RunRecord) as int32 codes into the run's id table stored beside them.
         """
+        if compact:
+            run_record = self._compact_run(run_record)
 
-        q = {}
-        self._runs.insert_one(run_record)
+        self._runs.insert_one(self._plain_run(run_record))
 
     def update_run_record(self, run_record: Dict) -> None:
         """
-        Updates existing run record
+        Updates existing run record, fields the record keeps compacted are rewritten as chunks
         """
         q = {"_id": run_record["_id"]}
-        self._runs.update_one(q, {"$set": run_record})
+        existing = self._runs.find_one(q, {"compacted": 1}) or {}
+        compacted = existing.get("compacted", {})
+
+        update = {k: v for k, v in self._plain_run(run_record).items() if k not in compacted and k != "_id"}
+        for field in compacted:
+            if field in run_record:
+                update[f"compacted.{field}"] = self._write_run_chunks(run_record["_id"], field, list(run_record[field]))
+
+        self._runs.update_one(q, {"$set": update})
+
+    def compact_runs(self, storm_name: str=None) -> int:
+        """
+        Compacts stored run records that still hold their bulky arrays inline.
+        Returns the number of runs compacted.
+        """
+        q = {"compacted": {"$exists": False}}
+        if storm_name is not None:
+            q["storm_name"] = storm_name
+
+        run_ids = [x["_id"] for x in self._runs.find(q, {"_id": 1})]
+        for run_id in run_ids:
+            run = self._runs.find_one({"_id": run_id})
+            slim = self._compact_run(run)
+            unset = {x: "" for x in self.RUN_CHUNKED_FIELDS if x in run}
+            self._runs.update_one({"_id": run_id}, {"$set": {"compacted": slim["compacted"]}, **({"$unset": unset} if unset else {})})
+
+        return len(run_ids)
 
     # Playlist Reading Endpoints
     def get_playlists(self, name: bool=False) -> List[int]:
@@ -180,6 +514,14 @@ class StormDB:
         else:
             raise Exception("Playlist Ambiguous, should be unique to table.")
 
+    def get_playlist_state(self, playlist_id: str) -> Dict:
+        """
+        Returns a playlists stored snapshot_id, tracks and artists, None if it was never loaded.
+        """
+        q = {"_id": playlist_id}
+        cols = {"info.snapshot_id": 1, "tracks": 1, "artists": 1}
+        return self._playlists.find_one(q, cols)
+
     def get_loaded_playlist_tracks(self, playlist_id: str) -> List[str]:
         """
         Returns a playlists most recently collected tracks
@@ -207,36 +549,61 @@ class StormDB:
             return r[0]["artists"]
 
     # Playlist Write Endpoints
-    def update_playlist(self, playlist_record: Dict) -> None:
+    def update_playlist(self, playlist_record: Dict, changelog_update: Dict=None) -> None:
+        """
+        Writes a playlist's current record and adds its changelog entry under the collection date.
+        The entry defaults to the full track list, incremental loads pass the added/removed delta.
+        """
 
         q = {"_id": playlist_record["_id"]}
 
         # Add new entry or update existing one
-        record = playlist_record
-        changelog_update = {
-            "snapshot": playlist_record["info"]["snapshot_id"],
-            "tracks": playlist_record["tracks"],
-        }
+        if changelog_update is None:
+            changelog_update = {
+                "snapshot": playlist_record["info"]["snapshot_id"],
+                "tracks": playlist_record["tracks"],
+            }
+
+        # Update static fields and append the changelog (date as new key) in one write
+        self._playlists.update_one(
+            q,
+            {
+                "$set": {
+                    **playlist_record,
+                    f"changelog.{playlist_record['last_collected']}": changelog_update,
+                }
+            },
+            upsert=True,
+        )
+
+    def update_playlist_collection_date(self, playlist_id: str, date: str) -> None:
+        """
+        Marks a playlist as collected without changing its contents.
+        """
+        q = {"_id": playlist_id}
+        self._playlists.update_one(q, {"$set": {"last_collected": date}})
 
-        # Update static fields
-        exclude_keys = ["changelog"]
-        update_dict = {
-            k: playlist_record[k]
-            for k in set(list(playlist_record.keys())) - set(exclude_keys)
-        }
-        self._playlists.update_one(q, {"$set": record}, upsert=True)
+    # Playlist Index Endpoints
+    def get_playlist_index(self, user_id: str, max_age: int=3600) -> Dict[str, str]:
+        """
+        A user's stored playlist name -> id index, None when there is none or it is older than max_age seconds.
+        """
+        record = self._playlist_index.find_one({"_id": user_id})
+        if record is None or dt.datetime.now() - record["updated"] > dt.timedelta(seconds=max_age):
+            return None
 
-        # Push to append fields (date as new key)
-        for key in exclude_keys:
-            self._playlists.update_one(
-                q,
-                {
-                    "$set": {
-                        f"{key}.{playlist_record['last_collected']}": changelog_update
-                    }
-                },
-                upsert=True,
-            )
+        return {x["name"]: x["id"] for x in record["playlists"]}
+
+    def update_playlist_index(self, user_id: str, playlist_ids: Dict[str, str]) -> None:
+        """
+        Stores a user's playlist name -> id index, as a list since names may hold characters keys can't.
+        """
+        record = {
+            "_id": user_id,
+            "updated": dt.datetime.now(),
+            "playlists": [{"name": k, "id": v} for k, v in playlist_ids.items()],
+        }
+        self._playlist_index.replace_one({"_id": user_id}, record, upsert=True)
 
     # Artist Reading Endpoints
     def get_known_artist_ids(self) -> List[str]:
@@ -250,23 +617,17 @@ class StormDB:
 
         return [x["_id"] for x in r]
 
-    def get_artists_for_album_collection(self, max_date: str) -> List[str]:
+    def get_artists_for_album_collection(self, max_date: str, artists: List[str]=None) -> Iterator[str]:
         """
-        returns all artists with album collection dates before max_date.
+        returns all artists with album collection dates before max_date (or never collected),
+        optionally limited to a list of artists. Filtered server side and streamed.
         """
-        q = {}
-        cols = {"_id": 1, "album_last_collected": 1}
-        r = list(self._artists.find(q, cols))
+        q = {"album_last_collected": {"$not": {"$gte": max_date}}}
+        if artists is not None:
+            q["_id"] = {"$in": list(artists)}
+        cols = {"_id": 1}
 
-        # Only append artists who need collection in result
-        result = []
-        for artist in r:
-            if "album_last_collected" in artist.keys():
-                if artist["album_last_collected"] < max_date:
-                    result.append(artist["_id"])
-            else:
-                result.append(artist["_id"])
-        return result
+        return (x["_id"] for x in self._artists.find(q, cols))
 
     def get_artists_by_genres(self, genres: List[str]) -> List[str]:
         """
@@ -279,33 +640,38 @@ class StormDB:
         return [x["_id"] for x in r]
 
     # Arist Write Endpoints
-    def update_artists(self, artist_info_list: List[Dict]) -> None:
+    def update_artists(self, artist_info_list: List[Dict]) -> Dict:
         """
         Updates artist db with list of new artist info
         """
+        today = dt.datetime.now().strftime("%Y-%m-%d")
 
-        for artist in tqdm(artist_info_list):
+        operations = []
+        for artist in artist_info_list:
             q = {"_id": artist["id"]}
 
             # Writing updates (formatting changes)
-            artist["last_updated"] = dt.datetime.now().strftime("%Y-%m-%d")
+            artist["last_updated"] = today
             artist["total_followers"] = artist["followers"]["total"]
             del artist["followers"]
             del artist["id"]
 
-            self._artists.update_one(q, {"$set": artist}, upsert=True)
+            operations.append(UpdateOne(q, {"$set": artist}, upsert=True))
 
-    def update_artist_album_collected_date(self, artist_ids: List[str], date: str=None) -> None:
+        return self._bulk_write(self._artists, operations)
+
+    def update_artist_album_collected_date(self, artist_ids: List[str], date: str=None) -> Dict:
         """
         Updates a list of artists album_collected date to today by default.
         """
         date = dt.datetime.now().strftime("%Y-%m-%d") if date is None else date
 
-        for artist_id in tqdm(artist_ids):
-            q = {"_id": artist_id}
-            self._artists.update_one(
-                q, {"$set": {"album_last_collected": date}}, upsert=True
-            )
+        operations = [
+            UpdateOne({"_id": artist_id}, {"$set": {"album_last_collected": date}}, upsert=True)
+            for artist_id in artist_ids
+        ]
+
+        return self._bulk_write(self._artists, operations)
 
     # Blacklist Read Enpoints
     def get_blacklist(self, name: str) -> List[str]:
@@ -317,15 +683,14 @@ class StormDB:
         return list(self._blacklists.find(q, cols))
 
     # Blacklist Write Endpoints
-    def update_blacklist(self, blacklist_name: str, artists: List[str]) -> None:
+    def update_blacklist(self, blacklist_name: str, artists: List[str]) -> Dict:
         """
         updates a blacklists artists given its name
         """
         q = {"_id": blacklist_name}
-        [
-            self._blacklists.update_one(q, {"$addToSet": {"blacklist": x}})
-            for x in artists
-        ]
+        operations = [UpdateOne(q, {"$addToSet": {"blacklist": {"$each": list(artists)}}})]
+
+        return self._bulk_write(self._blacklists, operations)
 
     # Album Read Endpoints
     def get_albums_by_release_date(self, start_date: str, end_date: str) -> List[str]:
@@ -338,20 +703,18 @@ class StormDB:
 
         return [x["_id"] for x in r]
 
-    def get_albums_for_track_collection(self) -> List[str]:
+    def get_albums_for_track_collection(self, albums: List[str]=None) -> Iterator[str]:
         """
-        Get all albums that need tracks added.
+        Get all albums that need tracks added, optionally limited to a list of albums.
+        Filtered server side and streamed.
         """
-        q = {}
-        cols = {"_id": 1, "tracks": 1}
-        r = list(self._albums.find(q, cols))
+        # Albums that never had tracks collected, an album the API returned no tracks for keeps its empty list
+        q = {"tracks": {"$exists": False}}
+        if albums is not None:
+            q["_id"] = {"$in": list(albums)}
+        cols = {"_id": 1}
 
-        # Only append artists who need collection in result
-        result = []
-        for album in r:
-            if "tracks" not in album.keys():
-                result.append(album["_id"])
-        return result
+        return (x["_id"] for x in self._albums.find(q, cols))
 
     def get_albums_from_artists_by_date(self, artists: List[str], start_date: str, end_date: str) -> List[str]:
         """
@@ -396,20 +759,24 @@ class StormDB:
         return result
 
     # Album Write Endpoints
-    def update_albums(self, album_info: List) -> None:
+    def update_albums(self, album_info: List) -> Dict:
         """
         update album info if needed.
         """
+        today = dt.datetime.now().strftime("%Y-%m-%d")
 
+        operations = []
         for album in album_info:
             if isinstance(album, dict):
                 q = {"_id": album["id"]}
 
                 # Writing updates (formatting changes)
-                album["last_updated"] = dt.datetime.now().strftime("%Y-%m-%d")
+                album["last_updated"] = today
                 del album["id"]
 
-                self._albums.update_one(q, {"$set": album}, upsert=True)
+                operations.append(UpdateOne(q, {"$set": album}, upsert=True))
+
+        return self._bulk_write(self._albums, operations)
 
     def remove_albums(self, album_ids: List[str]) -> None:
         """
@@ -432,25 +799,16 @@ class StormDB:
         # Only append artists who need collection in result
         return [x["_id"] for x in r]
 
-    def get_tracks_for_audio_analysis(self) -> List[str]:
+    def get_tracks_for_audio_analysis(self, max_attempts: int=None) -> Iterator[str]:
         """
-        Get all tracks that need audio analysis added.
+        Get all tracks that need audio analysis added, filtered server side and streamed.
+        Tracks whose analysis failed max_attempts times (AUDIO_ANALYSIS_ATTEMPTS by default) are left out.
         """
-        
-        l.debug("Finding Tracks without audio analysis, this can take some time.")
-        q = {}
-        cols = {"_id": 1, "audio_analysis_flag": 1}
-        r = list(self._tracks.find(q, cols))
+        max_attempts = self.AUDIO_ANALYSIS_ATTEMPTS if max_attempts is None else max_attempts
+        q = {"audio_analysis_flag": {"$ne": True}, "audio_analysis_attempts": {"$not": {"$gte": max_attempts}}}
+        cols = {"_id": 1}
 
-        # Only append artists who need collection in result
-        result = []
-        for track in r:
-            if "audio_analysis_flag" not in track.keys():
-                result.append(track["_id"])
-            else:
-                if not track["audio_analysis_flag"]:
-                    result.append(track["_id"])
-        return result
+        return (x["_id"] for x in self._tracks.find(q, cols))
 
     def get_tracks_from_albums(self, albums: List[str]) -> List[str]:
         """
@@ -473,6 +831,32 @@ class StormDB:
             return []  # not good, for downstream bug fixing
             raise ValueError(f"Track {track} not found or doesn't have any artists.")
 
+    def get_track_artists_map(self, tracks: List[str], resolved: bool=False) -> Dict[str, List[str]]:
+        """
+        Returns track -> artist ids for every known track in the list, in bulk.
+        With resolved, tracks missing from the tracks collection are looked up in the
+        artists previously resolved from the API (see update_track_artists).
+        """
+        result = {x["_id"]: x.get("artists", []) for x in self.get_track_info(tracks, {"_id": 1, "artists": 1})}
+
+        missing = [x for x in tracks if x not in result]
+        if resolved and len(missing) > 0:
+            q = {"_id": {"$in": missing}}
+            result.update({x["_id"]: x["artists"] for x in self._track_artists.find(q)})
+
+        return result
+
+    def update_track_artists(self, track_artists: Dict[str, List[str]]) -> Dict:
+        """
+        Stores API resolved track -> artist ids for tracks storm hasn't collected.
+        """
+        operations = [
+            UpdateOne({"_id": track}, {"$set": {"artists": artists}}, upsert=True)
+            for track, artists in track_artists.items()
+        ]
+
+        return self._bulk_write(self._track_artists, operations)
+
     def get_tracks(self) -> List[str]:
         """
         Returns a list of all tracks in the database.
@@ -489,6 +873,9 @@ class StormDB:
         Done in batches as it is a large database.
         """
 
+        if len(track_ids) == 0:
+            return []
+
         # Check if needs to be done in batches
         id_lim = 50000
         batches = np.array_split(track_ids, int(np.ceil(len(track_ids) / id_lim)))
@@ -512,65 +899,184 @@ class StormDB:
         
         return tracks
 
+    def get_eligible_tracks(self, artists: List[str], start_date: str, end_date: str, fields: Dict={"_id": 1, "album_id": 1}):
+        """
+        Streams the tracks on albums by any of the artists released in (start_date, end_date].
+        Done in a single aggregation (albums in window -> their tracks) so neither the
+        album list nor a giant $in array ever leaves the server. fields projects each track.
+        """
+        pipeline = [
+            {"$match": {"artists": {"$in": list(artists)}, "release_date": {"$gt": start_date, "$lte": end_date}}},
+            {"$project": {"_id": 1}},
+            # $lookup directly followed by $unwind is coalesced by the server, the joined array is never built
+            {"$lookup": {"from": self._tracks.name, "localField": "_id", "foreignField": "album_id", "as": "track"}},
+            {"$unwind": "$track"},
+            {"$replaceRoot": {"newRoot": "$track"}},
+            {"$project": fields},
+        ]
+
+        return self._albums.aggregate(pipeline, allowDiskUse=True)
+
     # Track Write Endpoints
-    def update_tracks(self, track_info_list: List[Dict]) -> None:
+    def update_tracks(self, track_info_list: List[Dict]) -> Dict:
         """
         Updates a track and its album frm a list.
+        Album track lists get a single grouped push per album.
+        Returns the write counts for both collections, {"albums": {...}, "tracks": {...}}.
         """
+        today = dt.datetime.now().strftime("%Y-%m-%d")
 
+        album_tracks = {}
+        track_operations = []
         for track in track_info_list:
 
             # Add track to album record
-            q = {"_id": track["album_id"]}
-            self._albums.update_one(q, {"$push": {"tracks": track["id"]}}, upsert=True)
+            album_tracks.setdefault(track["album_id"], []).append(track["id"])
 
             # Add track data to tracks
             q = {"_id": track["id"]}
-            track["last_updated"] = dt.datetime.now().strftime("%Y-%m-%d")
+            track["last_updated"] = today
             del track["id"]
-            self._tracks.update_one(q, {"$set": track}, upsert=True)
+            track_operations.append(UpdateOne(q, {"$set": track}, upsert=True))
+
+        album_operations = [
+            UpdateOne({"_id": album_id}, {"$push": {"tracks": {"$each": tracks}}}, upsert=True)
+            for album_id, tracks in album_tracks.items()
+        ]
+
+        return {
+            "albums": self._bulk_write(self._albums, album_operations),
+            "tracks": self._bulk_write(self._tracks, track_operations),
+        }
 
-    def update_track_features(self, tracks: List[Dict]) -> None:
+    def _update_track_flags(self, tracks: List[Dict], flags: Dict) -> Dict:
         """
-        Updates a track's record with audio features
+        Upserts track records with flags marking what has been collected for them.
         """
+        today = dt.datetime.now().strftime("%Y-%m-%d")
+
+        operations = []
         for track in tracks:
             q = {"_id": track["id"]}
 
             # Writing updates (formatting changes)
-            track["audio_features"] = True
-            track["last_updated"] = dt.datetime.now().strftime("%Y-%m-%d")
+            track.update(flags)
+            track["last_updated"] = today
             del track["id"]
 
-            self._tracks.update_one(q, {"$set": track}, upsert=True)
+            operations.append(UpdateOne(q, {"$set": track}, upsert=True))
+
+        return self._bulk_write(self._tracks, operations)
 
-    def update_track_analysis(self, tracks: List[Dict]) -> None:
+    def update_track_features(self, tracks: List[Dict]) -> Dict:
         """
-        Updates a track's record with audio features
+        Updates a track's record with audio features, and the feature store when there is one
         """
-        for track in tracks:
-            q = {"_id": track["id"]}
+        if self.feature_store is not None:
+            self.feature_store.append(tracks)
 
-            # Writing updates (formatting changes)
-            track["audio_analysis_flag"] = True
-            track["last_updated"] = dt.datetime.now().strftime("%Y-%m-%d")
-            del track["id"]
+        return self._update_track_flags(tracks, {"audio_features": True})
+
+    def update_track_analysis(self, tracks: List[Dict]) -> Dict:
+        """
+        Stores tracks' audio analysis packed in the audio_analysis collection,
+        the track records only get the flag so they stay small.
+        """
+        operations = [
+            UpdateOne({"_id": x["id"]}, {"$set": pack_audio_analysis(x["id"], x["audio_analysis"])}, upsert=True)
+            for x in tracks
+        ]
+        analysis = self._bulk_write(self._audio_analysis, operations)
+
+        flags = self._update_track_flags([{"id": x["id"]} for x in tracks], {"audio_analysis_flag": True})
+        return {"audio_analysis": analysis, "tracks": flags}
+
+    def record_track_analysis_failures(self, track_ids: List[str]) -> Dict:
+        """
+        Counts a failed audio analysis request against each track, so tracks the API
+        can't analyse (404s, malformed payloads) stop being requested after a few tries.
+        """
+        today = dt.datetime.now().strftime("%Y-%m-%d")
+        operations = [
+            UpdateOne({"_id": x}, {"$inc": {"audio_analysis_attempts": 1}, "$set": {"last_updated": today}})
+            for x in track_ids
+        ]
+        return self._bulk_write(self._tracks, operations)
+
+    def get_track_audio_analysis(self, track_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Returns track -> {"segments", "pitches", "timbre", "sections"} float32 matrices
+        for the tracks with a stored audio analysis.
+        """
+        q = {"_id": {"$in": list(track_ids)}}
+        return {x["_id"]: unpack_audio_analysis(x) for x in self._audio_analysis.find(q)}
+
+    def migrate_track_analysis(self, batch_size: int=500) -> int:
+        """
+        Moves audio analysis blobs embedded in track records into the packed collection.
+        Returns the number of tracks migrated.
+        """
+        q = {"audio_analysis": {"$exists": True}}
+        cols = {"_id": 1, "audio_analysis": 1}
 
-            self._tracks.update_one(q, {"$set": track}, upsert=True)
+        migrated = 0
+        while True:
+            batch = list(self._tracks.find(q, cols).limit(batch_size))
+            if len(batch) == 0:
+                return migrated
 
-    def update_bad_track_features(self, bad_tracks: List[str]) -> None:
+            self.update_track_analysis([{"id": x["_id"], "audio_analysis": x["audio_analysis"]} for x in batch])
+            self._tracks.update_many({"_id": {"$in": [x["_id"] for x in batch]}}, {"$unset": {"audio_analysis": ""}})
+            migrated += len(batch)
+
+    def update_bad_track_features(self, bad_tracks: List[Dict]) -> Dict:
         """
         If tracks that can't get features are identified, mark them here
         """
-        for track in tqdm(bad_tracks):
-            q = {"_id": track["id"]}
+        return self._update_track_flags(bad_tracks, {"audio_features": False})
 
-            # Writing updates (formatting changes)
-            track["audio_features"] = False
-            track["last_updated"] = dt.datetime.now().strftime("%Y-%m-%d")
-            del track["id"]
+    def export_feature_store(self, feature_store: FeatureStore=None, batch_size: int=50000) -> int:
+        """
+        Writes the audio features of every track that has them to the feature store (defaults to
+        the attached one) in batches, then compacts it. Returns the number of tracks exported.
+        """
+        feature_store = self.feature_store if feature_store is None else feature_store
+
+        q = {"audio_features": True}
+        cols = {"_id": 1, **{x: 1 for x in feature_store.columns}}
 
-            self._tracks.update_one(q, {"$set": track}, upsert=True)
+        exported = 0
+        batch = []
+        for track in self._tracks.find(q, cols):
+            batch.append(track)
+            if len(batch) == batch_size:
+                exported += feature_store.append(batch)
+                batch = []
+        exported += feature_store.append(batch)
+
+        feature_store.compact()
+        return exported
+
+    # Pipeline Checkpoint Endpoints
+    def get_pipeline_checkpoint(self, run_id: str) -> Dict:
+        """
+        Returns the stage progress of an ingest pipeline run, {} if it never started.
+        """
+        r = self._checkpoints.find_one({"_id": run_id}, {"stages": 1})
+        return {} if r is None else r["stages"]
+
+    def update_pipeline_checkpoint(self, run_id: str, stage: str, processed: int, done: bool=False) -> None:
+        """
+        Records how far a pipeline stage got, incrementing its processed count.
+        """
+        self._checkpoints.update_one(
+            {"_id": run_id},
+            {
+                "$inc": {f"stages.{stage}.processed": processed},
+                "$set": {f"stages.{stage}.done": done, f"stages.{stage}.updated": dt.datetime.now()},
+            },
+            upsert=True,
+        )
 
     # DB Cleanup and Prep / other
     def filter_tracks_by_audio_feature(self, tracks: List[str], audio_filter: Dict) -> List[str]:
@@ -583,83 +1089,169 @@ class StormDB:
 
         return [x["_id"] for x in r]
 
-    def update_artist_albums(self) -> None:
+    def update_artist_albums(self) -> Dict:
         """
-        Adds a track list to each artist or appends if not there
+        Adds each album not yet linked to its artists' album lists.
+        Only unlinked albums are read, the links are written in bulk per artist.
         """
 
-        q = {}
-        cols = {"_id": 1, "added_to_artists": 1, "artists": 1}
-        r = list(self._albums.find(q, cols))
+        q = {"added_to_artists": {"$ne": True}}
+        cols = {"_id": 1, "artists": 1}
 
-        for album in r:
-
-            if "added_to_artists" not in album.keys():
-                for artist in album["artists"]:
-                    self._artists.update_one(
-                        {"_id": artist},
-                        {"$addToSet": {"albums": album["_id"]}},
-                        upsert=True,
-                    )
-                self._albums.update_one(
-                    {"_id": album["_id"]}, {"$set": {"added_to_artists": True}}
-                )
-            else:
-                if not album["added_to_artists"]:
-                    for artist in album["artists"]:
-                        self._artists.update_one(
-                            {"_id": artist},
-                            {"$addToSet": {"albums": album["_id"]}},
-                            upsert=True,
-                        )
-                    self._albums.update_one(
-                        {"_id": album["_id"]}, {"$set": {"added_to_artists": True}}
-                    )
+        artist_albums = {}
+        album_ids = []
+        for album in self._albums.find(q, cols):
+            album_ids.append(album["_id"])
+            for artist in album.get("artists", []):
+                artist_albums.setdefault(artist, []).append(album["_id"])
+
+        artist_operations = [
+            UpdateOne({"_id": artist}, {"$addToSet": {"albums": {"$each": albums}}}, upsert=True)
+            for artist, albums in artist_albums.items()
+        ]
+        album_operations = [
+            UpdateMany({"_id": {"$in": album_ids[i : i + self.write_chunk_size]}}, {"$set": {"added_to_artists": True}})
+            for i in range(0, len(album_ids), self.write_chunk_size)
+        ]
+
+        return {
+            "artists": self._bulk_write(self._artists, artist_operations),
+            "albums": self._bulk_write(self._albums, album_operations),
+        }
 
     def gen_unique_track_id(self, track_name: str, artists: List[str]) -> str:
         """
         Generates a unique track-name based on the name and artists,
         avoids the same track being counted multiple times
         """
+        return track_name.translate(self.UNIQUE_NAME_TABLE) + "T&A" + "A&A".join(artists)
+
+    @classmethod
+    def gen_unique_track_uids(cls, track_names: List[str], artists: List[List[str]]) -> List[str]:
+        """
+        Fixed width (24 hex character) uids for many tracks at once,
+        the blake2b hash of each track's gen_unique_track_id key.
+        """
+        import pandas as pd
+
+        keys = pd.Series(track_names, dtype=object).fillna("").str.translate(cls.UNIQUE_NAME_TABLE)
+        keys = keys + "T&A" + pd.Series(["A&A".join(x) for x in artists], dtype=object)
 
-        bad_chars = ",. "
-        for char in bad_chars:
-            track_name = track_name.replace(char, "")
-        artist_string = "A&A".join(artists)
-        return track_name + "T&A" + artist_string
+        return [hashlib.blake2b(x.encode(), digest_size=12).hexdigest() for x in keys]
 
-    def dedup_tracks_on_name(self, updated_date: str="2021-01-01", tracks: List=[]) -> List[str]:
+    def dedup_tracks_on_name(self, updated_date: str=None, tracks: List=[]) -> Dict:
         """
         Copies the track database to the tracks_unique database.
         This database is dedicated to unique songs based on artist and name.
+        Incremental, by default only tracks updated since the last dedup are copied.
         """
+        today = dt.datetime.now().strftime("%Y-%m-%d")
+        cols = {"last_updated": 0, "audio_analysis": 0}
 
         # Get tracks that need moving if they weren't specified
-        if len(tracks) == 0:
+        if len(tracks) > 0:
+            q = {"_id": {"$in": [x["_id"] if isinstance(x, dict) else x for x in tracks]}}
+        else:
+            if updated_date is None:
+                last = self._utracks.find_one({}, {"dedup_date": 1}, sort=[("dedup_date", DESCENDING)])
+                updated_date = "2021-01-01" if last is None else last["dedup_date"]
             q = {"last_updated": {"$gte": updated_date}}
-            cols = {"_id": 1}
-            tracks = list(self._tracks.find(q, cols))
 
-        # Move them in batches
-        batch_size = 100
-        batches = np.array_split(tracks, int(np.ceil(len(tracks) / batch_size)))
+        # Upserted in bulk, chunk by chunk as the cursor streams
+        result = {"matched": 0, "modified": 0, "upserted": 0}
+        batch = []
+        for track_record in self._tracks.find(q, cols):
+            batch.append(track_record)
+            if len(batch) == self.write_chunk_size:
+                self._add_counts(result, self._upsert_unique_tracks(batch, today))
+                batch = []
+        self._add_counts(result, self._upsert_unique_tracks(batch, today))
 
-        for batch in tqdm(batches):
+        return result
 
-            q = {"_id": {"$in": [x["_id"] for x in batch.tolist()]}}
-            cols = {"_id": 0, "last_updated": 0}
-            r = list(self._tracks.find(q, cols))
+    def _upsert_unique_tracks(self, track_records: List[Dict], dedup_date: str) -> Dict:
+        uids = self.gen_unique_track_uids([x.get("name", "") for x in track_records], [x.get("artists", []) for x in track_records])
 
-            # Add track data to tracks
-            for track_record in r:
-                track_record["old_id"] = track_record["_id"]
-                track_record["_id"] = self.gen_unique_track_id(
-                    track_record["name"], track_record["artists"]
-                )
+        operations = []
+        for track_record, uid in zip(track_records, uids):
+            track_record["old_id"] = track_record.pop("_id")
+            track_record["uid"] = uid
+            track_record["dedup_date"] = dedup_date
+
+            q = {"_id": self.gen_unique_track_id(track_record.get("name", ""), track_record.get("artists", []))}
+            operations.append(UpdateOne(q, {"$set": track_record}, upsert=True))
+
+        return self._bulk_write(self._utracks, operations)
 
-                q = {"_id": track_record["_id"]}
-                track_record["dedup_date"] = dt.datetime.now().strftime("%Y-%m-%d")
-                self._utracks.update_one(q, {"$set": track_record}, upsert=True)
+    @staticmethod
+    def _add_counts(total: Dict, counts: Dict) -> None:
+        for k, v in counts.items():
+            total[k] += v
+
+    # Delivered Track Endpoints
+    def get_delivered_track_uids(self, storm_name: str, uids: List[str], since: str) -> List[str]:
+        """
+        The uids among uids a storm delivered after the since date, in one indexed lookup.
+        """
+        q = {"storm_name": storm_name, "uid": {"$in": list(uids)}, "last_delivered": {"$gt": since}}
+        cols = {"_id": 0, "uid": 1}
+
+        return [x["uid"] for x in self._delivered.find(q, cols)]
+
+    def delivered_tracks_backfilled(self, storm_name: str) -> bool:
+        """
+        Whether the storm's past runs were already read into delivered tracks, see backfill_delivered_tracks.
+        """
+        return self._delivered.find_one({"_id": f"{storm_name}:{self.DELIVERED_BACKFILL_MARKER}"}, {"_id": 1}) is not None
+
+    def ensure_delivered_tracks(self, storm_name: str) -> int:
+        """
+        Backfills a storm's delivered tracks unless it has been done, returns the number of runs read.
+        """
+        if self.delivered_tracks_backfilled(storm_name):
+            return 0
+
+        return self.backfill_delivered_tracks(storm_name)
+
+    def update_delivered_tracks(self, storm_name: str, uids: List[str], run_date: str) -> Dict:
+        """
+        Records a storm delivering track uids on run_date, keeping the first and last delivery dates.
+        """
+        operations = [
+            UpdateOne(
+                {"_id": f"{storm_name}:{uid}"},
+                {
+                    "$set": {"storm_name": storm_name, "uid": uid},
+                    "$min": {"first_delivered": run_date},
+                    "$max": {"last_delivered": run_date},
+                },
+                upsert=True,
+            )
+            for uid in uids
+        ]
+
+        return self._bulk_write(self._delivered, operations)
+
+    def backfill_delivered_tracks(self, storm_name: str) -> int:
+        """
+        Builds a storm's delivered tracks from the tracks of its past run records.
+        Returns the number of runs read.
+        """
+        runs = self.get_runs_by_storm(storm_name, ["run_date", "storm_tracks"]) or []
+
+        for run in runs:
+            tracks = self.get_track_info(run.get("storm_tracks", []), {"_id": 1, "name": 1, "artists": 1}) if len(run.get("storm_tracks", [])) > 0 else []
+            uids = self.gen_unique_track_uids([x.get("name", "") for x in tracks], [x.get("artists", []) for x in tracks])
+            self.update_delivered_tracks(storm_name, uids, run["run_date"])
+
+        # Marks the storm done even when its runs delivered nothing, so the history is only read once
+        self._delivered.update_one(
+            {"_id": f"{storm_name}:{self.DELIVERED_BACKFILL_MARKER}"},
+            {"$set": {"storm_name": storm_name, "backfilled_runs": len(runs)}},
+            upsert=True,
+        )
+
+        return len(runs)
 
     def gen_unique_run_tracks(self) -> None:
         """
@@ -667,20 +1259,19 @@ class StormDB:
         Updates Run Record directly
         """
 
+        from tqdm import tqdm
+
         storms = self.get_all_configs()
 
         for storm in tqdm(storms):
             print(f"Adding uids for {storm}")
-            runs = self.get_runs_by_storm(storm)
+            runs = self.get_runs_by_storm(storm, ["storm_tracks"]) or []
 
             for run in runs:
                 storm_tracks = self.get_track_info(
                     run["storm_tracks"], {"_id": 1, "name": 1, "artists": 1}
                 )
-                run["storm_tracks_uid"] = np.unique(
-                    [
-                        self.gen_unique_track_id(x["name"], x["artists"])
-                        for x in storm_tracks
-                    ]
+                uids = np.unique(
+                    self.gen_unique_track_uids([x["name"] for x in storm_tracks], [x["artists"] for x in storm_tracks])
                 ).tolist()
-                self.update_run_record(run)
+                self.update_run_record({"_id": run["_id"], "storm_tracks_uid": uids})
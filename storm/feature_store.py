@@ -0,0 +1,197 @@
+import glob
+import logging
+import os
+import threading
+import numpy as np
+
+from typing import List, Dict, Iterable
+
+l = logging.getLogger('storm.feature_store')
+
+# Audio feature columns kept in the store, in column order
+FEATURE_COLUMNS = [
+    "danceability",
+    "energy",
+    "key",
+    "loudness",
+    "mode",
+    "speechiness",
+    "acousticness",
+    "instrumentalness",
+    "liveness",
+    "valence",
+    "tempo",
+    "time_signature",
+    "duration_ms",
+]
+
+
+class FeatureStore:
+    """
+    Columnar on-disk store of track audio features.
+
+    Features are kept as append only segments, a float64 matrix (features_nnnnn.npy, the values
+    Mongo holds, so models score the same inputs either way) and its track ids (ids_nnnnn.npy),
+    memory mapped on read. Rows of later segments replace earlier rows
+    of the same track, so updates are appends. Lookups gather NumPy blocks straight from the
+    mapped segments without building per track records.
+    Expects a single writing process, readers pick up new segments on their next lookup and
+    remap the store once it was compacted under them.
+    """
+
+    def __init__(self, directory: str='./data/features', columns: List[str]=FEATURE_COLUMNS, max_segments: int=64):
+
+        self.directory = directory
+        self.columns = list(columns)
+        self.max_segments = max_segments  # appends past this many segments compact the store
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._segments = []  # mapped feature matrices
+        self._numbers = []  # file number of each mapped segment
+        self._index = {}  # track id -> (segment, row)
+        self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, track_id: str) -> bool:
+        return track_id in self._index
+
+    # Writing
+    def append(self, tracks: List[Dict]) -> int:
+        """
+        Adds (or replaces) the features of track records keyed by "id" or "_id" as a new segment.
+        Missing features are stored as NaN. Returns the number of rows written.
+        """
+        if len(tracks) == 0:
+            return 0
+
+        ids = np.array([x["id"] if "id" in x else x["_id"] for x in tracks])
+        features = np.array([[x.get(c, np.nan) for c in self.columns] for x in tracks], dtype=np.float64)
+
+        with self._lock:
+            self._refresh()
+            self._write_segment(self._next_segment(), ids, features)
+            self._refresh()
+
+            if len(self._segments) > self.max_segments:
+                self.compact()
+
+        return len(ids)
+
+    def compact(self) -> int:
+        """
+        Rewrites the store as a single segment holding the latest row of every track.
+        Returns the number of tracks kept.
+        """
+        with self._lock:
+            self._refresh()
+            if len(self._index) == 0:
+                return 0
+
+            ids = np.array(list(self._index.keys()))
+            features = self.lookup(ids)
+            old = self._segment_numbers()
+
+            self._write_segment(old[-1] + 1 if len(old) > 0 else 0, ids, features)
+            for n in old:
+                os.remove(self._path('features', n))
+                os.remove(self._path('ids', n))
+
+            self._segments = []
+            self._numbers = []
+            self._index = {}
+            self._refresh()
+
+        l.debug(f"Compacted {len(old)} segments into one of {len(ids)} tracks.")
+        return len(ids)
+
+    # Reading
+    def lookup(self, track_ids: Iterable[str], columns: List[str]=None) -> np.ndarray:
+        """
+        Returns the (len(track_ids), len(columns)) float64 feature block for the tracks,
+        in the given order. Tracks not in the store are NaN rows.
+        """
+        track_ids = list(track_ids)
+        cols = slice(None) if columns is None else [self.columns.index(x) for x in columns]
+
+        with self._lock:
+            self._refresh()
+
+            locations = np.array([self._index.get(x, (-1, -1)) for x in track_ids], dtype=np.int64).reshape(-1, 2)
+            block = np.full((len(track_ids), len(self.columns)), np.nan, dtype=np.float64)
+            for segment in np.unique(locations[:, 0]):
+                if segment < 0:
+                    continue
+                rows = locations[:, 0] == segment
+                block[rows] = self._segments[segment][locations[rows, 1]]
+
+        return block[:, cols]
+
+    def missing(self, track_ids: Iterable[str]) -> List[str]:
+        """
+        Tracks without a row in the store.
+        """
+        return [x for x in track_ids if x not in self._index]
+
+    def to_frame(self, track_ids: List[str], columns: List[str]=None) -> "pd.DataFrame":
+        """
+        Feature block as a DataFrame with an _id column, the shape models are scored on.
+        """
+        import pandas as pd
+
+        columns = self.columns if columns is None else columns
+        df = pd.DataFrame(self.lookup(track_ids, columns), columns=columns)
+        df.insert(0, '_id', track_ids)
+
+        return df
+
+    # Segment files
+    def _path(self, kind: str, n: int) -> str:
+        return os.path.join(self.directory, f"{kind}_{n:05d}.npy")
+
+    def _segment_numbers(self) -> List[int]:
+        files = glob.glob(os.path.join(self.directory, "ids_*.npy"))
+        return sorted(int(os.path.basename(x)[4:9]) for x in files)
+
+    def _next_segment(self) -> int:
+        numbers = self._segment_numbers()
+        return numbers[-1] + 1 if len(numbers) > 0 else 0
+
+    def _write_segment(self, n: int, ids: np.ndarray, features: np.ndarray) -> None:
+        """
+        Features first and each file swapped in whole, readers only pick up a segment once its ids exist.
+        """
+        for kind, data in [('features', features), ('ids', ids)]:
+            tmp = self._path(kind, n) + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmp, self._path(kind, n))
+
+    def _refresh(self) -> None:
+        """
+        Maps segments written since the last refresh (by this or another process) and indexes their ids.
+        Segments are tracked by file number, once a mapped one is gone (another store compacted)
+        the store is mapped again from scratch.
+        """
+        with self._lock:
+            numbers = self._segment_numbers()
+            if not set(self._numbers).issubset(numbers):
+                self._segments = []
+                self._numbers = []
+                self._index = {}
+
+            last = self._numbers[-1] if len(self._numbers) > 0 else -1
+            for n in [x for x in numbers if x > last]:
+                try:
+                    features = np.load(self._path('features', n), mmap_mode='r')
+                    ids = np.load(self._path('ids', n))
+                except FileNotFoundError:
+                    # Compacted away since listed, its rows are in the compacted segment numbered after it
+                    continue
+
+                segment = len(self._segments)
+                self._segments.append(features)
+                self._numbers.append(n)
+                self._index.update(zip(ids.tolist(), zip([segment] * len(ids), range(len(ids)))))
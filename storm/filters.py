@@ -0,0 +1,189 @@
+import logging
+import numpy as np
+from typing import List, Dict, Callable, Tuple, NamedTuple
+
+from .db import StormDB
+
+l = logging.getLogger('storm.filters')
+
+# Operators of the "op&&value" audio feature syntax, as comparisons against the feature
+AUDIO_FEATURE_OPERATORS = {
+    'gt': np.greater,
+    'gte': np.greater_equal,
+    'lt': np.less,
+    'lte': np.less_equal,
+    'eq': np.equal,
+    'ne': np.not_equal,
+}
+
+
+class AudioFeatureRule(NamedTuple):
+    """
+    A single audio feature filter, a track is kept when `feature op value` holds.
+    """
+    feature: str
+    op: str
+    value: float
+
+    @classmethod
+    def parse(cls, feature: str, spec: str) -> "AudioFeatureRule":
+        """
+        Parses the config syntax, e.g. ("energy", "gte&&0.5").
+        """
+        op, value = spec.split('&&')
+        if op not in AUDIO_FEATURE_OPERATORS:
+            raise ValueError(f"Unsupported audio feature operator {op} for {feature}.")
+        return cls(feature, op, float(value))
+
+    def to_query(self) -> Dict:
+        return {self.feature: {f"${self.op}": self.value}}
+
+
+def compile_audio_feature_filters(audio_features: Dict[str, str]) -> List[AudioFeatureRule]:
+    """
+    Compiles a config audio_features block into rules, once per storm.
+    """
+    return [AudioFeatureRule.parse(feature, spec) for feature, spec in audio_features.items()]
+
+
+def evaluate_audio_feature_filters(rules: List[AudioFeatureRule], track_records: List[Dict]) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Evaluates every rule in one vectorized pass over the prefetched feature matrix.
+    Returns the mask of tracks passing all rules and the rejection count per rule's feature.
+    Missing features are NaN, which fails every comparison except ne (as in Mongo).
+    """
+    features = [x.feature for x in rules]
+    matrix = np.array([[x.get(f) for f in features] for x in track_records], dtype=float).reshape(len(track_records), len(features))
+
+    keep = np.ones(len(track_records), dtype=bool)
+    rejections = {}
+    for i, rule in enumerate(rules):
+        with np.errstate(invalid='ignore'):
+            passed = AUDIO_FEATURE_OPERATORS[rule.op](matrix[:, i], rule.value)
+        rejections[rule.feature] = int((~passed).sum())
+        keep &= passed
+
+    return keep, rejections
+
+
+class StormFilterEngine:
+    """
+    Evaluates a storm's artist and track filters (config['filters']) with hash sets,
+    audio feature rules are compiled once and evaluated as a vectorized mask.
+    Track fields are prefetched in one bulk query, or handed in alongside the eligible
+    tracks, so no filter issues a query per track or per rule. Shared by StormRunner and FakeRunner.
+    """
+
+    def __init__(self, sdb: StormDB, filters: Dict, update_blacklist: Callable[[str, str], None]=None):
+
+        self.sdb = sdb
+        self.artist_filters = filters.get('artist', {})
+        self.track_filters = filters.get('track', {})
+
+        # Called with (blacklist name, playlist id) to refresh playlist backed blacklists
+        self.update_blacklist = update_blacklist
+
+        # Tracks rejected per track filter (audio features by feature name) in the last pass
+        self.rejections = {}
+
+    def apply_artist_filters(self, input_artists: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Returns the storm artists (input order kept) and the removed artists.
+        """
+        bad_artists = {}
+
+        l.debug(f"{len(self.artist_filters)} valid filters to apply")
+        for filter_name, filter_value in self.artist_filters.items():
+
+            l.debug(f"Attemping filter {filter_name} - {filter_value}")
+            if filter_name == 'genre':
+                # Add all known artists in sdb of a genre to remove in tracks later
+                bad_artists.update(dict.fromkeys(self.sdb.get_artists_by_genres(filter_value)))
+
+            elif filter_name == 'blacklist':
+                blacklist = self.sdb.get_blacklist(filter_value)
+                if len(blacklist) == 0:
+                    l.debug(f"{filter_value} not found, no filtering will be done.'")
+                    continue
+
+                if self.update_blacklist is not None and 'input_playlist' in blacklist[0].keys():
+                    l.debug("Updating Blacklist . . .")
+                    self.update_blacklist(blacklist[0]['_id'], blacklist[0]['input_playlist'])
+
+                    # Reload
+                    blacklist = self.sdb.get_blacklist(filter_value)
+                bad_artists.update(dict.fromkeys(blacklist[0]['blacklist']))
+
+            else:
+                l.debug(f"{filter_name} not supported or misspelled. ")
+
+        storm_artists = [x for x in input_artists if x not in bad_artists]
+        l.debug(f"Starting Artist Amount: {len(input_artists)}")
+        l.debug(f"Ending Artist Amount: {len(storm_artists)}")
+
+        return storm_artists, list(bad_artists)
+
+    def required_track_fields(self) -> Dict:
+        """
+        Projection of the track fields the configured track filters read.
+        """
+        fields = {'_id': 1}
+        if 'artist_filter' in self.track_filters:
+            fields['artists'] = 1
+        for rule in compile_audio_feature_filters(self.track_filters.get('audio_features', {})):
+            fields[rule.feature] = 1
+
+        return fields
+
+    def apply_track_filters(self, eligible_tracks: List[str], storm_artists: List[str], removed_artists: List[str],
+                            track_records: List[Dict]=None) -> Tuple[List[str], List[str]]:
+        """
+        Returns the storm tracks (eligible order kept) and the removed tracks.
+        track_records are the eligible track documents with required_track_fields,
+        they are fetched in one bulk query when not given.
+        Per filter rejection counts are kept in self.rejections.
+        """
+        if track_records is None:
+            track_records = self.sdb.get_track_info(eligible_tracks, self.required_track_fields())
+        records = {x['_id']: x for x in track_records}
+
+        bad_tracks = set()
+        self.rejections = {}
+
+        l.debug(f"{len(self.track_filters)} valid filters to apply")
+        for filter_name, filter_value in self.track_filters.items():
+
+            l.debug(f"Attemping filter {filter_name} - {filter_value} on {len(eligible_tracks)} Tracks.")
+            if filter_name == 'audio_features':
+                rules = compile_audio_feature_filters(filter_value)
+                keep, rejections = evaluate_audio_feature_filters(rules, [records.get(x, {}) for x in eligible_tracks])
+                bad_tracks.update(x for x, k in zip(eligible_tracks, keep) if not k)
+                self.rejections.update(rejections)
+                l.debug(f"Audio feature rejections {rejections}, cumulative Bad Tracks found {len(bad_tracks)}")
+
+            elif filter_name == "artist_filter":
+                if filter_value == 'hard':
+                    # Limits output to tracks that contain only storm artists
+                    valid_artists = set(storm_artists)
+                    rejected = [x for x in eligible_tracks if not valid_artists.issuperset(records.get(x, {}).get('artists', []))]
+
+                elif filter_value == 'soft':
+                    # Removes tracks that contain known filtered out artists
+                    # Other 'bad' artists could sneak in if not tracked by storm
+                    invalid_artists = set(removed_artists)
+                    rejected = [x for x in eligible_tracks if not invalid_artists.isdisjoint(records.get(x, {}).get('artists', []))]
+
+                else:
+                    rejected = []
+
+                bad_tracks.update(rejected)
+                self.rejections['artist_filter'] = len(rejected)
+
+            else:
+                l.debug(f"{filter_name} not supported or misspelled. ")
+
+        storm_tracks = [x for x in eligible_tracks if x not in bad_tracks]
+        l.debug(f"Starting Track Amount: {len(eligible_tracks)}")
+        l.debug(f"Ending Track Amount: {len(storm_tracks)}")
+
+        return storm_tracks, sorted(bad_tracks)
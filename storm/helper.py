@@ -6,3 +6,16 @@ def slow_print(string='', t=.01):
         sys.stdout.write(letter)
         time.sleep(t)
     sys.stdout.write('\n')
+
+_ENV_LOADED = False
+
+def load_env():
+    """
+    Loads the project's .env into the environment, once per process. Variables already set win.
+    Called where configuration is read rather than at import, so importing storm stays side effect free.
+    """
+    global _ENV_LOADED
+    if not _ENV_LOADED:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _ENV_LOADED = True
@@ -0,0 +1,325 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Iterator
+
+import bson
+from pymongo import monitoring
+
+l = logging.getLogger('storm.instrumentation')
+
+# Upper bounds (seconds) of the API latency histogram buckets, Prometheus style
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Calls and commands made outside any stage
+UNSTAGED = 'unstaged'
+
+
+class Instrumentation:
+    """
+    Per stage metrics of a storm run: wall time, Spotify calls per endpoint (latency histogram,
+    time spent waiting on the rate limiter, retries and throttles) and Mongo commands per
+    collection (documents and bytes each way). Calls and commands are attributed to the stage
+    running when they finish, whichever thread makes them.
+
+    Observes RequestSchedulers as one of their listeners and Mongo through MONGO_LISTENER,
+    which StormDB registers on the clients it builds.
+    """
+
+    def __init__(self, latency_buckets: tuple=LATENCY_BUCKETS):
+
+        self.latency_buckets = latency_buckets
+        self.stages = {}  # stage -> {'seconds', 'api': {endpoint: ...}, 'mongo': {collection: {command: ...}}}
+        self._stage = UNSTAGED
+        self._schedulers = []
+        self._lock = threading.Lock()
+
+    # Stages
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Times the block as a stage, calls made meanwhile count towards it.
+        """
+        previous = self._stage
+        self._stage = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self._get_stage(name)
+                stage['seconds'] += elapsed
+            self._stage = previous
+
+    def _get_stage(self, name: str) -> Dict:
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'api': {}, 'mongo': {}}
+        return self.stages[name]
+
+    # Sources
+    @contextmanager
+    def observing(self, *schedulers) -> Iterator["Instrumentation"]:
+        """
+        Records the API calls of the given RequestSchedulers and the Mongo commands
+        of instrumented clients while the block runs.
+        """
+        self.attach(*schedulers)
+        try:
+            yield self
+        finally:
+            self.detach()
+
+    def attach(self, *schedulers) -> None:
+        for scheduler in dict.fromkeys(x for x in schedulers if x is not None):
+            if self not in scheduler.listeners:
+                scheduler.listeners.append(self)
+                self._schedulers.append(scheduler)
+        MONGO_LISTENER.subscribe(self)
+
+    def detach(self) -> None:
+        for scheduler in self._schedulers:
+            if self in scheduler.listeners:
+                scheduler.listeners.remove(self)
+        self._schedulers = []
+        MONGO_LISTENER.unsubscribe(self)
+
+    # Recording
+    def api_call(self, endpoint: str, latency: float, wait: float=0.0, retries: int=0, throttled: int=0,
+                 failed: bool=False) -> None:
+        """
+        Records one RequestScheduler call: seconds spent in its attempts, seconds spent waiting
+        (rate limiter and backoff), and how many attempts were retried or throttled.
+        """
+        with self._lock:
+            stats = self._get_stage(self._stage)['api'].get(endpoint)
+            if stats is None:
+                stats = self._get_stage(self._stage)['api'][endpoint] = {
+                    'calls': 0, 'errors': 0, 'retries': 0, 'throttled': 0, 'seconds': 0.0, 'wait_seconds': 0.0,
+                    'buckets': [0] * (len(self.latency_buckets) + 1),
+                }
+
+            stats['calls'] += 1
+            stats['errors'] += int(failed)
+            stats['retries'] += retries
+            stats['throttled'] += throttled
+            stats['seconds'] += latency
+            stats['wait_seconds'] += wait
+            stats['buckets'][bisect.bisect_left(self.latency_buckets, latency)] += 1
+
+    def mongo_command(self, collection: str, command: str, seconds: float, documents: int=0,
+                      bytes_sent: int=0, bytes_received: int=0, failed: bool=False) -> None:
+        """
+        Records one Mongo command against a collection.
+        """
+        with self._lock:
+            commands = self._get_stage(self._stage)['mongo'].setdefault(collection, {})
+            stats = commands.get(command)
+            if stats is None:
+                stats = commands[command] = {
+                    'operations': 0, 'failures': 0, 'documents': 0, 'bytes_sent': 0, 'bytes_received': 0, 'seconds': 0.0,
+                }
+
+            stats['operations'] += 1
+            stats['failures'] += int(failed)
+            stats['documents'] += documents
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+            stats['seconds'] += seconds
+
+    # Reporting
+    def report(self) -> Dict:
+        """
+        The metrics as plain data, for the run record or JSON: per stage wall time,
+        api endpoint and mongo collection -> command stats. Latency histograms are
+        [bucket bound, cumulative count] pairs as in Prometheus (bounds are kept out of
+        keys, Mongo field names can't hold dots).
+        """
+        with self._lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                api = {}
+                for endpoint, stats in stage['api'].items():
+                    api[endpoint] = {k: v for k, v in stats.items() if k != 'buckets'}
+                    api[endpoint]['latency_histogram'] = self._cumulative(stats['buckets'])
+
+                stages[name] = {
+                    'seconds': stage['seconds'],
+                    'api': api,
+                    'mongo': {c: {k: dict(v) for k, v in commands.items()} for c, commands in stage['mongo'].items()},
+                }
+
+        return {'seconds': sum(x['seconds'] for x in stages.values()), 'stages': stages}
+
+    def _cumulative(self, buckets: List[int]) -> List[list]:
+        histogram = []
+        total = 0
+        for bound, count in zip([str(x) for x in self.latency_buckets] + ['+Inf'], buckets):
+            total += count
+            histogram.append([bound, total])
+        return histogram
+
+    def to_prometheus(self, labels: Dict[str, str]=None) -> str:
+        """
+        The metrics in the Prometheus text exposition format, e.g. for node_exporter's textfile collector.
+        """
+        report = self.report()
+        labels = labels or {}
+        lines = []
+
+        def metric(name: str, kind: str, help: str, samples: List[tuple]) -> None:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, sample_labels, value in samples:
+                lines.append(f"{name}{suffix}{_labels({**labels, **sample_labels})} {value}")
+
+        stages = report['stages']
+        api = [(s, e, x) for s, stage in stages.items() for e, x in stage['api'].items()]
+        mongo = [(s, c, k, x) for s, stage in stages.items() for c, commands in stage['mongo'].items() for k, x in commands.items()]
+
+        metric('storm_stage_seconds', 'gauge', 'Wall time of each run stage.',
+               [('', {'stage': s}, x['seconds']) for s, x in stages.items()])
+
+        for field, kind, help in [
+            ('calls', 'counter', 'Spotify calls per endpoint.'),
+            ('errors', 'counter', 'Spotify calls that failed after their retries.'),
+            ('retries', 'counter', 'Spotify call attempts retried.'),
+            ('throttled', 'counter', 'Spotify call attempts rate limited (429).'),
+            ('wait_seconds', 'counter', 'Seconds Spotify calls waited on the rate limiter and backoff.'),
+        ]:
+            metric(f'storm_api_{field}_total', kind, help, [('', {'stage': s, 'endpoint': e}, x[field]) for s, e, x in api])
+
+        samples = []
+        for s, e, x in api:
+            for bound, count in x['latency_histogram']:
+                samples.append(('_bucket', {'stage': s, 'endpoint': e, 'le': bound}, count))
+            samples.append(('_sum', {'stage': s, 'endpoint': e}, x['seconds']))
+            samples.append(('_count', {'stage': s, 'endpoint': e}, x['calls']))
+        metric('storm_api_latency_seconds', 'histogram', 'Seconds spent in the attempts of Spotify calls.', samples)
+
+        for field, help in [
+            ('operations', 'Mongo commands per collection.'),
+            ('failures', 'Mongo commands that failed.'),
+            ('documents', 'Documents returned, written or matched by Mongo commands.'),
+            ('bytes_sent', 'BSON bytes of the Mongo commands sent.'),
+            ('bytes_received', 'BSON bytes of the Mongo replies received.'),
+            ('seconds', 'Seconds spent in Mongo commands.'),
+        ]:
+            metric(f'storm_mongo_{field}_total', 'counter', help,
+                   [('', {'stage': s, 'collection': c, 'command': k}, x[field]) for s, c, k, x in mongo])
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, labels: Dict[str, str]=None) -> None:
+        """
+        Exports the metrics atomically, Prometheus text for a .prom path and JSON otherwise.
+        """
+        if path.endswith('.prom'):
+            content = self.to_prometheus(labels)
+        else:
+            content = json.dumps({'labels': labels or {}, **self.report()}, indent=2)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if len(labels) == 0:
+        return ''
+    escaped = {k: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for k, v in labels.items()}
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped.items()) + '}'
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """
+    pymongo command listener feeding the subscribed Instrumentations. Does nothing
+    (not even sizing commands) while none is subscribed.
+    """
+
+    # Commands whose reply counts the documents written or matched
+    WRITE_COMMANDS = ('insert', 'update', 'delete')
+
+    def __init__(self):
+
+        self._subscribers = []
+        self._started = {}  # (connection, request id) -> (collection, bytes sent)
+        self._lock = threading.Lock()
+
+    def subscribe(self, instrumentation: Instrumentation) -> None:
+        with self._lock:
+            if instrumentation not in self._subscribers:
+                self._subscribers.append(instrumentation)
+
+    def unsubscribe(self, instrumentation: Instrumentation) -> None:
+        with self._lock:
+            if instrumentation in self._subscribers:
+                self._subscribers.remove(instrumentation)
+            if len(self._subscribers) == 0:
+                self._started.clear()
+
+    def started(self, event) -> None:
+        if len(self._subscribers) == 0:
+            return
+
+        command = event.command
+        collection = command.get('collection') if event.command_name == 'getMore' else command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.database_name
+
+        with self._lock:
+            self._started[(event.connection_id, event.request_id)] = (collection, _bson_size(command))
+
+    def succeeded(self, event) -> None:
+        self._finished(event, event.reply, failed=False)
+
+    def failed(self, event) -> None:
+        self._finished(event, {}, failed=True)
+
+    def _finished(self, event, reply: Dict, failed: bool) -> None:
+        with self._lock:
+            started = self._started.pop((event.connection_id, event.request_id), None)
+            subscribers = list(self._subscribers)
+
+        if started is None or len(subscribers) == 0:
+            return
+
+        collection, bytes_sent = started
+        documents = self._documents(event.command_name, reply)
+        bytes_received = _bson_size(reply)
+        for instrumentation in subscribers:
+            instrumentation.mongo_command(collection, event.command_name, event.duration_micros / 1e6,
+                                          documents, bytes_sent, bytes_received, failed)
+
+    @classmethod
+    def _documents(cls, command_name: str, reply: Dict) -> int:
+        cursor = reply.get('cursor')
+        if isinstance(cursor, dict):
+            return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+        if command_name in cls.WRITE_COMMANDS:
+            return int(reply.get('n', 0))
+        if command_name == 'distinct':
+            return len(reply.get('values', []))
+        if command_name == 'findAndModify':
+            return int(reply.get('value') is not None)
+        return 0
+
+
+def _bson_size(document: Dict) -> int:
+    try:
+        return len(bson.encode(document))
+    except Exception:
+        return 0
+
+
+# Registered by StormDB on the Mongo clients it builds
+MONGO_LISTENER = MongoMetricsListener()
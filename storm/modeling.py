@@ -1,21 +1,27 @@
 import logging
+import threading
 from typing import Dict
+import numpy as np
 import pandas as pd
 import os
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator
 from sklearn.pipeline import Pipeline
 from sklearn.base import TransformerMixin, BaseEstimator
 
 from uuid import uuid4
-import joblib
 
 from .db import StormDB
+from .registry import get_registry
 
 l = logging.getLogger('storm.modeling')
 
 MODEL_NAME_BASE_FORMAT = '{friendly_name}__{storm_model_class}__{num_clusters}__{run}'
 
+# Loaded pipelines shared by every clusterizer in the process, (directory, name) -> pipeline
+_MODEL_CACHE = {}
+_MODEL_CACHE_LOCK = threading.Lock()
+
 class StormTrackClusterizer:
     """
     Manages loading and scoring of 'storm tracks', or more
@@ -23,44 +29,117 @@ class StormTrackClusterizer:
     at the track id level.
     """
 
-    def __init__(self, dir: str='../models', storm_db_client: StormDB=None):
+    def __init__(self, dir: str='../models', storm_db_client: StormDB=None, mmap_mode: str='r'):
         self.dir = dir
+        self.mmap_mode = mmap_mode  # model arrays are memory mapped from the pickle, shared across processes
 
         self.storm_db = storm_db_client
         self._model = None
 
     def load_model_by_name(self, name: str):
         """
-        Loads a model from prod or dev given exact name
+        Loads a model from prod or dev given exact name, each model is only unpickled once per process.
         """
+        key = (os.path.abspath(self.dir), name)
+
+        with _MODEL_CACHE_LOCK:
+            if key not in _MODEL_CACHE:
+                _MODEL_CACHE[key] = get_registry(self.dir).load(name, mmap_mode=self.mmap_mode)
 
-        if name+'.pkl' in os.listdir(self.dir):
-            self._model = joblib.load(f"{self.dir}/{name}.pkl")
-        else:
-            raise FileNotFoundError(f"Can't find {name}.pkl")
+            self._model = _MODEL_CACHE[key]
 
-    def predict(self, track_ids: List[str]) -> pd.DataFrame:
+    def load_latest_model(self, friendly_name: str) -> str:
+        """
+        Loads the most recently registered model for a friendly name, returns its full name.
+        """
+        name = get_registry(self.dir).latest(friendly_name)
+        self.load_model_by_name(name)
+
+        return name
+
+    def predict(self, track_ids: List[str], chunk_size: int=10000) -> pd.DataFrame:
         """
         Returns predicted class and distance to cluster
         """
+        return self.score(track_ids, chunk_size)
+
+    def score(self, track_ids: List[str], chunk_size: int=10000) -> pd.DataFrame:
+        """
+        Scores tracks chunk by chunk, only one chunk of features is in memory at a time.
+        The pipeline runs once per chunk, the cluster is the nearest of the transformed distances.
+        Returns _id, cluster and distance_to_cluster.
+        """
 
         if self._model is None:
             raise Exception("Model not loaded, call StormTrackClusterizer.load_model_by_name first")
 
-        track_df = pd.DataFrame.from_records(self.storm_db.get_track_info(track_ids))
-        track_df['cluster'] = self._model.predict(track_df)
-        track_df['distance_to_cluster'] = self._model.transform(track_df).min(axis=1)
+        ids, clusters, distances = [], [], []
+        for track_df in self.iter_track_features(track_ids, chunk_size):
+            chunk_distances = np.asarray(self._model.transform(track_df))
+            chunk_clusters = chunk_distances.argmin(axis=1)
+
+            ids.extend(track_df['_id'])
+            clusters.append(chunk_clusters)
+            distances.append(chunk_distances[np.arange(len(chunk_clusters)), chunk_clusters])
 
-        return track_df[['_id', 'cluster', 'distance_to_cluster']]
+        return pd.DataFrame({
+            '_id': ids,
+            'cluster': np.concatenate(clusters) if len(clusters) > 0 else np.array([], dtype=int),
+            'distance_to_cluster': np.concatenate(distances) if len(distances) > 0 else np.array([]),
+        })
+
+    def iter_track_features(self, track_ids: List[str], chunk_size: int=10000) -> Iterator[pd.DataFrame]:
+        """
+        Streams the model's features for the tracks in chunks of chunk_size.
+        """
+        for i in range(0, len(track_ids), chunk_size):
+            yield self._load_track_features(list(track_ids[i : i + chunk_size]))
+
+    def _load_track_features(self, track_ids: List[str]) -> pd.DataFrame:
+        """
+        Reads the model's features from the feature store when the database has one,
+        only tracks the store doesn't have are read from Mongo.
+        """
+        store = self.storm_db.feature_store
+        features = self._model_features()
+        if store is None or features is None or not set(features).issubset(store.columns):
+            return pd.DataFrame.from_records(self._get_track_info(track_ids, features))
+
+        missing = store.missing(track_ids)
+        missing_set = set(missing)
+        frames = [store.to_frame([x for x in track_ids if x not in missing_set], features)]
+        if len(missing) > 0:
+            l.debug(f"{len(missing)} tracks not in the feature store, reading them from Mongo.")
+            frames.append(pd.DataFrame.from_records(self._get_track_info(missing, features)))
+
+        return pd.concat(frames, ignore_index=True)
+
+    def _get_track_info(self, track_ids: List[str], features: List[str]=None) -> List[Dict]:
+        """
+        Track records from Mongo, projected to the model's features when they are known.
+        """
+        if features is None:
+            return self.storm_db.get_track_info(track_ids)
+
+        return self.storm_db.get_track_info(track_ids, {'_id': 1, **{x: 1 for x in features}})
+
+    def _model_features(self) -> List[str]:
+        """
+        Columns the loaded pipeline selects in its first step, None when it doesn't start with a FeatureSelector.
+        """
+        steps = getattr(self._model, 'steps', [])
+        if len(steps) > 0 and isinstance(steps[0][1], FeatureSelector):
+            return list(steps[0][1].feature_names)
 
     @staticmethod
     def register_model(model_name: str, fitted_pipeline: Pipeline, num_clusters: int, directory='../models'):
         """
-        Saves a model to the directory with consistent formatting
+        Saves a model to the directory with consistent formatting and adds it to the directory's registry
         """
 
-        output_name = MODEL_NAME_BASE_FORMAT.format(friendly_name=model_name, storm_model_class='track_feature', num_clusters=num_clusters, run=uuid4())
-        joblib.dump(fitted_pipeline, f'../models/{output_name}.pkl', compress = 1)
+        output_name = get_registry(directory).register(
+            model_name, fitted_pipeline, num_clusters, run=str(uuid4()), model_class='track_feature', name_format=MODEL_NAME_BASE_FORMAT
+        )
 
         l.info(f"{output_name} saved to {directory}")
         return output_name
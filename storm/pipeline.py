@@ -0,0 +1,213 @@
+import logging
+import queue
+import threading
+import time
+from typing import List, Dict, Iterable, Iterator, Callable
+
+from .db import StormDB
+from .storm_client import StormClient
+
+l = logging.getLogger('storm.pipeline')
+
+# Marks the end of an upstream stage's output
+_DONE = object()
+
+
+class StormIngestPipeline:
+    """
+    Streams collection for a storm run: artists -> albums -> album tracks -> track features.
+    Each stage runs in its own thread connected to the next by a bounded queue, so features
+    for the first albums are collected while later artists are still being paged, and no
+    stage holds more than a few batches in memory.
+
+    Progress is checkpointed per stage in Mongo under run_id. Every batch is written to the
+    database before it is handed downstream, and each stage starts from what the database
+    still marks as needing collection, so a rerun after a crash resumes where it stopped.
+    Finished stages are skipped entirely on a rerun of the same run_id.
+    """
+
+    STAGES = ('artists', 'albums', 'features')
+
+    def __init__(self, sdb: StormDB, sc: StormClient, run_id: str, run_date: str,
+                 artist_batch_size: int=20, album_batch_size: int=20, feature_batch_size: int=100,
+                 queue_size: int=8):
+
+        self.sdb = sdb
+        self.sc = sc
+        self.run_id = run_id
+        self.run_date = run_date
+
+        self.artist_batch_size = artist_batch_size
+        self.album_batch_size = album_batch_size
+        self.feature_batch_size = feature_batch_size
+        self.queue_size = queue_size  # batches waiting between two stages
+
+        self.stats = {}
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self, artists: List[str]) -> Dict[str, Dict]:
+        """
+        Collects albums, tracks and features for the artists needing it.
+        Returns per stage stats, {stage: {processed, seconds, skipped}}.
+        Re-raises the first stage failure once every stage has stopped.
+        """
+        checkpoint = self.sdb.get_pipeline_checkpoint(self.run_id)
+        skip = {x for x in self.STAGES if checkpoint.get(x, {}).get('done', False)}
+        if len(skip) > 0:
+            l.info(f"Resuming {self.run_id}, skipping finished stages {sorted(skip)}")
+
+        self._stop.clear()
+        self._errors = []
+        self.stats = {x: {'processed': 0, 'seconds': 0.0, 'skipped': x in skip} for x in self.STAGES}
+
+        albums = queue.Queue(maxsize=self.queue_size)
+        tracks = queue.Queue(maxsize=self.queue_size)
+        stages = [
+            ('artists', lambda: self._artist_stage(artists, albums), albums),
+            ('albums', lambda: self._album_stage(albums, tracks), tracks),
+            ('features', lambda: self._feature_stage(tracks), None),
+        ]
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=(name, fn, outbox, name in skip), name=f"storm-{name}")
+            for name, fn, outbox in stages
+        ]
+        [x.start() for x in threads]
+        [x.join() for x in threads]
+
+        if len(self._errors) > 0:
+            raise self._errors[0]
+
+        return self.stats
+
+    # Stages
+    def _artist_stage(self, artists: List[str], outbox: queue.Queue) -> None:
+        """
+        Pages albums for artists not collected today, hands the album ids downstream.
+        """
+        to_collect = list(self.sdb.get_artists_for_album_collection(self.run_date, artists))
+        l.info(f"Streaming albums for {len(to_collect)} artists.")
+
+        for batch in self._chunks(to_collect, self.artist_batch_size):
+            if self._stop.is_set():
+                return
+
+            albums = self.sc.get_artist_albums(batch)
+            album_ids = [x['id'] for x in albums if isinstance(x, dict)]
+
+            self.sdb.update_albums(albums)
+            self.sdb.update_artist_album_collected_date(batch, self.run_date)
+            self._checkpoint('artists', len(batch))
+            self._put(outbox, album_ids)
+
+        self.sdb.update_artist_albums()
+
+    def _album_stage(self, inbox: queue.Queue, outbox: queue.Queue) -> None:
+        """
+        Collects tracks for albums missing them, albums left over from earlier runs first.
+        """
+        # Leftovers are read up front, a cursor left open while their tracks are collected can time out
+        leftovers = list(self.sdb.get_albums_for_track_collection())
+
+        seen = set()
+        for batch in self._consume(inbox, self.album_batch_size, seed=leftovers):
+
+            batch = [x for x in batch if x not in seen]
+            seen.update(batch)
+            needs_collection = list(self.sdb.get_albums_for_track_collection(batch))
+            if len(needs_collection) == 0:
+                continue
+
+            tracks = self.sc.get_album_tracks(needs_collection)
+            track_ids = [x['id'] for x in tracks]
+
+            self.sdb.update_tracks(tracks)
+            self._checkpoint('albums', len(needs_collection))
+            self._put(outbox, track_ids)
+
+    def _feature_stage(self, inbox: queue.Queue) -> None:
+        """
+        Collects audio features for new tracks, tracks left over from earlier runs first.
+        """
+        seen = set()
+        for batch in self._consume(inbox, self.feature_batch_size, seed=self.sdb.get_tracks_for_feature_collection()):
+
+            batch = [x for x in batch if x not in seen]
+            seen.update(batch)
+            if len(batch) == 0:
+                continue
+
+            self.sdb.update_track_features(self.sc.get_track_features(batch))
+            self._checkpoint('features', len(batch))
+
+    # Plumbing
+    def _run_stage(self, name: str, fn: Callable[[], None], outbox: queue.Queue, skip: bool) -> None:
+        start = time.perf_counter()
+        try:
+            if skip:
+                l.debug(f"Stage {name} already finished for {self.run_id}.")
+            else:
+                fn()
+                if not self._stop.is_set():
+                    self.sdb.update_pipeline_checkpoint(self.run_id, name, 0, done=True)
+
+        except Exception as e:
+            l.error(f"Stage {name} failed, stopping the pipeline: {e}")
+            self._errors.append(e)
+            self._stop.set()
+
+        finally:
+            self.stats[name]['seconds'] = time.perf_counter() - start
+            if outbox is not None:
+                self._put(outbox, _DONE)
+
+    def _checkpoint(self, stage: str, processed: int) -> None:
+        self.stats[stage]['processed'] += processed
+        self.sdb.update_pipeline_checkpoint(self.run_id, stage, processed)
+
+    def _put(self, outbox: queue.Queue, item) -> None:
+        """
+        Blocks while the next stage is behind, gives up once the pipeline is stopping.
+        """
+        while not self._stop.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _consume(self, inbox: queue.Queue, size: int, seed: Iterable[str]=()) -> Iterator[List[str]]:
+        """
+        Regroups the seed ids followed by the upstream batches into batches of size.
+        """
+        buffer = []
+        for x in seed:
+            if self._stop.is_set():
+                return
+            buffer.append(x)
+            if len(buffer) == size:
+                yield buffer
+                buffer = []
+
+        while not self._stop.is_set():
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if item is _DONE:
+                break
+
+            buffer.extend(item)
+            while len(buffer) >= size:
+                yield buffer[:size]
+                buffer = buffer[size:]
+
+        if len(buffer) > 0 and not self._stop.is_set():
+            yield buffer
+
+    @staticmethod
+    def _chunks(ids: List[str], size: int) -> Iterator[List[str]]:
+        for i in range(0, len(ids), size):
+            yield ids[i : i + size]
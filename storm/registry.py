@@ -0,0 +1,207 @@
+import datetime as dt
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from typing import List, Dict, Any
+
+l = logging.getLogger('storm.registry')
+
+INDEX_FILE = 'index.json'
+
+# One registry per models directory in the process, see get_registry
+_REGISTRIES = {}
+_REGISTRIES_LOCK = threading.Lock()
+
+
+def get_registry(directory: str) -> "ModelRegistry":
+    """
+    Shared registry for a directory, its index is read once per process.
+    """
+    key = os.path.abspath(directory)
+    with _REGISTRIES_LOCK:
+        if key not in _REGISTRIES:
+            _REGISTRIES[key] = ModelRegistry(directory)
+
+        return _REGISTRIES[key]
+
+
+class ModelRegistry:
+    """
+    Index of the models in a directory, kept in index.json beside the pickles.
+    Each entry records the parts of its MODEL_NAME_BASE_FORMAT name (friendly name,
+    model class, cluster count, run), creation time, file modification time, the features
+    the pipeline selects and the file's sha256. Pickles found in the directory are indexed
+    from their names alone, their features and hash are filled in when first loaded. The index is rewritten atomically, and models are saved
+    uncompressed so their arrays can be memory mapped and shared between processes.
+    """
+
+    def __init__(self, directory: str='../models'):
+
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._index = None
+
+    @property
+    def index(self) -> Dict[str, Dict]:
+        if self._index is None:
+            self._index = self._read_index()
+            if len(self.unindexed()) > 0:
+                self.rebuild()
+
+        return self._index
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.pkl")
+
+    # Resolution
+    def get(self, name: str) -> Dict:
+        """
+        Index entry of a model, re-reading the index once in case another process registered it.
+        """
+        if name not in self.index:
+            self._index = None
+        if name not in self.index:
+            raise FileNotFoundError(f"Can't find {name}.pkl")
+
+        return self.index[name]
+
+    def latest(self, friendly_name: str, model_class: str=None) -> str:
+        """
+        Name of the most recently registered model under friendly_name. Models indexed by rebuild()
+        have no registration time (file times only tell when they were checked out), so they are
+        only picked when none was registered, by name for a stable choice.
+        """
+        candidates = [
+            x for x in self.index.values()
+            if x['friendly_name'] == friendly_name and (model_class is None or x['model_class'] == model_class)
+        ]
+        if len(candidates) == 0:
+            raise FileNotFoundError(f"No models registered for {friendly_name}")
+
+        registered = [x for x in candidates if x['created'] is not None]
+        if len(registered) > 0:
+            return max(registered, key=lambda x: x['created'])['name']
+
+        l.warning(f"No registration times for {friendly_name} models, picking by name.")
+        return max(candidates, key=lambda x: x['name'])['name']
+
+    def load(self, name: str, mmap_mode: str='r', verify: bool=False) -> Any:
+        """
+        Loads a model, its numpy arrays memory mapped (read only) rather than copied when mmap_mode is set.
+        """
+        entry = self.get(name)
+        if verify and entry['sha256'] is not None and self._hash(self.path(name)) != entry['sha256']:
+            raise ValueError(f"{name}.pkl does not match its registered hash.")
+
+        import joblib
+        model = joblib.load(self.path(name), mmap_mode=mmap_mode)
+
+        # Indexed by rebuild(), completed now that the pickle was read anyway
+        if entry['sha256'] is None:
+            self._update({name: self._entry(name, model, created=entry['created'])})
+
+        return model
+
+    # Writing
+    def register(self, friendly_name: str, fitted_pipeline: Any, num_clusters: int, run: str,
+                 model_class: str='track_feature', name_format: str='{friendly_name}__{storm_model_class}__{num_clusters}__{run}') -> str:
+        """
+        Saves a fitted pipeline to the directory and adds it to the index, returns its name.
+        """
+        name = name_format.format(friendly_name=friendly_name, storm_model_class=model_class, num_clusters=num_clusters, run=run)
+
+        import joblib
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path(name) + '.tmp'
+        joblib.dump(fitted_pipeline, tmp)
+        os.replace(tmp, self.path(name))
+
+        self._update({name: self._entry(name, fitted_pipeline, created=dt.datetime.now().isoformat())})
+        return name
+
+    def rebuild(self) -> Dict[str, Dict]:
+        """
+        Indexes pickles in the directory the index doesn't know yet from their names and file times,
+        without loading them, and drops entries whose files are gone.
+        """
+        entries = {name: self._entry(name) for name in self.unindexed()}
+        return self._update(entries, prune=True)
+
+    def unindexed(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+
+        names = [x[:-4] for x in os.listdir(self.directory) if x.endswith('.pkl')]
+        return sorted(x for x in names if x not in (self._index or {}))
+
+    # Index file
+    def _entry(self, name: str, model: Any=None, created: str=None) -> Dict:
+        """
+        Index entry of a pickle, its features and hash only once the model was saved or loaded.
+        """
+        parts = name.rsplit('__', 3)
+        parsed = len(parts) == 4 and parts[2].isdigit()
+
+        return {
+            'name': name,
+            'friendly_name': parts[0] if parsed else name,
+            'model_class': parts[1] if parsed else None,
+            'num_clusters': int(parts[2]) if parsed else None,
+            'run': parts[3] if parsed else None,
+            'created': created,  # registration time, None for pickles indexed by rebuild()
+            'modified': dt.datetime.fromtimestamp(os.path.getmtime(self.path(name))).isoformat(),
+            'features': self._features(model),
+            'sha256': self._hash(self.path(name)) if model is not None else None,
+        }
+
+    @staticmethod
+    def _features(model: Any) -> List[str]:
+        """
+        Feature names selected by the pipeline's first step (a FeatureSelector), None otherwise.
+        """
+        steps = getattr(model, 'steps', [])
+        if len(steps) > 0 and hasattr(steps[0][1], 'feature_names'):
+            return list(steps[0][1].feature_names)
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+
+        return sha.hexdigest()
+
+    def _read_index(self) -> Dict[str, Dict]:
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return {}
+
+        with open(path) as f:
+            return json.load(f)
+
+    def _update(self, entries: Dict[str, Dict], prune: bool=False) -> Dict[str, Dict]:
+        """
+        Merges entries into the index on disk, written to a temporary file and swapped in whole.
+        """
+        with self._lock:
+            index = self._read_index()
+            index.update(entries)
+            if prune:
+                index = {k: v for k, v in index.items() if os.path.exists(self.path(k))}
+
+            path = os.path.join(self.directory, INDEX_FILE)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(index, f, indent=2, sort_keys=True)
+            os.replace(path + '.tmp', path)
+
+            self._index = index
+
+        return index
@@ -0,0 +1,172 @@
+import zlib
+import numpy as np
+
+from array import array
+from typing import List, Dict, Iterable, Iterator
+
+# Run record fields holding Spotify ids, kept as IdSets of the run's IdTable
+RUN_ID_FIELDS = [
+    "input_tracks",
+    "input_artists",
+    "eligible_tracks",
+    "removed_tracks",
+    "storm_tracks",
+    "storm_artists",
+    "storm_albums",
+    "storm_sample_tracks",
+    "removed_artists",
+]
+
+
+class IdTable:
+    """
+    Interns the ids of a run as dense int32 codes, each id string is held once
+    however many run record fields contain it. Codes are never reassigned.
+    """
+
+    def __init__(self, ids: Iterable[str]=()):
+
+        self._codes = {}  # id -> code
+        self.ids = []  # code -> id
+        self.encode(ids)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def code(self, id: str) -> int:
+        """
+        Code of an id, added to the table if new.
+        """
+        code = self._codes.get(id)
+        if code is None:
+            code = self._codes[id] = len(self.ids)
+            self.ids.append(id)
+
+        return code
+
+    def lookup(self, id: str) -> int:
+        """
+        Code of an id, -1 when it isn't in the table.
+        """
+        return self._codes.get(id, -1)
+
+    def encode(self, ids: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.code(x) for x in ids), dtype=np.int32)
+
+    def decode(self, codes: Iterable[int]) -> List[str]:
+        return [self.ids[x] for x in codes]
+
+    def pack(self) -> bytes:
+        """
+        The ids in code order, newline separated and zlib compressed.
+        """
+        return zlib.compress("\n".join(self.ids).encode())
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "IdTable":
+        text = zlib.decompress(data).decode()
+        return cls(text.split("\n") if len(text) > 0 else [])
+
+
+class IdSet:
+    """
+    Ordered set of ids stored as int32 codes into an IdTable.
+    Adding keeps the first occurrence, membership is a bitmap lookup by code,
+    and iterating, indexing and slicing give back the ids, so it reads like the list it replaces.
+    """
+
+    def __init__(self, table: IdTable, ids: Iterable[str]=()):
+
+        self.table = table
+        self._codes = array("i")
+        self._member = np.zeros(max(len(table), 64), dtype=bool)
+        self.extend(ids)
+
+    # Writing
+    def append(self, id: str) -> bool:
+        """
+        Adds an id unless already present, returns whether it was added.
+        """
+        code = self.table.code(id)
+        if code >= len(self._member):
+            self._member = np.concatenate([self._member, np.zeros(max(code + 1, 2 * len(self._member)) - len(self._member), dtype=bool)])
+
+        if self._member[code]:
+            return False
+
+        self._member[code] = True
+        self._codes.append(code)
+        return True
+
+    add = append
+
+    def extend(self, ids: Iterable[str]) -> int:
+        """
+        Adds the ids not yet present in order, returns how many were added.
+        """
+        return sum(self.append(x) for x in ids)
+
+    # Reading
+    @property
+    def codes(self) -> np.ndarray:
+        return np.frombuffer(self._codes, dtype=np.int32) if len(self._codes) > 0 else np.array([], dtype=np.int32)
+
+    def __contains__(self, id: str) -> bool:
+        code = self.table.lookup(id)
+        return 0 <= code < len(self._member) and bool(self._member[code])
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def __iter__(self) -> Iterator[str]:
+        ids = self.table.ids
+        return (ids[x] for x in self._codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.table.decode(self._codes[i])
+
+        return self.table.ids[self._codes[i]]
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(self.tolist(), dtype=dtype)
+
+    def __repr__(self) -> str:
+        return f"IdSet({len(self)} ids)"
+
+    def tolist(self) -> List[str]:
+        return self.table.decode(self._codes)
+
+
+class RunRecord(dict):
+    """
+    A run record whose id fields (RUN_ID_FIELDS) are IdSets sharing one IdTable.
+    Assigning a list to an id field converts it, so runner code keeps assigning and extending lists.
+    StormDB stores the fields as codes and the table once, see StormDB.write_run_record.
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__()
+        self.table = IdTable()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key in RUN_ID_FIELDS and not (isinstance(value, IdSet) and value.table is self.table):
+            value = IdSet(self.table, value)
+
+        super().__setitem__(key, value)
+
+    def update(self, *args, **kwargs) -> None:
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+
+        return self[key]
+
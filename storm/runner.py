@@ -1,18 +1,18 @@
-import spotipy
-from spotipy import util
-from spotipy import oauth2
+import logging
 import numpy as np
-import pandas as pd
-import os
 import datetime as dt
-import time
-import json
+
+from typing import List
 
 # DB
-from .db import *
-from .storm_client import *
-from .weatherboy import *
-from pymongo import MongoClient
+from .db import StormDB
+from .storm_client import StormClient, get_user_client, user_scheduler
+from .weatherboy import WeatherBoy
+from .filters import StormFilterEngine
+from .cache import TrackArtistResolver
+from .pipeline import StormIngestPipeline
+from .run_record import RunRecord
+from .instrumentation import Instrumentation
 
 l = logging.getLogger('storm.runner')
 
@@ -33,9 +33,10 @@ class FakeRunner:
 
         # Verbocity
         self.print = l.debug
+        self.eligible_records = None  # eligible track documents, filled with the eligible tracks
 
         # metadata
-        self.run_record = {'config':self.config, 
+        self.run_record = RunRecord({'config':self.config, 
                            'storm_name':self.name,
                            'run_date':self.run_date,
                            'start_date':self.start_date,
@@ -46,7 +47,7 @@ class FakeRunner:
                            'storm_albums':[], # Release Date Filter
                            'storm_sample_tracks':[], # subset of storm tracks delivered to sample
                            'removed_artists':[] # Artists filtered out
-                           }
+                           })
 
         self.print(f"{self.name} Started Successfully!\n")
         #self.Run()
@@ -70,7 +71,7 @@ class FakeRunner:
         Loads in relevant information from last run.
         """
         self.print("Appending last runs tracks and artists.")
-        self.run_record['input_artists'].extend(self.sdb.get_last_run(self.name)['storm_artists']) # Post-filter
+        self.run_record['input_artists'].extend(self.sdb.get_last_run(self.name, ['storm_artists'])['storm_artists']) # Post-filter
 
     def filter_storm_tracks(self):
         """
@@ -80,118 +81,80 @@ class FakeRunner:
         self.print("Filtering artists.")
         self.apply_artist_filters()
 
-        self.print("Obtaining all albums from storm artists.")
-        self.run_record['storm_albums'] = self.sdb.get_albums_from_artists_by_date(self.run_record['storm_artists'], 
-                                                                                   self.run_record['start_date'],
-                                                                                   self.run_date)
-        self.print("Getting tracks from albums.")
-        self.run_record['eligible_tracks'] = self.sdb.get_tracks_from_albums(self.run_record['storm_albums'])
+        self.print("Obtaining all album tracks from storm artists.")
+        self.load_eligible_tracks()
 
         self.print("Filtering Tracks.")
         self.apply_track_filters()
 
         self.print("Storm Tracks Generated! \n")
 
+    def load_eligible_tracks(self):
+        """
+        Gets the tracks (and their albums) released by storm artists in the run window in one query.
+        """
+        fields = StormFilterEngine(self.sdb, self.config['filters']).required_track_fields()
+        eligible = self.sdb.get_eligible_tracks(self.run_record['storm_artists'],
+                                                self.run_record['start_date'],
+                                                self.run_date,
+                                                fields={**fields, 'album_id':1})
+
+        # Records carry what the track filters need, so filtering needs no further queries
+        self.eligible_records = list(eligible)
+        self.run_record['eligible_tracks'] = [x['_id'] for x in self.eligible_records]
+        self.run_record['storm_albums'] = list(dict.fromkeys(x['album_id'] for x in self.eligible_records))
+
     def apply_artist_filters(self):
         """
         read in filters from configurations
         """
-        filters = self.config['filters']['artist']
-        supported = ['genre', 'blacklist']
-        bad_artists = []
-
-        # Filters
-        self.print(f"{len(filters)} valid filters to apply")
-        for filter_name, filter_value in filters.items():
-            
-            self.print(f"Attemping filter {filter_name} - {filter_value}")
-            if filter_name == 'genre':
-                # Add all known artists in sdb of a genre to remove in tracks later
-                genre_artists = self.sdb.get_artists_by_genres(filter_value)
-                bad_artists.extend(genre_artists)
-
-            elif filter_name == 'blacklist':
-                blacklist = self.sdb.get_blacklist(filter_value)
-                if len(blacklist) == 0:
-                    self.print(f"{filter_value} not found, no filtering will be done.'")
-                else:
-                    bad_artists.extend(blacklist[0]['blacklist'])
-            else:
-                self.print(f"{filter_name} not supported or misspelled. ")
-
-        self.run_record['storm_artists'] = [x for x in self.run_record['input_artists'] if x not in bad_artists]
-        self.run_record['removed_artists'] = bad_artists
-        self.print(f"Starting Artist Amount: {len(self.run_record['input_artists'])}")
-        self.print(f"Ending Artist Amount: {len(self.run_record['storm_artists'])}")
+        engine = StormFilterEngine(self.sdb, self.config['filters'])
+        self.run_record['storm_artists'], self.run_record['removed_artists'] = engine.apply_artist_filters(
+            self.run_record['input_artists']
+        )
 
     def apply_track_filters(self):
         """
         read in filters from configurations
         """
-        filters = self.config['filters']['track']
-        supported = ['audio_features', 'artist_filter']
-        bad_tracks = []
-
-        # Filters
-        self.print(f"{len(filters)} valid filters to apply")
-        for filter_name, filter_value in filters.items():
-            
-            self.print(f"Attemping filter {filter_name} - {filter_value}")
-            if filter_name == 'audio_features':
-                for feature, feature_value in filter_value.items():
-                    op = f"${feature_value.split('&&')[0]}"
-                    val = float(feature_value.split('&&')[1])
-                    self.print(f"Removing tracks with {feature} - {op}:{val}")
-                    valid = self.sdb.filter_tracks_by_audio_feature(self.run_record['eligible_tracks'], {feature:{op:val}})
-                    bad_tracks.extend([x for x in self.run_record['eligible_tracks'] if x not in valid])
-                    self.print(f"Cumulative Bad Tracks found {len(np.unique(bad_tracks))}")
-
-                
-            elif filter_name == "artist_filter":
-                if filter_value == 'hard':
-                    # Limits output to tracks that contain only storm artists
-                    for track in self.run_record['eligible_tracks']:
-
-                        track_artists = set(self.sdb.get_track_artists(track))
-                        if not track_artists.issubset(set(self.run_record['storm_artists'])):
-                            bad_tracks.append(track)
-
-                elif filter_value == 'soft':
-                    # Removes tracks that contain known filtered out artists
-                    # Other 'bad' artists could sneak in if not tracked by storm
-                    for track in self.run_record['eligible_tracks']:
-                        track_artists = set(self.sdb.get_track_artists(track))
-                        if not set(self.run_record['removed_artists']).isdisjoint(track_artists):
-                            bad_tracks.append(track)
-
-            else:
-                self.print(f"{filter_name} not supported or misspelled. ")
-
-        bad_tracks = np.unique(bad_tracks).tolist()
-        self.print("Removing bad tracks . . .")
-        self.run_record['storm_tracks'] = [x for x in self.run_record['eligible_tracks'] if x not in bad_tracks]
-        self.run_record['removed_tracks'] = bad_tracks
-        self.print(f"Starting Track Amount: {len(self.run_record['eligible_tracks'])}")
-        self.print(f"Ending Track Amount: {len(self.run_record['storm_tracks'])}")
+        engine = StormFilterEngine(self.sdb, self.config['filters'])
+        self.run_record['storm_tracks'], self.run_record['removed_tracks'] = engine.apply_track_filters(
+            self.run_record['eligible_tracks'],
+            self.run_record['storm_artists'],
+            self.run_record['removed_artists'],
+            track_records=self.eligible_records,
+        )
+        self.run_record['track_filter_rejections'] = engine.rejections
 
 class StormRunner:
     """
     Orchestrates a storm run
     """
-    def __init__(self, storm_name, start_date=None, ignore_rerelease=True, model_name='', model_friendly_name=''):
+    def __init__(self, storm_name, start_date=None, ignore_rerelease=True, model_name='', model_friendly_name='', streaming=False,
+                 sdb=None, sc=None, suc=None, model_dir='./models', metrics_path=None):
 
         l.info(f"Initializing Runner for {storm_name}")
-        self.sdb = StormDB()
+
+        # Clients can be shared across runners (see StormScheduler)
+        self.sdb = StormDB() if sdb is None else sdb
         self.config = self.sdb.get_config(storm_name)
-        self.sc = StormClient(self.config['user_id'])
-        self.suc = StormUserClient(self.config['user_id'])
+        self.sc = StormClient(self.config['user_id'], workers=self.config.get('api_workers', 1)) if sc is None else sc
+        self.suc = get_user_client(self.config['user_id'], sdb=self.sdb) if suc is None else suc
+        self.track_artists = TrackArtistResolver(self.sdb, self.sc, maxsize=self.config.get('track_artist_cache_size', 100000))
         self.name = storm_name
         self.start_date = start_date
         self.ignore_rerelease = ignore_rerelease
+        self.streaming = streaming # Collect albums, tracks and features as one resumable pipeline
+        self.model_dir = model_dir
+
+        # Per step wall time, API calls and Mongo commands, exported to metrics_path ({storm_name} is filled in,
+        # .prom for Prometheus text and JSON otherwise) when given
+        self.instrumentation = Instrumentation()
+        self.metrics_path = self.config.get('metrics_path') if metrics_path is None else metrics_path
 
         # metadata
         self.run_date = dt.datetime.now().strftime('%Y-%m-%d')
-        self.run_record = {'config':self.config, 
+        self.run_record = RunRecord({'config':self.config, 
                            'storm_name':self.name,
                            'run_date':self.run_date,
                            'start_date':self.start_date,
@@ -206,8 +169,9 @@ class StormRunner:
                            'storm_albums':[], # Release Date Filter
                            'storm_sample_tracks':[], # subset of storm tracks delivered to sample
                            'removed_artists':[] # Artists filtered out
-                           }
-        self.last_run = self.sdb.get_last_run(self.name)
+                           })
+        self.eligible_records = None  # eligible track documents, filled with the eligible tracks
+        self.last_run = self.sdb.get_last_run(self.name, ['run_date', 'input_tracks', 'storm_artists'])
         self._gen_dates()
 
         l.info(f"{self.name} Started Successfully!\n")
@@ -218,35 +182,63 @@ class StormRunner:
         Storm Orchestration based on a configuration.
         """
 
-        l.info(f"{self.name} - Step 0 / 8 - Initializing using last run.")
-        self.load_last_run()
+        with self.instrumentation.observing(*self.schedulers()):
 
-        l.info(f"{self.name} - Step 1 / 8 - Collecting Playlist Tracks and Artists. . .")
-        self.collect_playlist_info()
-        
-        l.info(f"{self.name} - Step 2 / 8 - Collecting Artist info. . .")
-        self.collect_artist_info()
+            l.info(f"{self.name} - Step 0 / 8 - Initializing using last run.")
+            with self.instrumentation.stage('load_last_run'):
+                self.load_last_run()
 
-        l.info(f"{self.name} - Step 3 / 8 - Collecting Albums and their Tracks. . .")
-        self.collect_album_info()
+            l.info(f"{self.name} - Step 1 / 8 - Collecting Playlist Tracks and Artists. . .")
+            with self.instrumentation.stage('collect_playlist_info'):
+                self.collect_playlist_info()
 
-        l.info(f"{self.name} - Step 4 / 8 - Collecting Track Features . . .")
-        self.collect_track_features()
+            l.info(f"{self.name} - Step 2 / 8 - Collecting Artist info. . .")
+            with self.instrumentation.stage('collect_artist_info'):
+                self.collect_artist_info()
 
-        l.info(f"{self.name} - Step 5 / 8 - Filtering Track List . . .")
-        self.filter_storm_tracks()
+            if self.streaming:
+                l.info(f"{self.name} - Step 3-4 / 8 - Streaming Albums, their Tracks and Track Features . . .")
+                with self.instrumentation.stage('stream_album_info'):
+                    self.stream_album_info()
+
+            else:
+                l.info(f"{self.name} - Step 3 / 8 - Collecting Albums and their Tracks. . .")
+                with self.instrumentation.stage('collect_album_info'):
+                    self.collect_album_info()
+
+                l.info(f"{self.name} - Step 4 / 8 - Collecting Track Features . . .")
+                with self.instrumentation.stage('collect_track_features'):
+                    self.collect_track_features()
 
-        l.info(f"{self.name} - Step 6 / 8 - Handing off to Weatherboy . . . ")
-        self.call_weatherboy()
+            l.info(f"{self.name} - Step 5 / 8 - Filtering Track List . . .")
+            with self.instrumentation.stage('filter_storm_tracks'):
+                self.filter_storm_tracks()
 
-        l.info(f"{self.name} - Step 7 / 8 - Writing to Spotify . . .")
-        self.write_storm_tracks()
+            l.info(f"{self.name} - Step 6 / 8 - Handing off to Weatherboy . . . ")
+            with self.instrumentation.stage('call_weatherboy'):
+                self.call_weatherboy()
 
-        l.info(f"{self.name} - Step 8 / 8 - Saving Storm Run . . .")
-        self.save_run_record()
+            l.info(f"{self.name} - Step 7 / 8 - Writing to Spotify . . .")
+            with self.instrumentation.stage('write_storm_tracks'):
+                self.write_storm_tracks()
+
+            # The stored record has every step but its own save, the export has all of them
+            l.info(f"{self.name} - Step 8 / 8 - Saving Storm Run . . .")
+            with self.instrumentation.stage('save_run_record'):
+                self.run_record['instrumentation'] = self.instrumentation.report()
+                self.save_run_record()
+
+        if self.metrics_path:
+            self.instrumentation.write(self.metrics_path.format(storm_name=self.name), labels={'storm': self.name})
 
         l.info(f"{self.name} - Complete!\n")
     
+    def schedulers(self) -> List:
+        """
+        Rate limiters the run's Spotify calls go through, WeatherBoy's user client waits on user_scheduler().
+        """
+        return [getattr(x, 'scheduler', None) for x in (self.sc, self.suc)] + [user_scheduler()]
+
     # Object Based orchestration
     def load_last_run(self):
         """
@@ -288,14 +280,15 @@ class StormRunner:
        
         l.info("Playlists Prepared. \n")
 
-    def collect_artist_info(self):
+    def collect_artist_info(self, artists=None):
         """
-        Loads in the data from the run_records artists
+        Loads in the data from the run_records artists (or the given artists)
         """
+        artists = self.run_record['input_artists'] if artists is None else artists
 
         # get data for artists we don't know
-        known_artists = self.sdb.get_known_artist_ids()
-        new_artists = [x for x in self.run_record['input_artists'] if x not in known_artists]
+        known_artists = set(self.sdb.get_known_artist_ids())
+        new_artists = [x for x in artists if x not in known_artists]
 
         if len(new_artists) > 0:
             l.info(f"{len(new_artists)} New Artists Found! Getting their info now.")
@@ -309,25 +302,39 @@ class StormRunner:
 
         l.info("Artist Info Collection Done.\n")
 
-    def collect_album_info(self):
+    def collect_album_info(self, artists=None):
         """
         Get and update all albums associated with the artists
         """
         
         l.info("Getting the albums for Input Artists that haven't been acquired.")
-        self.collect_artist_albums()
+        self.collect_artist_albums(artists)
         
         l.info("Getting tracks for albums that need it")
         self.collect_album_tracks()
     
         l.info("Album Collection Done. \n")
 
+    def stream_album_info(self, artists=None, run_id=None):
+        """
+        Albums, their tracks and track features collected concurrently in a pipeline,
+        checkpointed per storm and run date so a failed run resumes where it stopped.
+        """
+        artists = self.run_record['input_artists'] if artists is None else artists
+        run_id = f"{self.name}_{self.run_date}" if run_id is None else run_id
+
+        stats = StormIngestPipeline(self.sdb, self.sc, run_id, self.run_date).run(artists)
+        self.run_record['ingest_pipeline'] = stats
+
+        l.info(f"Streaming Collection Done: {stats}\n")
+        return stats
+
     def collect_track_features(self):
         """
-        Gets all track features needed
-        Also in a while try except loop to get through all tracks in the case of bad batches.
+        Gets all track features needed.
+        Throttling and transient errors are retried per request by the client's scheduler,
+        so every batch is only sent once.
         """
-        
         to_collect = self.sdb.get_tracks_for_feature_collection()
         if len(to_collect) == 0:
             l.debug("No Track Features to collect.")
@@ -335,39 +342,15 @@ class StormRunner:
 
         batch_size = 1000
         batches = np.array_split(to_collect, int(np.ceil(len(to_collect)/batch_size)))
+        num_batches = len(batches)
+
+        l.debug(f"Batch Size: {batch_size} | Number of Batches {num_batches}")
+        for i, batch in enumerate(batches):
+
+            l.debug(f"Current Outer Batch: {i}/{num_batches}")
+            batch_tracks = self.sc.get_track_features(batch)
+            self.sdb.update_track_features(batch_tracks)
 
-        # Attempt to go get the batches
-        bad_batch_retries = 0
-        consecutive_bad_batches_limit = 10
-        retry_limit = 5
-        while (bad_batch_retries < retry_limit) & (len(batches) > 0):
-
-            bad_batches = []
-            consecutive_bad_batches = 0
-            num_batches = len(batches)
-            l.debug(f"Batch Size: {batch_size} | Number of Batches {num_batches}")
-            for i, batch in enumerate(batches):
-
-                l.debug(f"Current Outer Batch: {i}/{num_batches}")
-                if consecutive_bad_batches > consecutive_bad_batches_limit:
-                    raise Exception(f"{consecutive_bad_batches_limit} consecutive bad batches. . . Terminating Process.")
-                try:
-                    batch_tracks = self.sc.get_track_features(batch)
-                    self.sdb.update_track_features(batch_tracks)
-
-                    # Successful, does not need collection
-                    consecutive_bad_batches = 0
-
-                except:
-                    l.debug("Bad Batch, will try again after.")
-                    bad_batches.append(batch)
-                    consecutive_bad_batches += 1
-
-            bad_batch_retries += 1
-            batches = bad_batches
-
-            bad_batch_retries += 1
-        
         l.debug("All Track batches collected!")
         l.debug("Track Collection Done! \n")
         return True
@@ -380,12 +363,8 @@ class StormRunner:
         l.debug("Filtering artists.")
         self.apply_artist_filters()
 
-        l.debug("Obtaining all albums from storm artists.")
-        self.run_record['storm_albums'] = self.sdb.get_albums_from_artists_by_date(self.run_record['storm_artists'], 
-                                                                                   self.run_record['start_date'],
-                                                                                   self.run_date)
-        l.debug("Getting tracks from albums.")
-        self.run_record['eligible_tracks'] = self.sdb.get_tracks_from_albums(self.run_record['storm_albums'])
+        l.debug("Obtaining all album tracks from storm artists.")
+        self.load_eligible_tracks()
 
         l.debug("Filtering Tracks.")
         self.apply_track_filters()
@@ -404,23 +383,33 @@ class StormRunner:
         wb = WeatherBoy(
             sdb=self.sdb, 
             model_name=self.run_record['model'], 
-            model_dir='./models',
+            model_dir=self.model_dir,
             friendly_name=self.run_record['model_friendly'],
+            sync_playlists=self.config.get('sync_playlists', True),
         )
         wb.run(self.run_record['storm_tracks'])
 
     def write_storm_tracks(self):
         """
-        Output the tracks in storm_tracks
+        Output the tracks in storm_tracks, synced into the delivery playlist unless the config sets sync_playlists off
         """
 
-        self.suc.write_playlist_tracks(self.config['full_storm_delivery']['playlist'], self.run_record['storm_tracks'])
+        playlist = self.config['full_storm_delivery']['playlist']
+        if self.config.get('sync_playlists', True):
+            self.run_record['playlist_sync'] = self.suc.sync_playlist_tracks(playlist, self.run_record['storm_tracks'])
+        else:
+            self.suc.write_playlist_tracks(playlist, self.run_record['storm_tracks'])
 
     def save_run_record(self):
         """
         Update Metadata and save run_record
         """
-        self.sdb.write_run_record(self.run_record)
+        if 'storm_tracks_uid' in self.run_record:
+            self.sdb.update_delivered_tracks(self.name, self.run_record['storm_tracks_uid'], self.run_date)
+
+        self.run_record['track_artist_cache'] = self.track_artists.stats
+        l.info(f"Track artist resolution: {self.track_artists.stats}")
+        self.sdb.write_run_record(self.run_record, compact=self.config.get('compact_run_records', True))
 
 
     # Low Level orchestration
@@ -446,18 +435,7 @@ class StormRunner:
 
         # Determine if playlists need examining
         if self.run_date > self.sdb.get_playlist_collection_date(playlist_id):
-
-            # Acquire data
-            playlist_record = {'_id':playlist_id, 
-                            'last_collected':self.run_date}
-
-            playlist_record['info'] = self.sc.get_playlist_info(playlist_id)
-            playlist_record['tracks'] = self.sc.get_playlist_tracks(playlist_id)
-            playlist_record['artists'] = self.sc.get_artists_from_tracks(playlist_record['tracks'])
-
-            l.debug("Writing changes to DB")
-            self.sdb.update_playlist(playlist_record)
-
+            self.sync_playlist(playlist_id)
         else:
             l.debug("Skipping API Load, already collected today.")
 
@@ -467,8 +445,8 @@ class StormRunner:
 
         # Update run record
         self.run_record['playlists'].append(playlist_id)
-        self.run_record['input_tracks'].extend([x for x in input_tracks if x not in self.run_record['input_tracks']])
-        self.run_record['input_artists'].extend([x for x in input_artists if x not in self.run_record['input_artists']])
+        self.run_record['input_tracks'].extend(input_tracks)  # id fields are ordered sets, new ids only
+        self.run_record['input_artists'].extend(input_artists)
 
     def load_output_playlist(self, playlist_id):
         """
@@ -477,23 +455,61 @@ class StormRunner:
 
         # Determine if playlists need examining
         if self.run_date > self.sdb.get_playlist_collection_date(playlist_id):
+            self.sync_playlist(playlist_id, skip_empty=True)
+        else:
+            l.debug("Skipping API Load, already collected today.")
 
-            # Acquire data
-            playlist_record = {'_id':playlist_id, 
-                            'last_collected':self.run_date}
+    def sync_playlist(self, playlist_id, skip_empty=False):
+        """
+        Brings the stored playlist up to date with Spotify.
+        Nothing beyond the playlist info is fetched when the snapshot_id is unchanged,
+        otherwise only the delta against the stored tracks is resolved and logged.
+        """
+        info = self.sc.get_playlist_info(playlist_id)
+        stored = self.sdb.get_playlist_state(playlist_id)
 
-            playlist_record['info'] = self.sc.get_playlist_info(playlist_id)
-            playlist_record['tracks'] = self.sc.get_playlist_tracks(playlist_id)
-            if len(playlist_record['tracks']) > 0:
-                playlist_record['artists'] = self.sc.get_artists_from_tracks(playlist_record['tracks'])
+        if stored is not None and stored.get('info', {}).get('snapshot_id') == info['snapshot_id']:
+            l.debug("Playlist snapshot unchanged, skipping track and artist load.")
+            self.sdb.update_playlist_collection_date(playlist_id, self.run_date)
+            return
 
-                l.debug("Writing changes to DB")
-                self.sdb.update_playlist(playlist_record)
-            else:
-                l.debug("No tracks, must be new storm or something odd is happening.")
+        # Acquire data
+        playlist_record = {'_id':playlist_id,
+                           'last_collected':self.run_date,
+                           'info':info}
+        playlist_record['tracks'] = self.sc.get_playlist_tracks(playlist_id)
+
+        if skip_empty and len(playlist_record['tracks']) == 0:
+            l.debug("No tracks, must be new storm or something odd is happening.")
+            return
+
+        if stored is None or 'artists' not in stored.keys():
+            playlist_record['artists'] = self._get_artists_from_tracks(playlist_record['tracks'])
+            changelog_update = None  # first load logs the full track list
 
         else:
-            l.debug("Skipping API Load, already collected today.")
+            stored_tracks = set(stored['tracks'])
+            current_tracks = set(playlist_record['tracks'])
+            added = [x for x in playlist_record['tracks'] if x not in stored_tracks]
+            removed = [x for x in stored['tracks'] if x not in current_tracks]
+            l.debug(f"Playlist changed, {len(added)} tracks added and {len(removed)} removed.")
+
+            if len(removed) > 0:
+                # Can't tell which artists left with the removed tracks, resolve all of them
+                playlist_record['artists'] = self._get_artists_from_tracks(playlist_record['tracks'])
+            else:
+                playlist_record['artists'] = sorted(set(stored['artists']).union(self._get_artists_from_tracks(added)))
+
+            changelog_update = {'snapshot':info['snapshot_id'], 'added':added, 'removed':removed}
+
+        l.debug("Writing changes to DB")
+        self.sdb.update_playlist(playlist_record, changelog_update)
+
+    def _get_artists_from_tracks(self, tracks):
+        """
+        Unique artists for a list of tracks, no API call for an empty list.
+        """
+        return self.track_artists.get_artists_from_tracks(tracks) if len(tracks) > 0 else []
 
     def load_artist_albums(self, artists):
         """
@@ -510,13 +526,14 @@ class StormRunner:
             self.sdb.update_albums(batch_albums)
             self.sdb.update_artist_album_collected_date(batch)
 
-    def collect_artist_albums(self):
+    def collect_artist_albums(self, artists=None):
         """
-        Get artist albums for input artists that need it.
+        Get artist albums for input artists (or the given artists) that need it.
         """
+        artists = self.run_record['input_artists'] if artists is None else artists
+
         # Get a list of all artists in storm that need album collection
-        needs_collection = self.sdb.get_artists_for_album_collection(self.run_date)
-        to_collect = [x for x in self.run_record['input_artists'] if x in needs_collection]
+        to_collect = list(self.sdb.get_artists_for_album_collection(self.run_date, artists))
 
         # Get their albums
         if len(to_collect) == 0:
@@ -534,9 +551,9 @@ class StormRunner:
         Gets tracks for every album that needs them, not just storm.
         In the case of new storms this helps populate historical.
         In the case of existing ones it will only be the storm albums that need collection.
-        Given the intensity, try except implemented to retry bad batches
+        Failed requests are retried individually by the client's scheduler.
         """
-        needs_collection = self.sdb.get_albums_for_track_collection()
+        needs_collection = list(self.sdb.get_albums_for_track_collection())
         batch_size = 20
         if len(needs_collection) == 0:
             l.debug("No Albums needed to collect.")
@@ -545,135 +562,60 @@ class StormRunner:
         batches = np.array_split(needs_collection, int(np.ceil(len(needs_collection)/batch_size)))
         num_batches = len(batches)
 
-        # Attempt to go get the batches
-        bad_batch_retries = 0
-        consecutive_bad_batches_limit = 10
-        retry_limit = 5
-        while (bad_batch_retries < retry_limit) & (len(batches) > 0):
-
-            bad_batches = []
-            consecutive_bad_batches = 0
-            l.info(f"Batch Size: {batch_size} | Number of Batches {num_batches}")
-            for i, batch in enumerate(batches):
-
-                l.info(f"Current Outer Batch: {i}/{num_batches}")
-
-                if consecutive_bad_batches > consecutive_bad_batches_limit:
-                    raise Exception(f"{consecutive_bad_batches_limit} consecutive bad batches. . . Terminating Process.")
-                try:
-                    batch_tracks = self.sc.get_album_tracks(batch)
-                    self.sdb.update_tracks(batch_tracks)
-
-                    # Successful, does not need collection
-                    consecutive_bad_batches = 0
+        l.info(f"Batch Size: {batch_size} | Number of Batches {num_batches}")
+        for i, batch in enumerate(batches):
 
-                except:
-                    l.error("Bad Batch, will try again after.")
-                    bad_batches.append(batch)
-                    consecutive_bad_batches += 1
+            l.info(f"Current Outer Batch: {i}/{num_batches}")
+            batch_tracks = self.sc.get_album_tracks(batch)
+            self.sdb.update_tracks(batch_tracks)
 
-            bad_batch_retries += 1
-            batches = bad_batches
-        
         l.info("All album batches collected!")
         return True
 
+    def load_eligible_tracks(self):
+        """
+        Gets the tracks (and their albums) released by storm artists in the run window in one query.
+        """
+        fields = StormFilterEngine(self.sdb, self.config['filters']).required_track_fields()
+        eligible = self.sdb.get_eligible_tracks(self.run_record['storm_artists'],
+                                                self.run_record['start_date'],
+                                                self.run_date,
+                                                fields={**fields, 'album_id':1})
+
+        # Records carry what the track filters need, so filtering needs no further queries
+        self.eligible_records = list(eligible)
+        self.run_record['eligible_tracks'] = [x['_id'] for x in self.eligible_records]
+        self.run_record['storm_albums'] = list(dict.fromkeys(x['album_id'] for x in self.eligible_records))
+
     def apply_artist_filters(self):
         """
         read in filters from configurations
         """
-        filters = self.config['filters']['artist']
-        supported = ['genre', 'blacklist']
-        bad_artists = []
-
-        # Filters
-        l.debug(f"{len(filters)} valid filters to apply")
-        for filter_name, filter_value in filters.items():
-            
-            l.debug(f"Attemping filter {filter_name} - {filter_value}")
-            if filter_name == 'genre':
-                # Add all known artists in sdb of a genre to remove in tracks later
-                genre_artists = self.sdb.get_artists_by_genres(filter_value)
-                bad_artists.extend(genre_artists)
-
-            elif filter_name == 'blacklist':
-                blacklist = self.sdb.get_blacklist(filter_value)
-                if len(blacklist) == 0:
-                    l.debug(f"{filter_value} not found, no filtering will be done.'")
-                else:
-                    l.debug(f"{filter_value} found!'")
-                    if 'input_playlist' in blacklist[0].keys():
-                        l.debug("Updating Blacklist . . .")
-                        self.update_blacklist_from_playlist(blacklist[0]['_id'], blacklist[0]['input_playlist'])
-
-                        # Reload
-                        blacklist = self.sdb.get_blacklist(filter_value)
-                    bad_artists.extend(blacklist[0]['blacklist'])
-            else:
-                print(f"{filter_name} not supported or misspelled. ")
-
-        self.run_record['storm_artists'] = [x for x in self.run_record['input_artists'] if x not in bad_artists]
-        self.run_record['removed_artists'] = bad_artists
-        print(f"Starting Artist Amount: {len(self.run_record['input_artists'])}")
-        print(f"Ending Artist Amount: {len(self.run_record['storm_artists'])}")
+        engine = StormFilterEngine(self.sdb, self.config['filters'], update_blacklist=self.update_blacklist_from_playlist)
+        self.run_record['storm_artists'], self.run_record['removed_artists'] = engine.apply_artist_filters(
+            self.run_record['input_artists']
+        )
 
     def update_blacklist_from_playlist(self, blacklist_name, playlist_id):
         """
         Updates a blacklist from a playlist (reads the artists)
         """
         bl_tracks = self.sc.get_playlist_tracks(playlist_id)
-        bl_artists = self.sc.get_artists_from_tracks(bl_tracks)
+        bl_artists = self._get_artists_from_tracks(bl_tracks)
         self.sdb.update_blacklist(blacklist_name, bl_artists)
 
     def apply_track_filters(self):
         """
         read in filters from configurations
         """
-        filters = self.config['filters']['track']
-        supported = ['audio_features', 'artist_filter']
-        bad_tracks = []
-
-        # Filters
-        l.debug(f"{len(filters)} valid filters to apply")
-        for filter_name, filter_value in filters.items():
-            
-            l.debug(f"Attemping filter {filter_name} - {filter_value} on {len(self.run_record['eligible_tracks'])} Tracks.")
-            if filter_name == 'audio_features':
-                for feature, feature_value in filter_value.items():
-                    op = f"${feature_value.split('&&')[0]}"
-                    val = float(feature_value.split('&&')[1])
-                    l.debug(f"Removing tracks with {feature} - {op}:{val}")
-                    valid = self.sdb.filter_tracks_by_audio_feature(self.run_record['eligible_tracks'], {feature:{op:val}})
-                    bad_tracks.extend([x for x in self.run_record['eligible_tracks'] if x not in valid])
-                    l.debug(f"Cumulative Bad Tracks found {len(np.unique(bad_tracks))}")
-
-                
-            elif filter_name == "artist_filter":
-                if filter_value == 'hard':
-                    # Limits output to tracks that contain only storm artists
-                    for track in self.run_record['eligible_tracks']:
-
-                        track_artists = set(self.sdb.get_track_artists(track))
-                        if not track_artists.issubset(set(self.run_record['storm_artists'])):
-                            bad_tracks.append(track)
-
-                elif filter_value == 'soft':
-                    # Removes tracks that contain known filtered out artists
-                    # Other 'bad' artists could sneak in if not tracked by storm
-                    for track in self.run_record['eligible_tracks']:
-                        track_artists = set(self.sdb.get_track_artists(track))
-                        if not set(self.run_record['removed_artists']).isdisjoint(track_artists):
-                            bad_tracks.append(track)
-
-            else:
-                l.debug(f"{filter_name} not supported or misspelled. ")
-
-        bad_tracks = np.unique(bad_tracks).tolist()
-        l.debug("Removing bad tracks . . .")
-        self.run_record['storm_tracks'] = [x for x in self.run_record['eligible_tracks'] if x not in bad_tracks]
-        self.run_record['removed_tracks'] = bad_tracks
-        l.debug(f"Starting Track Amount: {len(self.run_record['eligible_tracks'])}")
-        l.debug(f"Ending Track Amount: {len(self.run_record['storm_tracks'])}")
+        engine = StormFilterEngine(self.sdb, self.config['filters'])
+        self.run_record['storm_tracks'], self.run_record['removed_tracks'] = engine.apply_track_filters(
+            self.run_record['eligible_tracks'],
+            self.run_record['storm_artists'],
+            self.run_record['removed_artists'],
+            track_records=self.eligible_records,
+        )
+        self.run_record['track_filter_rejections'] = engine.rejections
 
     def filter_rereleases(self, last_delivered_window=60):
         """
@@ -687,34 +629,29 @@ class StormRunner:
             - There ia no guarantee an explicit or non-explicit version will be kept
         """
 
-        # Convert storm tracks to their uids
+        # Convert storm tracks to their uids, in storm track order
         l.debug(f"Starting Storm Track Amount: {len(self.run_record['storm_tracks'])}")
-        storm_tracks = self.sdb.get_track_info(self.run_record['storm_tracks'], {"_id":1, 'name':1, 'artists':1})
-        storm_track_df = pd.DataFrame(storm_tracks)
-        storm_track_df['track_uids'] = storm_track_df.apply(lambda x: self.sdb.gen_unique_track_id(x['name'], x['artists']), axis=1)
-        self.run_record['storm_tracks_uid'] = storm_track_df['track_uids'].unique()
+        records = {x['_id']: x for x in self.sdb.get_track_info(self.run_record['storm_tracks'], {"_id":1, 'name':1, 'artists':1})}
+        track_ids = [x for x in self.run_record['storm_tracks'] if x in records]
+        track_uids = self.sdb.gen_unique_track_uids([records[x].get('name', '') for x in track_ids],
+                                                    [records[x].get('artists', []) for x in track_ids])
 
-        # Get a list of all the previous delivered storm tracks
-        runs = self.sdb.get_runs_by_storm(self.name)
-        window_date = (dt.datetime.now() - dt.timedelta(days=last_delivered_window)).strftime('%Y-%m-%d')
-
-        if runs is not None:
-            valid_runs = [x for x in runs if x['run_date'] > window_date]
-            l.debug(f"Tracks remaining after dedup: {len(storm_track_df.drop_duplicates('track_uids')._id.tolist())}")
-
-            delivered_tracks = []
-            for run in valid_runs:
+        # Storms delivered before the index existed get it built from their run records once
+        backfilled = self.sdb.ensure_delivered_tracks(self.name)
+        if backfilled > 0:
+            l.debug(f"Built delivered tracks from {backfilled} past runs.")
 
-                # Not every run generates unique keys, bug will be fixed later
-                if 'storm_tracks_uid' in run.keys():
-                    delivered_tracks.extend(run['storm_tracks_uid'])
-                    
-            delivered_tracks = np.unique(delivered_tracks).tolist()
-
-            # Remove previously delivered tracks
-            storm_track_df = storm_track_df[~storm_track_df.track_uids.isin(delivered_tracks)]
+        # Previously delivered storm tracks inside the window
+        window_date = (dt.datetime.now() - dt.timedelta(days=last_delivered_window)).strftime('%Y-%m-%d')
+        seen = set(self.sdb.get_delivered_track_uids(self.name, track_uids, window_date))
+        l.debug(f"{len(seen)} Storm Tracks delivered since {window_date}")
 
         # Save off the unique track ids (dedupped on their unique name)
-        self.run_record['storm_tracks'] = storm_track_df.drop_duplicates('track_uids')._id.tolist()
-        self.run_record['storm_tracks_uid'] = storm_track_df['track_uids'].unique().tolist()
+        self.run_record['storm_tracks'] = []
+        self.run_record['storm_tracks_uid'] = []
+        for track, uid in zip(track_ids, track_uids):
+            if uid not in seen:
+                seen.add(uid)
+                self.run_record['storm_tracks'].append(track)
+                self.run_record['storm_tracks_uid'].append(uid)
         l.debug(f"Ending Storm Track Amount: {len(self.run_record['storm_tracks'])}")
\ No newline at end of file
@@ -0,0 +1,182 @@
+import logging
+import time
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+
+from .db import StormDB
+from .storm_client import StormClient, StormUserClient, get_user_client, user_scheduler
+from .runner import StormRunner
+from .instrumentation import Instrumentation
+
+l = logging.getLogger('storm.scheduler')
+
+
+class StormScheduler:
+    """
+    Runs many storms as one job.
+    All runners share one database connection pool and one rate limited API client,
+    the union of the storms' input artists is collected once, then each storm's filter,
+    model and write phases run in parallel on a pool of workers.
+    """
+
+    def __init__(self, storm_config: Dict[str, Dict], workers: int=4, streaming: bool=False,
+                 sdb: StormDB=None, sc: StormClient=None, api_workers: int=1, metrics_path: str=None):
+        """
+        storm_config maps storm name -> StormRunner keyword arguments (model_name, ...).
+        metrics_path exports the job's instrumentation (.prom for Prometheus text, JSON otherwise).
+        """
+
+        self.storm_config = storm_config
+        self.workers = workers
+        self.streaming = streaming
+
+        self.sdb = StormDB() if sdb is None else sdb
+        self._sc = sc
+        self.api_workers = api_workers
+        self._user_clients = {}
+
+        self.runners = {}
+        self.timings = {}
+
+        # Checkpoints streamed collection under the job's storms and start time, so another job
+        # the same day doesn't skip stages this one finished
+        self.run_id = f"scheduler_{'+'.join(sorted(storm_config))}_{dt.datetime.now().isoformat()}"
+
+        # Storms share clients and are delivered concurrently, so metrics are kept per job phase
+        self.instrumentation = Instrumentation()
+        self.metrics_path = metrics_path
+
+    def Run(self) -> Dict[str, Dict]:
+        """
+        Runs every storm, returns the timings in seconds, {storm: {phase: seconds}, 'total': {...}}.
+        """
+        start = time.perf_counter()
+        self.timings = {'total': {}}
+
+        with self.instrumentation.observing():
+
+            l.info(f"Step 1 / 3 - Preparing {len(self.storm_config)} Storms . . .")
+            with self.instrumentation.stage('prepare'):
+                self._timed('total', 'prepare', self.prepare)
+
+            l.info("Step 2 / 3 - Collecting the shared Artist, Album and Track data . . .")
+            with self.instrumentation.stage('collect'):
+                self._timed('total', 'collect', self.collect)
+
+            l.info(f"Step 3 / 3 - Delivering Storms with {self.workers} worker(s) . . .")
+            with self.instrumentation.stage('deliver'):
+                self._timed('total', 'deliver', self.deliver)
+
+        if self.metrics_path:
+            self.instrumentation.write(self.metrics_path)
+
+        self.timings['total']['total'] = time.perf_counter() - start
+        for storm_name, timing in self.timings.items():
+            l.info(f"{storm_name}: " + ", ".join(f"{k} {v:.1f}s" for k, v in timing.items()))
+
+        return self.timings
+
+    def user_client(self, user_id: str) -> StormUserClient:
+        """
+        One user client per Spotify user, shared by that user's storms.
+        """
+        if user_id not in self._user_clients:
+            self._user_clients[user_id] = get_user_client(user_id, sdb=self.sdb)
+        return self._user_clients[user_id]
+
+    # Phases
+    def prepare(self) -> None:
+        """
+        Builds the runners on the shared clients and loads their input playlists.
+        """
+        for storm_name, kwargs in self.storm_config.items():
+            config = self.sdb.get_config(storm_name)
+
+            self.runners[storm_name] = StormRunner(
+                storm_name,
+                sdb=self.sdb,
+                sc=self._shared_client(config['user_id']),
+                suc=self.user_client(config['user_id']),
+                **kwargs,
+            )
+
+        # The clients exist now, count their calls from the playlist loads on
+        self.instrumentation.attach(*self._schedulers())
+
+        for storm_name, runner in self.runners.items():
+            self.timings[storm_name] = {}
+            self._timed(storm_name, 'prepare', self._prepare_runner, runner)
+
+    def collect(self) -> None:
+        """
+        Collects artists, albums, tracks and features once for the union of the storms' input artists.
+        """
+        artists = self.union_input_artists()
+        l.info(f"{len(artists)} unique input Artists across {len(self.runners)} Storms.")
+
+        collector = next(iter(self.runners.values()))
+        collector.collect_artist_info(artists)
+
+        if self.streaming:
+            collector.stream_album_info(artists, run_id=self.run_id)
+        else:
+            collector.collect_album_info(artists)
+            collector.collect_track_features()
+
+    def deliver(self) -> None:
+        """
+        Filters, models, writes and saves every storm in parallel.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {name: executor.submit(self._deliver_runner, runner) for name, runner in self.runners.items()}
+
+        # Surface failures after every other storm got its chance to finish
+        failed = {name: x.exception() for name, x in futures.items() if x.exception() is not None}
+        for name, e in failed.items():
+            l.error(f"{name} failed: {e}")
+        if len(failed) > 0:
+            raise next(iter(failed.values()))
+
+    def union_input_artists(self) -> List[str]:
+        artists = {}
+        for runner in self.runners.values():
+            artists.update(dict.fromkeys(runner.run_record['input_artists']))
+
+        return list(artists)
+
+    # Per storm work
+    def _prepare_runner(self, runner: StormRunner) -> None:
+        runner.load_last_run()
+        runner.collect_playlist_info()
+
+    def _deliver_runner(self, runner: StormRunner) -> None:
+        self._timed(runner.name, 'filter', runner.filter_storm_tracks)
+        self._timed(runner.name, 'model', runner.call_weatherboy)
+        self._timed(runner.name, 'write', runner.write_storm_tracks)
+
+        timing = self.timings[runner.name]
+        timing['total'] = sum(timing.values())
+        runner.run_record['timings'] = timing
+        runner.run_record['instrumentation'] = self.instrumentation.report()  # the job's so far, shared by its storms
+        runner.save_run_record()
+        l.info(f"{runner.name} - Complete!")
+
+    def _shared_client(self, user_id: str) -> StormClient:
+        """
+        The API client of the first storm, rate limits are per application so all storms share it.
+        """
+        if self._sc is None:
+            self._sc = StormClient(user_id, workers=self.api_workers)
+        return self._sc
+
+    def _schedulers(self) -> List:
+        clients = [self._sc] + list(self._user_clients.values())
+        return [getattr(x, 'scheduler', None) for x in clients] + [user_scheduler()]
+
+    def _timed(self, key: str, phase: str, fn, *args) -> None:
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.timings.setdefault(key, {})[phase] = time.perf_counter() - start
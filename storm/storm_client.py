@@ -2,16 +2,365 @@ from dataclasses import dataclass
 import spotipy
 from spotipy import util
 from spotipy import oauth2
+from spotipy.cache_handler import MemoryCacheHandler, CacheFileHandler
+import requests
+from requests.adapters import HTTPAdapter
 import numpy as np
 import logging
-from tqdm import tqdm
 import os
-import datetime as dt
+import time
+import threading
+import bisect
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import List, Dict
+from typing import List, Dict, Callable, Tuple
+
+from .helper import load_env
 
 l = logging.getLogger('storm.client')
 
+# Most tracks a playlist write endpoint takes per call
+PLAYLIST_BATCH_SIZE = 100
+
+
+def build_session(pool_size: int=10) -> requests.Session:
+    """
+    A single HTTP session whose connection pool is sized for the number of concurrent callers.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def resolve_credentials(client_id: str=None, client_secret: str=None) -> Tuple[str, str]:
+    """
+    The API app credentials, falling back to storm_client_id and storm_client_secret
+    from the environment (and the project's .env) for those not given.
+    """
+    load_env()
+    return (
+        os.getenv("storm_client_id") if client_id is None else client_id,
+        os.getenv("storm_client_secret") if client_secret is None else client_secret,
+    )
+
+
+class SpotifyTokenManager:
+    """
+    Thread-safe cache for a Spotify access token and its expiry.
+    The token is only refreshed once it is within refresh_margin seconds of expiring,
+    so one manager can be shared by every call (and thread) of a client.
+    Also usable directly as a spotipy auth_manager.
+    """
+
+    def __init__(self, fetch_token: Callable[[], Dict], refresh_margin: int=60):
+
+        self._fetch_token = fetch_token  # returns a token_info dict with access_token and expires_at
+        self.refresh_margin = refresh_margin
+        self.refresh_count = 0
+
+        self._token_info = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_client_credentials(cls, client_id: str, client_secret: str, session: requests.Session=None, refresh_margin: int=60):
+        """
+        Manager for the app level (client credentials) flow used by StormClient.
+        """
+        sp_cc = oauth2.SpotifyClientCredentials(
+            client_id,
+            client_secret,
+            requests_session=session if session is not None else True,
+            cache_handler=MemoryCacheHandler(),
+        )
+
+        def fetch_token():
+            sp_cc.get_access_token(as_dict=False, check_cache=False)
+            return sp_cc.cache_handler.get_cached_token()
+
+        return cls(fetch_token, refresh_margin)
+
+    @classmethod
+    def from_user_authorization(cls, user_id: str, scope: str, client_id: str, client_secret: str,
+                                redirect_uri: str="http://localhost/", session: requests.Session=None, refresh_margin: int=60):
+        """
+        Manager for the user authorization flow used by StormUserClient.
+        The user is only prompted when no token has been cached on this machine, afterwards
+        the refresh token is used.
+        """
+        sp_oauth = oauth2.SpotifyOAuth(
+            client_id,
+            client_secret,
+            redirect_uri,
+            scope=scope,
+            requests_session=session if session is not None else True,
+            cache_handler=CacheFileHandler(username=user_id),
+        )
+
+        def fetch_token():
+            token_info = sp_oauth.cache_handler.get_cached_token()
+            if token_info is None:
+                util.prompt_for_user_token(user_id, scope=scope, oauth_manager=sp_oauth)
+                token_info = sp_oauth.cache_handler.get_cached_token()
+            elif token_info["expires_at"] - time.time() < refresh_margin:
+                token_info = sp_oauth.refresh_access_token(token_info["refresh_token"])
+            return token_info
+
+        return cls(fetch_token, refresh_margin)
+
+    def _is_expiring(self) -> bool:
+        return self._token_info is None or self._token_info["expires_at"] - time.time() < self.refresh_margin
+
+    def get_access_token(self, as_dict: bool=False):
+        """
+        Returns the cached access token, refreshing it first if it is about to expire.
+        """
+        with self._lock:
+            if self._is_expiring():
+                l.debug("Refreshing Spotify access token.")
+                self._token_info = self._fetch_token()
+                self.refresh_count += 1
+
+            return dict(self._token_info) if as_dict else self._token_info["access_token"]
+
+
+class TokenBucket:
+    """
+    Token bucket keeping the sustained request rate just under the API limit.
+    The rate adapts, it is halved when the API throttles us and creeps back
+    up towards max_rate after successful calls.
+    """
+
+    def __init__(self, rate: float, capacity: int=None, min_rate: float=1.0, recovery: float=0.1):
+
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate
+        self.recovery = recovery  # requests/sec regained per successful call
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Blocks until a request may be sent.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+
+    def throttle(self, retry_after: float) -> None:
+        """
+        Stops every caller for retry_after seconds and backs the rate off,
+        throttles arriving while already paused only extend the pause.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._blocked_until:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._tokens = 0.0
+
+    def recover(self) -> None:
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.recovery)
+
+
+class RequestScheduler:
+    """
+    Central gate for every Spotify call made by the storm clients.
+    Calls wait on a shared token bucket, rate limit responses (429) honour Retry-After
+    and pause all callers, server errors back off exponentially. Only the failed
+    call is retried, never the batch it belongs to.
+    """
+    retry_codes = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate: float=20.0, max_retries: int=6, backoff: float=0.5, max_backoff: float=30.0):
+
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.call_count = 0
+        self.retry_count = 0
+        self.throttle_count = 0
+        self.listeners = []  # told about every call, see Instrumentation.api_call
+        self._lock = threading.Lock()  # guards the counts, the scheduler is shared by worker threads
+
+    @staticmethod
+    def _retry_after(error: spotipy.SpotifyException) -> float:
+        headers = error.headers or {}
+        try:
+            return float(headers.get("Retry-After", 1))
+        except ValueError:
+            return 1.0
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        Runs a single API call under the rate limit, retrying it if it is throttled or fails transiently.
+        Listeners (see Instrumentation) are told about each call once it succeeds or gives up.
+        """
+        stats = {"latency": 0.0, "wait": 0.0, "retries": 0, "throttled": 0}
+        failed = True
+        try:
+            result = self._call(stats, fn, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            if len(self.listeners) > 0:
+                endpoint = getattr(fn, "__name__", type(fn).__name__)
+                for listener in list(self.listeners):
+                    listener.api_call(endpoint, failed=failed, **stats)
+
+    def _call(self, stats: Dict, fn: Callable, *args, **kwargs):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            self.bucket.acquire()
+            sent = time.perf_counter()
+            stats["wait"] += sent - start
+
+            with self._lock:
+                self.call_count += 1
+            try:
+                result = fn(*args, **kwargs)
+
+            except spotipy.SpotifyException as e:
+                stats["latency"] += time.perf_counter() - sent
+                if e.http_status not in self.retry_codes or attempt >= self.max_retries:
+                    raise
+                if e.http_status == 429:
+                    wait = self._retry_after(e)
+                    with self._lock:
+                        self.throttle_count += 1
+                    stats["throttled"] += 1
+                    self.bucket.throttle(wait)
+                    l.debug(f"Rate limited, waiting {wait}s (rate now {self.bucket.rate:.1f}/s)")
+                else:
+                    wait = min(self.max_backoff, self.backoff * 2 ** attempt)
+                    l.debug(f"Spotify returned {e.http_status}, retrying in {wait}s")
+                    time.sleep(wait)
+                    stats["wait"] += wait
+
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                stats["latency"] += time.perf_counter() - sent
+                if attempt >= self.max_retries:
+                    raise
+                wait = min(self.max_backoff, self.backoff * 2 ** attempt)
+                l.debug(f"Connection problem, retrying in {wait}s")
+                time.sleep(wait)
+                stats["wait"] += wait
+
+            else:
+                stats["latency"] += time.perf_counter() - sent
+                self.bucket.recover()
+                return result
+
+            attempt += 1
+            with self._lock:
+                self.retry_count += 1
+            stats["retries"] += 1
+
+
+def plan_playlist_sync(current: List[str], desired: List[str], batch_size: int=PLAYLIST_BATCH_SIZE) -> List[Tuple]:
+    """
+    The playlist calls turning the current track order into the desired one (duplicates dropped):
+    ("remove", tracks), ("reorder", range_start, insert_before, range_length) and ("add", tracks, position),
+    applied in that order. Only tracks off the longest run already in desired order are moved.
+    Falls back to ("replace", tracks) followed by appends when that takes fewer calls, or when the
+    current playlist has duplicates or unavailable (None) tracks a diff can't address.
+    """
+    desired = list(dict.fromkeys(desired))
+    if list(current) == desired:
+        return []
+
+    replace = [("replace", desired[:batch_size])]
+    replace += [("add", desired[i : i + batch_size], None) for i in range(batch_size, len(desired), batch_size)]
+    if None in current or len(set(current)) != len(current):
+        return replace
+
+    wanted = set(desired)
+    removed = [x for x in current if x not in wanted]
+    operations = [("remove", removed[i : i + batch_size]) for i in range(0, len(removed), batch_size)]
+
+    # Kept tracks into their desired relative order
+    rank = {x: i for i, x in enumerate(desired)}
+    playlist = [x for x in current if x in wanted]
+    stay = _longest_increasing_subsequence([rank[x] for x in playlist])
+    placed = sorted(stay)
+    for r in sorted(rank[x] for x in playlist):
+        if r in stay:
+            continue
+
+        # Right after the nearest placed track before it in desired order
+        start = playlist.index(desired[r])
+        playlist.pop(start)
+        before = bisect.bisect_left(placed, r)
+        position = 0 if before == 0 else playlist.index(desired[placed[before - 1]]) + 1
+        playlist.insert(position, desired[r])
+        bisect.insort(placed, r)
+
+        # insert_before counts positions before the move
+        operations.append(("reorder", start, position if position <= start else position + 1, 1))
+
+    # New tracks, one call per contiguous run (and batch)
+    present = set(playlist)
+    i = 0
+    while i < len(desired):
+        if desired[i] in present:
+            i += 1
+            continue
+
+        run_end = i
+        while run_end < len(desired) and desired[run_end] not in present:
+            run_end += 1
+        operations += [("add", desired[j : min(j + batch_size, run_end)], j) for j in range(i, run_end, batch_size)]
+        i = run_end
+
+    return operations if len(operations) < len(replace) else replace
+
+
+def _longest_increasing_subsequence(values: List[int]) -> set:
+    """
+    Values of one longest strictly increasing subsequence, O(n log n).
+    """
+    tails, tail_index, previous = [], [], [None] * len(values)
+    for i, value in enumerate(values):
+        j = bisect.bisect_left(tails, value)
+        previous[i] = tail_index[j - 1] if j > 0 else None
+        if j == len(tails):
+            tails.append(value)
+            tail_index.append(i)
+        else:
+            tails[j] = value
+            tail_index[j] = i
+
+    result = set()
+    i = tail_index[-1] if len(tail_index) > 0 else None
+    while i is not None:
+        result.add(values[i])
+        i = previous[i]
+
+    return result
+
+
 @dataclass
 class StormUserClient:
     """
@@ -20,61 +369,146 @@ class StormUserClient:
     """
     __user_id: int
     scope: str = "playlist-modify-private playlist-modify-public"
-    client_id: str = os.getenv("storm_client_id")  # API app id
-    client_secret: str = os.getenv("storm_client_secret")  # API app secret
-    token: str = None
+    client_id: str = None  # API app id, storm_client_id from the environment if not given
+    client_secret: str = None  # API app secret, storm_client_secret from the environment if not given
+    token_manager: SpotifyTokenManager = None  # shareable, built from the user flow if not given
+    session: requests.Session = None  # shareable HTTP session
+    scheduler: RequestScheduler = None  # shareable rate limiter
+    api_prefix: str = None  # override the API base url, e.g. a local stand-in
+    workers: int = 4  # concurrent pages when listing the user's playlists
+    sdb: "StormDB" = None  # persists the playlist name -> id index when given
+    playlist_index_ttl: int = 3600  # seconds a persisted playlist index is trusted
 
     def __post_init__(self):
         """
         Client with authorization for modifying user information.
         """
+        self.client_id, self.client_secret = resolve_credentials(self.client_id, self.client_secret)
+        if self.session is None:
+            self.session = build_session()
+
+        if self.scheduler is None:
+            self.scheduler = RequestScheduler()
+
+        if self.token_manager is None:
+            self.token_manager = SpotifyTokenManager.from_user_authorization(
+                self.__user_id,
+                scope=self.scope,
+                client_id=self.client_id,
+                client_secret=self.client_secret,
+                session=self.session,
+            )
+
+        self._playlist_ids = None  # name -> id, see get_playlist_ids
+        self._playlist_ids_stored = False  # the index came from the StormDB rather than the API
         self._authenticate()
         l.debug("Storm User Client successfully connected to Spotify.")
 
     # Authentication Functions
     def _authenticate(self) -> None:
         """
-        Connect to Spotify API, intialize spotipy object and generate access token.
+        Connect to Spotify API, the token manager keeps the token valid for every call after.
         """
-        self.token = util.prompt_for_user_token(
-            self.__user_id,
-            scope=self.scope,
-            client_id=self.client_id,
-            client_secret=self.client_secret,
-            redirect_uri="http://localhost/",
-        )
-        self._sp = spotipy.Spotify(auth=self.token)
-        self.token_start = dt.datetime.now()
+        self.token_manager.get_access_token()
+        self._sp = spotipy.Spotify(auth_manager=self.token_manager, requests_session=self.session)
+        if self.api_prefix is not None:
+            self._sp.prefix = self.api_prefix
 
     def write_playlist_tracks(self, playlist_id: int, tracks: List) -> None:
         """
-        Writes a list of track ids into a user's playlist
+        Overwrites a user's playlist with a list of track ids
         """
+        from tqdm import tqdm
 
-        # Call info
-        id_lim = 50
-        batches = np.array_split(tracks, int(np.ceil(len(tracks) / id_lim)))
+        tracks = list(tracks)
+        batches = [tracks[i : i + PLAYLIST_BATCH_SIZE] for i in range(0, len(tracks), PLAYLIST_BATCH_SIZE)]
 
         # First batch overwrite
-        self._authenticate()
-        self._sp.user_playlist_replace_tracks(self.__user_id, playlist_id, batches[0])
+        self.scheduler.call(self._sp.playlist_replace_items, playlist_id, batches[0] if len(batches) > 0 else [])
 
         for batch in tqdm(batches[1:]):
-            self._sp.user_playlist_add_tracks(self.__user_id, playlist_id, batch)
+            self.scheduler.call(self._sp.playlist_add_items, playlist_id, batch)
 
         l.debug(f"Successfully Wrote {len(tracks)} Tracks to {playlist_id}")
 
-    def write_playlist_tracks_by_name(self, playlist_name: str, tracks: List) -> None:
+    def sync_playlist_tracks(self, playlist_id: int, tracks: List, current: List=None) -> Dict[str, int]:
         """
-        Writes a list of track ids into a user's playlist
+        Brings a user's playlist to the track order given with the fewest calls (see plan_playlist_sync),
+        current being the playlist's tracks when already known. Returns the calls made per kind.
+        """
+        current = self.get_playlist_tracks(playlist_id) if current is None else list(current)
+        operations = plan_playlist_sync(current, list(tracks))
+
+        calls = {}
+        for operation in operations:
+            kind, args = operation[0], operation[1:]
+            if kind == "replace":
+                self.scheduler.call(self._sp.playlist_replace_items, playlist_id, *args)
+            elif kind == "remove":
+                self.scheduler.call(self._sp.playlist_remove_all_occurrences_of_items, playlist_id, *args)
+            elif kind == "reorder":
+                self.scheduler.call(self._sp.playlist_reorder_items, playlist_id, *args)
+            elif kind == "add":
+                self.scheduler.call(self._sp.playlist_add_items, playlist_id, *args)
+            calls[kind] = calls.get(kind, 0) + 1
+
+        l.debug(f"Synced {len(tracks)} Tracks to {playlist_id} with {calls}")
+        return calls
+
+    def write_playlist_tracks_by_name(self, playlist_name: str, tracks: List, sync: bool=True) -> None:
+        """
+        Writes a list of track ids into a user's playlist, synced by default rather than overwritten
         """
         
-        # Find playlist
-        playlist_names = {x['name']:x['id'] for x in self.get_user_playlists()}
-        if playlist_name in playlist_names.keys():
-            self.write_playlist_tracks(playlist_names[playlist_name], tracks)
-        else:
+        # Find playlist, a stored index may predate the playlist
+        playlist_ids = self.get_playlist_ids()
+        if playlist_name not in playlist_ids and self._playlist_ids_stored:
+            playlist_ids = self.get_playlist_ids(refresh=True)
+
+        if playlist_name not in playlist_ids:
             l.debug("Playlist not found, skipping write.")
+        elif sync:
+            self.sync_playlist_tracks(playlist_ids[playlist_name], tracks)
+        else:
+            self.write_playlist_tracks(playlist_ids[playlist_name], tracks)
+
+    def get_playlist_tracks(self, playlist_id: int) -> List[str]:
+        """
+        Track ids of a user's playlist in order, None for unavailable items
+        """
+        result = []
+        offset = 0
+        while True:
+            response = self.scheduler.call(
+                self._sp.playlist_items, playlist_id, fields="items(track(id)),next", limit=PLAYLIST_BATCH_SIZE, offset=offset
+            )
+            result.extend((x.get("track") or {}).get("id") for x in response["items"])
+            offset += PLAYLIST_BATCH_SIZE
+
+            if response.get("next") is None:
+                return result
+
+    def get_playlist_ids(self, refresh: bool=False) -> Dict[str, str]:
+        """
+        Playlist name -> id for the user's playlists, listed once per client unless refreshed.
+        With a StormDB the index is shared across runs, listed again once older than playlist_index_ttl.
+        """
+        if self._playlist_ids is not None and not refresh:
+            return self._playlist_ids
+
+        stored = None
+        if self.sdb is not None and not refresh:
+            stored = self.sdb.get_playlist_index(self.__user_id, self.playlist_index_ttl)
+
+        if stored is None:
+            self._playlist_ids = {x['name']: x['id'] for x in self.get_user_playlists()}
+            if self.sdb is not None:
+                self.sdb.update_playlist_index(self.__user_id, self._playlist_ids)
+        else:
+            self._playlist_ids = stored
+        self._playlist_ids_stored = stored is not None
+
+        return self._playlist_ids
 
     def create_many_playlists(self, playlist_configs: List[Dict]):
         """
@@ -83,24 +517,74 @@ class StormUserClient:
         """
 
         for playlist_config in playlist_configs:
-            self._sp.user_playlist_create(user=self.__user_id, **playlist_config)
+            self.scheduler.call(self._sp.user_playlist_create, user=self.__user_id, **playlist_config)
+
+        if self._playlist_ids is not None or self.sdb is not None:
+            self.get_playlist_ids(refresh=True)
 
-    def get_user_playlists(self):
+    def get_user_playlists(self, workers: int=None) -> List[Dict]:
         """
-        Returns a list of Playlist Ids on the users account
+        Returns the playlists on the users account, in account order.
+        The first page gives the total, the remaining pages are fetched concurrently
+        when workers > 1 (defaults to the client setting).
         """
+        workers = self.workers if workers is None else workers
+        lim = 50
 
-        response = self._sp.current_user_playlists()
+        response = self.scheduler.call(self._sp.current_user_playlists, limit=lim, offset=0)
         result = response['items']
+        offsets = range(lim, int(response['total']), lim)
 
-        counter = 1
-        while response['next'] is not None:
-            response = self._sp.current_user_playlists(offset=counter)
-            result.extend(response['items'])
-            counter += 1
+        if workers > 1 and len(offsets) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pages = list(executor.map(self._get_user_playlists_page, offsets))
+        else:
+            pages = [self._get_user_playlists_page(x) for x in offsets]
+
+        [result.extend(x) for x in pages]
+        l.debug(f"{len(result)} playlists listed in {len(offsets) + 1} calls")
 
         return result
 
+    def _get_user_playlists_page(self, offset: int, lim: int=50) -> List[Dict]:
+        return self.scheduler.call(self._sp.current_user_playlists, limit=lim, offset=offset)['items']
+
+# User clients shared by everything in the process, see get_user_client
+_USER_CLIENTS = {}
+_USER_CLIENTS_LOCK = threading.Lock()
+_USER_SCHEDULER = None
+
+
+def user_scheduler() -> RequestScheduler:
+    """
+    The process wide rate limiter of user scoped calls. Rate limits are per application,
+    so every user client made by get_user_client waits on this one bucket.
+    """
+    global _USER_SCHEDULER
+    with _USER_CLIENTS_LOCK:
+        if _USER_SCHEDULER is None:
+            _USER_SCHEDULER = RequestScheduler()
+        return _USER_SCHEDULER
+
+
+def get_user_client(user_id: str, sdb: "StormDB"=None, **kwargs) -> "StormUserClient":
+    """
+    The process' client for a Spotify user, built on first use (kwargs are only used then) on
+    user_scheduler(). Sharing it keeps one token manager (and token cache file reader) per user
+    and one rate limit for every storm and WeatherBoy in the process.
+    A client built without an sdb picks up the first one given, for the persisted playlist index.
+    """
+    scheduler = user_scheduler()
+    with _USER_CLIENTS_LOCK:
+        client = _USER_CLIENTS.get(user_id)
+        if client is None:
+            client = _USER_CLIENTS[user_id] = StormUserClient(user_id, sdb=sdb, scheduler=kwargs.pop("scheduler", scheduler), **kwargs)
+        elif client.sdb is None and sdb is not None:
+            client.sdb = sdb
+
+        return client
+
+
 @dataclass
 class StormClient:
     """
@@ -109,17 +593,31 @@ class StormClient:
     which handles low-level API calls back to Spotify.
     """
     user_id: int
-    client_id: str = os.getenv("storm_client_id")  # API app id
-    client_secret: str = os.getenv("storm_client_secret")  # API app secret
-
-    token: str = None
+    client_id: str = None  # API app id, storm_client_id from the environment if not given
+    client_secret: str = None  # API app secret, storm_client_secret from the environment if not given
+    workers: int = 1  # concurrent requests for the per-artist endpoints
+    api_prefix: str = None  # override the API base url, e.g. a local stand-in
+    token_manager: SpotifyTokenManager = None  # shareable, built from client credentials if not given
+    session: requests.Session = None  # shareable HTTP session
+    scheduler: RequestScheduler = None  # shareable rate limiter
+    rate_limit: float = 20.0  # sustained requests per second when building a scheduler
 
     def __post_init__(self):
         """
         Specify a user only for scope
         """
+        self.client_id, self.client_secret = resolve_credentials(self.client_id, self.client_secret)
+
+        if self.session is None:
+            self.session = build_session(max(self.workers, 10))
 
-        self.sp_cc = oauth2.SpotifyClientCredentials(self.client_id, self.client_secret)
+        if self.scheduler is None:
+            self.scheduler = RequestScheduler(rate=self.rate_limit)
+
+        if self.token_manager is None:
+            self.token_manager = SpotifyTokenManager.from_client_credentials(
+                self.client_id, self.client_secret, session=self.session
+            )
 
         # Authenticate
         self._authenticate()
@@ -130,11 +628,13 @@ class StormClient:
     # Authentication
     def _authenticate(self) -> None:
         """
-        Get a cached token (again) or try to get a new one.
-        Call this before any api call to make sure it won't get credential error.
+        Get the first token and build the spotipy object once, the token manager
+        refreshes the token shortly before it expires so calls never need to re-authenticate.
         """
-        self.token = self.sp_cc.get_access_token(as_dict=False)
-        self.sp = spotipy.Spotify(auth=self.token)
+        self.token_manager.get_access_token()
+        self.sp = spotipy.Spotify(auth_manager=self.token_manager, requests_session=self.session)
+        if self.api_prefix is not None:
+            self.sp.prefix = self.api_prefix
 
     def get_playlist_info(self, playlist_id: int) -> Dict:
         """Returns subset of playlist metadata"""
@@ -143,8 +643,7 @@ class StormClient:
         fields = "description,id,name,owner,snapshot_id"
 
         # Get the info
-        self._authenticate()
-        return self.sp.playlist(playlist_id, fields=fields)
+        return self.scheduler.call(self.sp.playlist, playlist_id, fields=fields)
 
     def get_playlist_tracks(self, playlist_id: int) -> List:
         """
@@ -156,8 +655,7 @@ class StormClient:
         fields = "items(track(id))"  # only getting the ids, get info about them later
 
         # Get number of tracks trying to get (faster to know then go in blind)
-        self._authenticate()
-        total = int(self.sp.user_playlist_tracks(self.user_id, playlist_id, fields="total")["total"])
+        total = int(self.scheduler.call(self.sp.user_playlist_tracks, self.user_id, playlist_id, fields="total")["total"])
         num_batches = int(np.ceil(total / batch_size))
 
         l.debug(f"Total Tracks found for playlist {playlist_id}: {total}.")
@@ -169,9 +667,8 @@ class StormClient:
             
             l.debug(f"Getting Tracks, batch {i}/{num_batches}")
 
-            self._authenticate()
-            response = self.sp.user_playlist_tracks(
-                self.user_id, playlist_id, fields=fields, limit=batch_size, offset=(i * batch_size)
+            response = self.scheduler.call(
+                self.sp.user_playlist_tracks, self.user_id, playlist_id, fields=fields, limit=batch_size, offset=(i * batch_size)
             )
 
             # Populate Ids in the correct indices
@@ -188,27 +685,36 @@ class StormClient:
         across all of the tracks inputted.
         """
 
+        l.debug(f"Attempting to Get Unique Artists for {len(tracks)} Tracks . . .")
+
+        artists = set()
+        [artists.update(x) for x in self.get_track_artists_map(tracks).values()]
+
+        return sorted(artists)
+
+    def get_track_artists_map(self, tracks: List) -> Dict[str, List[str]]:
+        """
+        Returns track_id -> artist_ids in full batches of 50,
+        tracks Spotify doesn't return map to an empty list.
+        """
+
         # Call Info
         id_lim = 50
-        batches = np.array_split(tracks, int(np.ceil(len(tracks) / id_lim)))
-        num_batches = len(batches)
-
-        l.debug(f"Attempting to Get Unique Artists for {len(tracks)} Tracks . . .")
+        num_batches = int(np.ceil(len(tracks) / id_lim))
 
-        # Get Artists
-        artists = []
-        for i, batch in enumerate(batches):
+        result = {}
+        for i in range(num_batches):
 
             l.debug(f"Getting Artists, batch {i}/{num_batches}")
 
-            self._authenticate()
-            response = self.sp.tracks(batch, market="US")["tracks"]
+            batch = list(tracks[i * id_lim : (i + 1) * id_lim])
+            response = self.scheduler.call(self.sp.tracks, batch, market="US")["tracks"]
 
-            # Extend the artists array with all of the artists on the tracks
-            [artists.extend(x["artists"]) for x in response if x is not None]
+            # Responses come back in request order (ids can differ for relinked tracks)
+            for track, x in zip(batch, response):
+                result[track] = [] if x is None else [artist["id"] for artist in x["artists"]]
 
-        # Filter to just ids and unique artists
-        return np.unique([x["id"] for x in artists]).tolist()
+        return result
 
     def get_artist_info(self, artists: List) -> Dict:
         """
@@ -229,8 +735,7 @@ class StormClient:
 
             l.debug(f"Getting Artist Info, batch {i}/{num_batches}")
 
-            self._authenticate()
-            response = self.sp.artists(batch)["artists"]
+            response = self.scheduler.call(self.sp.artists, batch)["artists"]
             result.extend(response)
 
         # Filter to just relevant fields
@@ -239,14 +744,37 @@ class StormClient:
 
         return result
 
-    def get_artist_albums(self, artists: List) -> Dict:
+    def get_artist_albums(self, artists: List, workers: int=None) -> Dict:
         """
-        Returns subset of album fields
+        Returns subset of album fields.
+        Artists are paged concurrently when workers > 1 (defaults to the client setting),
+        albums are returned grouped in the same order as the input artists.
+        """
+
+        workers = self.workers if workers is None else workers
+        total_artists = len(artists)
+        l.debug(f"Getting Albums for {total_artists} Artists with {workers} worker(s) . . .")
+
+        # Get All artist info
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                artist_results = list(executor.map(self._get_single_artist_albums, artists))
+        else:
+            artist_results = [self._get_single_artist_albums(x) for x in artists]
+
+        result = []
+        [result.extend(x) for x in artist_results]
+
+        return result
+
+    def _get_single_artist_albums(self, artist: str) -> List[Dict]:
+        """
+        Pages through one artist's albums, the first full page also provides the total
+        so no separate probe call is needed.
         """
 
         # Call info
         lim = 50
-        offset = 0
         album_types = "single,album"
         country = "US"
         keys = [
@@ -259,47 +787,32 @@ class StormClient:
             "total_tracks",
         ]
 
-        total_artists = len(artists)
-        l.debug(f"Getting {len(keys)} fields for {total_artists} Artist's Albums . . .")
-
-        # Get All artist info
-        result = []
-        for i, artist in enumerate(artists):
-
-            l.debug(f"Getting Albums for {artist}, {i}/{total_artists}")
+        l.debug(f"Getting Albums for {artist}")
 
-            # Initialize array for speed
-            self._authenticate()
-            total_albums = int(
-                self.sp.artist_albums(
-                    artist, country=country, album_type=album_types, limit=1
-                )["total"]
+        response = self.scheduler.call(
+            self.sp.artist_albums, artist, country=country, album_type=album_types, limit=lim, offset=0
+        )
+        total_albums = int(response["total"])
+        items = response["items"]
+
+        for i in range(1, int(np.ceil(total_albums / lim))):
+            response = self.scheduler.call(
+                self.sp.artist_albums,
+                artist,
+                country=country,
+                album_type=album_types,
+                limit=lim,
+                offset=(i * lim),
             )
+            items.extend(response["items"])
 
-            artist_result = ["" for x in range(total_albums)]  # List of album ids pre-initialized
-
-            for i in range(int(np.ceil(total_albums / lim))):
-                self._authenticate()
-                response = self.sp.artist_albums(
-                    artist,
-                    country=country,
-                    album_type=album_types,
-                    limit=lim,
-                    offset=(i * lim),
-                )
-                artist_result[i * lim : (i * lim) + len(response["items"])] = [
-                    {k: x[k] for k in keys} for x in response["items"]
-                ]
-
-            result.extend(artist_result)
-
-        # Remove all other info about artists except ids
-        for i in range(len(result)):
+        # Filter fields and remove all other info about artists except ids
+        result = [{k: x[k] for k in keys} for x in items if x is not None]
+        for album in result:
             try:
-                result[i]["artists"] = [x["id"] for x in result[i]["artists"]]
-            except:
+                album["artists"] = [x["id"] for x in album["artists"]]
+            except (KeyError, TypeError):
                 continue
-                # print("No artists found for album: ", result[i])
 
         return result
 
@@ -319,20 +832,12 @@ class StormClient:
         result = []
         for album in albums:
 
-            # Initialize array for speed
-            self._authenticate()
-            total = int(self.sp.album_tracks(album, market=country, limit=1)["total"])
-
-            album_result = ["" for x in range(total)]  # List of album ids pre-initialized
-
-            for i in range(int(np.ceil(total / lim))):
-                self._authenticate()
-                response = self.sp.album_tracks(
-                    album, market=country, limit=lim, offset=(i * lim)
-                )
-                album_result[i * lim : (i * lim) + len(response["items"])] = [
-                    {k: x[k] for k in keys} for x in response["items"]
-                ]
+            # A failing album is left without tracks and picked up again next run
+            try:
+                album_result = self._get_single_album_tracks(album, keys, lim, country)
+            except spotipy.SpotifyException as e:
+                l.error(f"Couldn't acquire tracks for album {album}: {e.http_status}")
+                continue
 
             # Add the album_id back in
             [x.update({"album_id": album}) for x in album_result]
@@ -344,6 +849,21 @@ class StormClient:
 
         return result
 
+    def _get_single_album_tracks(self, album: str, keys: List[str], lim: int, country: str) -> List[Dict]:
+        """
+        Pages through one album's tracks.
+        """
+        total = int(self.scheduler.call(self.sp.album_tracks, album, market=country, limit=1)["total"])
+
+        album_result = []
+        for i in range(int(np.ceil(total / lim))):
+            response = self.scheduler.call(
+                self.sp.album_tracks, album, market=country, limit=lim, offset=(i * lim)
+            )
+            album_result.extend([{k: x[k] for k in keys} for x in response["items"] if x is not None])
+
+        return album_result
+
     def get_track_features(self, tracks: List) -> List[Dict]:
         """
         Returns a tracks info and audio features
@@ -364,6 +884,7 @@ class StormClient:
             "valence",
             "tempo",
             "time_signature",
+            "duration_ms",
         ]
         batches = np.array_split(tracks, int(np.ceil(len(tracks) / id_lim)))
         num_batches = len(batches)
@@ -374,39 +895,47 @@ class StormClient:
             l.debug(f"Acquiring Audio Features for {id_lim} tracks, batch {j+1}/{num_batches}")
 
             try:
-                self._authenticate()
-                response = self.sp.audio_features(batch)
-                result.extend([{k: x[k] for k in keys} for x in response if x is not None])
-            except:
-                l.error(f"Could not complete batch, tracks {batch}")
+                response = self.scheduler.call(self.sp.audio_features, batch)
+            except spotipy.SpotifyException as e:
+                l.error(f"Could not complete batch ({e.http_status}), tracks {batch}")
+                continue
+
+            result.extend([{k: x[k] for k in keys} for x in response if x is not None])
 
         return result
 
-    def get_track_audio_analysis(self, tracks:List) -> List[Dict]:
+    def get_track_audio_analysis(self, tracks: List, workers: int=None) -> List[Dict]:
         """
-        Gets the detailed audio analysis for a track. This method is slow,
-        the endpoint itself is vey slow and cannot be batched.
+        Gets the detailed audio analysis (sections and segments) for tracks. The endpoint is
+        slow and cannot be batched, so tracks are requested concurrently when workers > 1
+        (defaults to the client setting). Tracks the API fails on are left out.
         """
 
-        # Call Info
-        id_lim = 50
-        batches = np.array_split(tracks, int(np.ceil(len(tracks) / id_lim)))
-        num_batches = len(batches)
-        keys = ['sections', 'segments']
+        workers = self.workers if workers is None else workers
+        l.debug(f"Acquiring Audio Analysis for {len(tracks)} tracks with {workers} worker(s) . . .")
 
-        # Get track features in batches
-        result = []
-        for j, batch in enumerate(batches):
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                responses = list(executor.map(self._get_single_audio_analysis, tracks))
+        else:
+            responses = [self._get_single_audio_analysis(x) for x in tracks]
+
+        return [x for x in responses if x is not None]
+
+    def _get_single_audio_analysis(self, track: str) -> Dict:
+        """
+        One track's sections and segments, None if the API has no analysis for it or sends a malformed one.
+        """
+        keys = ['sections', 'segments']
 
-            l.debug(f"Acquiring Audio Analysis for {id_lim} tracks, batch {j+1}/{num_batches}")
+        try:
+            response = self.scheduler.call(self.sp.audio_analysis, track)
+        except spotipy.SpotifyException as e:
+            l.error(f"Couldn't acquire audio analysis for {track} ({e.http_status})")
+            return None
 
-            for i, track in enumerate(batch):
-                try:
-                    self._authenticate()
-                    response = {'id':track}
-                    response['audio_analysis'] = self.sp.audio_analysis(track)
-                    result.extend([response])
-                except:
-                    l.error(f"Couldn't acquire audio analysis for {track}")
+        if not isinstance(response, dict) or not all(isinstance(response.get(k, []), list) for k in keys):
+            l.error(f"Malformed audio analysis for {track}, skipping it.")
+            return None
 
-        return result
\ No newline at end of file
+        return {'id': track, 'audio_analysis': {k: response.get(k, []) for k in keys}}
\ No newline at end of file
@@ -1,19 +1,11 @@
-# Modeling
-import numpy as np
-import pandas as pd
-from tqdm import tqdm
-import joblib
-
-from dotenv import load_dotenv
-load_dotenv() 
-
-# Directory writing
 import os
 
+from typing import List
+
 # Internal
-from .db import *
-from .modeling import StormTrackClusterizer, MeanSquasher, FeatureSelector
-from .storm_client import StormUserClient
+from .db import StormDB
+from .helper import load_env
+from .storm_client import StormUserClient, get_user_client
 
 class WeatherBoy:
     """
@@ -21,25 +13,33 @@ class WeatherBoy:
     predictions from them.
     """
 
-    def __init__(self, sdb: StormDB, model_name, model_dir: str='../models/', friendly_name='{cluster_number}'):
+    def __init__(self, sdb: StormDB, model_name, model_dir: str='../models/', friendly_name='{cluster_number}',
+                 user_client: StormUserClient=None, sync_playlists: bool=True):
 
         self.sdb = sdb
         self.model_name = model_name
         self.model_dir = model_dir
         self.friendly_name = friendly_name
+        self.user_client = user_client  # the process' spotify_user_id client (see get_user_client) if not given
+        self.sync_playlists = sync_playlists  # diff playlists rather than overwrite them
 
     def run(self, tracks: List[str]):
         """
         Runs tracks through the model
         """
 
-        model = StormTrackClusterizer(dir='./models', storm_db_client=self.sdb)
+        # sklearn and joblib load with the first model scored, not with storm
+        from .modeling import StormTrackClusterizer
+
+        # Pipelines are cached per model, only the first run in a process reads the pickle
+        model = StormTrackClusterizer(dir=self.model_dir, storm_db_client=self.sdb)
         model.load_model_by_name(self.model_name)
 
-        predicted = model.predict(tracks)
+        predicted = model.score(tracks)
         results = model.format_track_predictions_for_writing(predicted, self.friendly_name)
 
-        storm_client = StormUserClient(os.getenv('spotify_user_id'))
+        load_env()
+        storm_client = get_user_client(os.getenv('spotify_user_id'), sdb=self.sdb) if self.user_client is None else self.user_client
 
         playlist_info = []
         for i, name in enumerate(list(results.keys())):
@@ -47,5 +47,6 @@ class WeatherBoy:
                 'name':name
             })
 
+        # Playlist names are resolved from the client's cached name -> id map
         for playlist_name, tracks in results.items():
-            storm_client.write_playlist_tracks_by_name(playlist_name, tracks)
\ No newline at end of file
+            storm_client.write_playlist_tracks_by_name(playlist_name, list(tracks), sync=self.sync_playlists)
\ No newline at end of file
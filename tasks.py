@@ -1,54 +1,26 @@
-import sys
-import logging
-import subprocess
+import os
 
 # Internal
 from invoke import task
 
-from storm.runner import StormRunner
-from storm.modeling import *
-
-# Make sure to add the models you want here
-STORM_CONFIG = {
-    'film_vg_instrumental_v2': {
-        'model_name': 'film_vg_instrumental__distinct__track_feature__8__d9a37891-b219-4fb6-b764-5028f189d117',
-        'model_friendly_name': '{cluster_number} - Film, VG and Instrumental'
-    },
-    'contemporary_lyrical_v2': {
-        'model_name': 'contemporary_lyrical__distinct__track_feature__8__8b53daac-aa99-4442-a5cb-e309dab7e468',
-        'model_friendly_name': '{cluster_number} - Contemporary Lyrical'
-    },
-}
+# Commands import the storm modules they use, so listing and setting up tasks stays fast
+from storm import cli
 
 @task
 def setup_logging(c, level='info'):
     """
     Setups logging for the project. Defaults to info level, is automatically called by run_all.
     """
-
-    if level == 'info':
-        log_level = logging.INFO
-    elif level == 'debug':
-        log_level = logging.DEBUG
-
-    root = logging.getLogger("storm")
-    root.setLevel(log_level)
-
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(log_level)
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    handler.setFormatter(formatter)
-    root.addHandler(handler)
+    cli.setup_logging(level)
 
 @task
-def run(c, storm_name):
+def run(c, storm_name, streaming=False, metrics_path=None):
     """
     Runs a storm by name, assumes the mongo server is already running and logging is setup.
+    With streaming, collection runs as a resumable pipeline. metrics_path exports the run's
+    stage, API and Mongo metrics (.prom for Prometheus text, JSON otherwise).
     """
-    StormRunner(
-        storm_name,
-        **STORM_CONFIG[storm_name]
-    ).Run()
+    cli.run(storm_name, streaming=streaming, metrics_path=metrics_path)
 
 @task
 def run_all(c):
@@ -59,11 +31,59 @@ def run_all(c):
     """
 
     setup_logging(c)
-    for storm_name in STORM_CONFIG:
-        run(c, storm_name)
+    cli.run_all()
 
     c.run('mongo --eval "db.shutdownServer()"')
 
+@task
+def run_parallel(c, workers=4, streaming=False, metrics_path=None):
+    """
+    Runs all the configured storms as one job, collecting shared artists once and
+    delivering the storms in parallel. Turns the mongo server off when done.
+    """
+
+    setup_logging(c)
+    cli.run_parallel(workers=int(workers), streaming=streaming, metrics_path=metrics_path)
+
+    c.run('mongo --eval "db.shutdownServer()"')
+
+@task
+def collect_audio_analysis(c, limit=None, workers=8, migrate=False):
+    """
+    Collects audio analysis for tracks missing it, optionally first moving analysis
+    still embedded in track records into the packed audio_analysis collection.
+    """
+    setup_logging(c)
+    cli.collect_audio_analysis(limit=None if limit is None else int(limit), workers=int(workers), migrate=migrate)
+
+@task
+def compact_runs(c, storm_name=None):
+    """
+    Moves the bulky arrays of stored run records into run_chunks, for one storm or all of them.
+    """
+    cli.compact_runs(storm_name)
+
+@task
+def ensure_indexes(c, explain=False):
+    """
+    Creates the Storm MongoDB indexes, optionally reporting which read endpoints still scan collections.
+    """
+    cli.ensure_indexes(explain=explain)
+
+@task
+def bench(c, name=None, artists=100, mongo_uri=None):
+    """
+    Runs the benchmark scenarios on a seeded database and the local Spotify stand-in,
+    saving results as benchmarks/results/<name or commit>.json for pytest-benchmark compare.
+    """
+    name = c.run('git rev-parse --short HEAD', hide=True).stdout.strip() if name is None else name
+    env = {'STORM_BENCH_ARTISTS': str(artists)}
+    if mongo_uri is not None:
+        env['STORM_BENCH_MONGO_URI'] = mongo_uri
+
+    os.makedirs('benchmarks/results', exist_ok=True)
+    c.run(f'pytest benchmarks/bench_scenarios.py -p no:warnings --benchmark-json=benchmarks/results/{name}.json', env=env)
+
 @task
 def test(c):
     """
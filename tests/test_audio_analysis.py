@@ -0,0 +1,65 @@
+import time
+import numpy as np
+import pytest
+import mongomock
+
+from storm.db import StormDB
+from storm.storm_client import StormClient, SpotifyTokenManager
+from storm.audio_analysis import collect_audio_analysis, pack_audio_analysis, unpack_audio_analysis, SEGMENT_FIELDS
+from benchmarks.fake_spotify import FakeSpotifyServer
+
+@pytest.fixture
+def mock_storm_db(monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+    sdb._tracks.insert_many([{'_id': f"t{i}", 'name': f"Track {i}"} for i in range(7)])
+    yield sdb
+
+def test_pack_round_trip():
+    analysis = FakeSpotifyServer.audio_analysis('t1')
+
+    packed = pack_audio_analysis('t1', analysis)
+    matrices = unpack_audio_analysis(packed)
+
+    assert matrices['segments'].shape == (len(analysis['segments']), len(SEGMENT_FIELDS))
+    assert matrices['pitches'].dtype == np.float32
+    assert np.allclose(matrices['timbre'][3], analysis['segments'][3]['timbre'])
+    assert matrices['sections'][1, 0] == 5.0
+
+def test_collect_audio_analysis(mock_storm_db):
+    with FakeSpotifyServer() as server:
+        token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+        sc = StormClient("test", workers=4, api_prefix=server.prefix, token_manager=token_manager, rate_limit=1000)
+
+        # Interrupted after the first batch, the rerun picks up the rest
+        assert collect_audio_analysis(mock_storm_db, sc, batch_size=3, limit=3) == {'requested': 3, 'stored': 3, 'failed': 0}
+        assert collect_audio_analysis(mock_storm_db, sc, batch_size=3) == {'requested': 4, 'stored': 4, 'failed': 0}
+        assert server.request_count == 7
+
+    assert list(mock_storm_db.get_tracks_for_audio_analysis()) == []
+    track = mock_storm_db._tracks.find_one({'_id': 't0'})
+    assert 'audio_analysis' not in track and track['audio_analysis_flag']
+    assert mock_storm_db.get_track_audio_analysis(['t0', 't6'])['t6']['pitches'].shape[1] == 12
+
+def test_failing_tracks_are_given_up_on(mock_storm_db):
+    with FakeSpotifyServer() as server:
+        # t1 is unknown to the API, t2 comes back malformed
+        server.missing_analysis.add('t1')
+        analysis = server.audio_analysis
+        server.audio_analysis = lambda track_id: {'segments': None} if track_id == 't2' else analysis(track_id)
+        token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+        sc = StormClient("test", api_prefix=server.prefix, token_manager=token_manager, rate_limit=1000)
+
+        for _ in range(StormDB.AUDIO_ANALYSIS_ATTEMPTS):
+            assert collect_audio_analysis(mock_storm_db, sc)['failed'] == 2
+        assert collect_audio_analysis(mock_storm_db, sc) == {'requested': 0, 'stored': 0, 'failed': 0}
+
+    assert mock_storm_db._tracks.find_one({'_id': 't2'})['audio_analysis_attempts'] == StormDB.AUDIO_ANALYSIS_ATTEMPTS
+    assert sorted(mock_storm_db.get_tracks_for_audio_analysis(max_attempts=4)) == ['t1', 't2']
+
+def test_migrate_embedded_analysis(mock_storm_db):
+    mock_storm_db._tracks.update_one({'_id': 't1'}, {'$set': {'audio_analysis': FakeSpotifyServer.audio_analysis('t1')}})
+
+    assert mock_storm_db.migrate_track_analysis() == 1
+    assert 'audio_analysis' not in mock_storm_db._tracks.find_one({'_id': 't1'})
+    assert 't1' in mock_storm_db.get_track_audio_analysis(['t1'])
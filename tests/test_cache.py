@@ -0,0 +1,55 @@
+import pytest
+import mongomock
+
+from storm.db import StormDB
+from storm.cache import TrackArtistResolver
+
+class RecordingClient:
+    """Answers track artist lookups and records the requested tracks"""
+
+    def __init__(self):
+        self.requested = []
+
+    def get_track_artists_map(self, tracks):
+        self.requested.append(list(tracks))
+        return {x: [f"{x}_artist"] for x in tracks}
+
+@pytest.fixture
+def resolver(monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+    sdb._tracks.insert_many([
+        {'_id': 't1', 'artists': ['a1']},
+        {'_id': 't2', 'artists': ['a1', 'a2']},
+    ])
+    yield TrackArtistResolver(sdb, RecordingClient(), maxsize=3)
+
+def test_resolver_sources(resolver):
+    artists = resolver.get_artists_from_tracks(['t1', 't2', 't3'])
+
+    assert artists == ['a1', 'a2', 't3_artist']
+    assert resolver.sc.requested == [['t3']]
+    assert resolver.stats == {'lru_hits': 0, 'db_hits': 2, 'api_misses': 1, 'size': 3}
+
+    # Everything is answered from memory the second time
+    resolver.get_artists_from_tracks(['t1', 't2', 't3'])
+    assert resolver.lru_hits == 3
+    assert len(resolver.sc.requested) == 1
+
+def test_resolver_writes_back(resolver):
+    resolver.get_track_artists_map(['t3', 't4'])
+
+    # A fresh process finds the API results in Mongo
+    fresh = TrackArtistResolver(resolver.sdb, RecordingClient())
+    assert fresh.get_track_artists_map(['t3', 't4']) == {'t3': ['t3_artist'], 't4': ['t4_artist']}
+    assert fresh.sc.requested == []
+    assert fresh.db_hits == 2
+
+    # Resolved tracks are not stored as collected tracks
+    assert resolver.sdb._tracks.count_documents({}) == 2
+
+def test_resolver_eviction(resolver):
+    resolver.get_track_artists_map(['t1', 't2', 't3', 't4'])
+
+    assert len(resolver) == 3
+    assert 't1' not in resolver._cache
@@ -0,0 +1,59 @@
+import json
+import subprocess
+import sys
+import pytest
+
+from storm import cli
+
+# Seconds `import storm.cli` may take in a fresh interpreter, interpreter startup excluded
+IMPORT_BUDGET = 0.25
+HEAVY_MODULES = ['pandas', 'sklearn', 'joblib', 'spotipy', 'pymongo', 'dotenv']
+
+def _fresh_import(statement: str) -> dict:
+    """
+    Imports in a new interpreter, returns the seconds taken and which heavy modules got loaded.
+    """
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"print(json.dumps({{'seconds': seconds, 'loaded': [x for x in {HEAVY_MODULES!r} if x in sys.modules]}}))\n"
+    )
+    return json.loads(subprocess.run([sys.executable, '-c', code], capture_output=True, check=True, text=True).stdout)
+
+@pytest.mark.parametrize('statement', ['import storm', 'import storm.cli', 'from storm import cli'])
+def test_import_loads_no_heavy_modules(statement):
+    assert _fresh_import(statement)['loaded'] == []
+
+def test_import_within_budget():
+    # Best of a few cold starts, so a busy machine doesn't fail the budget
+    assert min(_fresh_import('import storm.cli')['seconds'] for _ in range(3)) < IMPORT_BUDGET
+
+def test_runner_import_skips_modeling_dependencies():
+    loaded = _fresh_import('from storm.runner import StormRunner')['loaded']
+
+    assert 'sklearn' not in loaded
+    assert 'joblib' not in loaded
+    assert 'pandas' not in loaded
+
+def test_lazy_attributes():
+    import storm
+    from storm.db import StormDB
+
+    assert storm.StormDB is StormDB
+    assert 'StormRunner' in dir(storm)
+    with pytest.raises(AttributeError):
+        storm.NotAThing
+
+def test_parser_dispatches_commands(monkeypatch):
+    calls = []
+    monkeypatch.setattr(cli, 'run_parallel', lambda **kwargs: calls.append(kwargs))
+    monkeypatch.setattr(cli, 'setup_logging', lambda level: None)
+
+    assert cli.main(['run-parallel', '--workers', '2', '--streaming']) == 0
+    assert calls == [{'workers': 2, 'streaming': True, 'metrics_path': None}]
+
+def test_parser_rejects_unknown_storms():
+    with pytest.raises(SystemExit):
+        cli.build_parser().parse_args(['run', 'not_a_storm'])
@@ -1,11 +1,18 @@
 import pytest
+import mongomock
 
 from storm import StormDB
+from storm.run_record import RunRecord
 
 @pytest.fixture
 def storm_db():
     yield StormDB()
 
+@pytest.fixture
+def mock_storm_db(monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    yield StormDB(mongo_client=mongomock.MongoClient(), write_chunk_size=2)
+
 def test_update_tracks(storm_db):
     track_record = {
         '_id': '5f4f4f4f4f4f4f4f4f4f4f4f',
@@ -32,4 +39,211 @@ def test_remove_albums(storm_db):
     info = storm_db.get_album_info(['5f4f4f4f4f4f4f4f4f4f4f4f'], fields={'_id': 1})
 
     assert info == []
-    
\ No newline at end of file
+    
+def test_update_tracks_bulk(mock_storm_db):
+    tracks = [
+        {'id': f't{i}', 'name': f'Track {i}', 'artists': ['a1'], 'album_id': f'al{i % 2}'}
+        for i in range(5)
+    ]
+
+    result = mock_storm_db.update_tracks(tracks)
+
+    assert result['tracks']['upserted'] == 5
+    assert result['albums']['upserted'] == 2
+    assert mock_storm_db._albums.find_one({'_id': 'al0'})['tracks'] == ['t0', 't2', 't4']
+
+    result = mock_storm_db.update_track_features([{'id': 't0', 'energy': 0.5}, {'id': 't1', 'energy': 0.1}])
+
+    assert result == {'matched': 2, 'modified': 2, 'upserted': 0}
+
+def test_update_blacklist_bulk(mock_storm_db):
+    mock_storm_db._blacklists.insert_one({'_id': 'bl', 'blacklist': ['a1']})
+
+    mock_storm_db.update_blacklist('bl', ['a1', 'a2', 'a3'])
+
+    assert mock_storm_db.get_blacklist('bl')[0]['blacklist'] == ['a1', 'a2', 'a3']
+
+def test_ensure_indexes(mock_storm_db):
+    mock_storm_db.ensure_indexes()
+
+    for collection, indexes in mock_storm_db.INDEXES.items():
+        assert set(indexes).issubset(mock_storm_db._db[collection].index_information())
+
+def test_explain_read_endpoints(mock_storm_db):
+    result = mock_storm_db.explain_read_endpoints()
+
+    assert set(result) == set(mock_storm_db._read_endpoint_queries())
+    assert all('collscan' in x for x in result.values())
+
+def test_collection_candidates_server_side(mock_storm_db):
+    mock_storm_db._artists.insert_many([
+        {'_id': 'a1', 'album_last_collected': '2021-01-01'},
+        {'_id': 'a2', 'album_last_collected': '2021-03-01'},
+        {'_id': 'a3'},
+    ])
+    mock_storm_db._albums.insert_many([
+        {'_id': 'al1', 'artists': ['a1', 'a2'], 'tracks': ['t1']},
+        {'_id': 'al2', 'artists': ['a1']},
+    ])
+    mock_storm_db._tracks.insert_many([
+        {'_id': 't1', 'audio_analysis_flag': True},
+        {'_id': 't2', 'audio_analysis_flag': False},
+        {'_id': 't3'},
+    ])
+
+    assert sorted(mock_storm_db.get_artists_for_album_collection('2021-02-01')) == ['a1', 'a3']
+    assert list(mock_storm_db.get_artists_for_album_collection('2021-02-01', ['a3'])) == ['a3']
+    assert list(mock_storm_db.get_albums_for_track_collection()) == ['al2']
+
+    # Albums collected with no tracks aren't requested again
+    mock_storm_db._albums.insert_one({'_id': 'al3', 'artists': ['a3'], 'tracks': []})
+    assert list(mock_storm_db.get_albums_for_track_collection()) == ['al2']
+    assert sorted(mock_storm_db.get_tracks_for_audio_analysis()) == ['t2', 't3']
+
+    mock_storm_db.update_artist_albums()
+
+    assert mock_storm_db._artists.find_one({'_id': 'a1'})['albums'] == ['al1', 'al2']
+    assert mock_storm_db._artists.find_one({'_id': 'a2'})['albums'] == ['al1']
+    assert mock_storm_db.update_artist_albums()['albums']['matched'] == 0
+
+def test_get_eligible_tracks(mock_storm_db):
+    mock_storm_db._albums.insert_many([
+        {'_id': 'al1', 'artists': ['a1'], 'release_date': '2021-01-05'},
+        {'_id': 'al2', 'artists': ['a1', 'a2'], 'release_date': '2020-12-01'},
+        {'_id': 'al3', 'artists': ['a3'], 'release_date': '2021-01-06'},
+    ])
+    mock_storm_db._tracks.insert_many([
+        {'_id': 't1', 'album_id': 'al1', 'name': 'One'},
+        {'_id': 't2', 'album_id': 'al1', 'name': 'Two'},
+        {'_id': 't3', 'album_id': 'al2', 'name': 'Three'},
+        {'_id': 't4', 'album_id': 'al3', 'name': 'Four'},
+    ])
+
+    tracks = list(mock_storm_db.get_eligible_tracks(['a1', 'a2'], '2021-01-01', '2021-01-07'))
+
+    assert sorted(tracks, key=lambda x: x['_id']) == [
+        {'_id': 't1', 'album_id': 'al1'},
+        {'_id': 't2', 'album_id': 'al1'},
+    ]
+
+def test_update_playlist_changelog(mock_storm_db):
+    record = {'_id': 'p1', 'last_collected': '2021-01-01', 'info': {'snapshot_id': 's1'}, 'tracks': ['t1'], 'artists': ['a1']}
+    mock_storm_db.update_playlist(record)
+    mock_storm_db.update_playlist(
+        {**record, 'last_collected': '2021-01-02', 'info': {'snapshot_id': 's2'}, 'tracks': ['t1', 't2']},
+        {'snapshot': 's2', 'added': ['t2'], 'removed': []},
+    )
+    mock_storm_db.update_playlist_collection_date('p1', '2021-01-03')
+
+    assert mock_storm_db.get_playlist_state('p1')['info']['snapshot_id'] == 's2'
+    assert mock_storm_db.get_playlist_collection_date('p1') == '2021-01-03'
+    assert mock_storm_db.get_playlist_changelog('p1') == {
+        '2021-01-01': {'snapshot': 's1', 'tracks': ['t1']},
+        '2021-01-02': {'snapshot': 's2', 'added': ['t2'], 'removed': []},
+    }
+    assert mock_storm_db.get_playlist_state('p2') is None
+
+def test_unique_track_uids(mock_storm_db):
+    uids = mock_storm_db.gen_unique_track_uids(['Hello, World.', 'Hello World', 'Hello World'], [['a1'], ['a1'], ['a2']])
+
+    assert all(len(x) == 24 for x in uids)
+    assert uids[0] == uids[1] != uids[2]
+    assert mock_storm_db.gen_unique_track_id('Hello, World.', ['a1', 'a2']) == 'HelloWorldT&Aa1A&Aa2'
+
+def test_dedup_tracks_on_name_is_incremental(mock_storm_db):
+    mock_storm_db._tracks.insert_many([
+        {'_id': 't1', 'name': 'Song', 'artists': ['a1'], 'last_updated': '2021-01-01'},
+        {'_id': 't2', 'name': 'Song.', 'artists': ['a1'], 'last_updated': '2021-01-02'},
+        {'_id': 't3', 'name': 'Other', 'artists': ['a1'], 'last_updated': '2021-01-02'},
+    ])
+
+    assert mock_storm_db.dedup_tracks_on_name('2021-01-01')['upserted'] == 2
+    assert mock_storm_db._utracks.find_one({'_id': 'SongT&Aa1'})['uid'] == mock_storm_db.gen_unique_track_uids(['Song'], [['a1']])[0]
+
+    # Nothing was updated after the last dedup
+    mock_storm_db._utracks.update_many({}, {'$set': {'dedup_date': '2021-01-03'}})
+    assert mock_storm_db.dedup_tracks_on_name() == {'matched': 0, 'modified': 0, 'upserted': 0}
+
+def test_delivered_tracks_window(mock_storm_db):
+    mock_storm_db.update_delivered_tracks('storm', ['u1', 'u2'], '2021-01-01')
+    mock_storm_db.update_delivered_tracks('storm', ['u2'], '2021-03-01')
+    mock_storm_db.update_delivered_tracks('other', ['u3'], '2021-03-01')
+
+    assert mock_storm_db.get_delivered_track_uids('storm', ['u1', 'u2', 'u3'], '2021-02-01') == ['u2']
+    assert mock_storm_db._delivered.find_one({'_id': 'storm:u2'})['first_delivered'] == '2021-01-01'
+
+def test_backfill_delivered_tracks(mock_storm_db):
+    mock_storm_db._tracks.insert_one({'_id': 't1', 'name': 'Song', 'artists': ['a1']})
+    mock_storm_db._runs.insert_one({'storm_name': 'storm', 'run_date': '2021-01-01', 'storm_tracks': ['t1']})
+
+    assert not mock_storm_db.delivered_tracks_backfilled('storm')
+    assert mock_storm_db.ensure_delivered_tracks('storm') == 1
+    assert mock_storm_db.delivered_tracks_backfilled('storm')
+
+    uid = mock_storm_db.gen_unique_track_uids(['Song'], [['a1']])[0]
+    assert mock_storm_db.get_delivered_track_uids('storm', [uid], '2020-12-31') == [uid]
+
+def test_backfill_runs_once_with_empty_history(mock_storm_db, monkeypatch):
+    reads = []
+    get_runs_by_storm = mock_storm_db.get_runs_by_storm
+    monkeypatch.setattr(mock_storm_db, 'get_runs_by_storm', lambda *args: reads.append(args) or get_runs_by_storm(*args))
+
+    # Nothing delivered, so only the marker records the backfill
+    assert mock_storm_db.ensure_delivered_tracks('storm') == 0
+    assert mock_storm_db.ensure_delivered_tracks('storm') == 0
+    assert len(reads) == 1
+    assert mock_storm_db.get_delivered_track_uids('storm', ['__backfilled__'], '0000-00-00') == []
+
+def test_get_last_run_is_sorted_and_slim(mock_storm_db):
+    mock_storm_db.write_run_record({'storm_name': 'storm', 'run_date': '2021-01-09', 'input_tracks': ['t1'], 'config': {}})
+    mock_storm_db.write_run_record({'storm_name': 'storm', 'run_date': '2021-01-10', 'input_tracks': ['t2'], 'config': {}})
+    mock_storm_db.write_run_record({'storm_name': 'storm', 'run_date': '2021-01-02', 'input_tracks': ['t3'], 'config': {}})
+
+    assert mock_storm_db.get_last_run('storm', ['run_date']) == {'run_date': '2021-01-10'}
+    assert mock_storm_db.get_last_run('storm')['input_tracks'] == ['t2']
+    assert mock_storm_db.get_last_run('missing') is None
+
+def test_compacted_run_records(mock_storm_db):
+    mock_storm_db.run_chunk_size = 2
+    tracks = [f"t{i}" for i in range(5)]
+    mock_storm_db.write_run_record({'storm_name': 'storm', 'run_date': '2021-01-10', 'storm_tracks': tracks, 'input_artists': []}, compact=True)
+
+    stored = mock_storm_db._runs.find_one({'storm_name': 'storm'})
+    assert 'storm_tracks' not in stored and stored['compacted'] == {'storm_tracks': 3, 'input_artists': 0}
+    assert mock_storm_db.get_last_run('storm', ['storm_tracks'])['storm_tracks'] == tracks
+    assert mock_storm_db.get_runs_by_storm('storm')[0]['input_artists'] == []
+
+    # Updating a compacted field rewrites its chunks
+    mock_storm_db.update_run_record({'_id': stored['_id'], 'storm_tracks': ['t9']})
+    assert mock_storm_db.get_last_run('storm')['storm_tracks'] == ['t9']
+    assert mock_storm_db._run_chunks.count_documents({'field': 'storm_tracks'}) == 1
+
+def test_compact_existing_runs(mock_storm_db):
+    mock_storm_db.write_run_record({'storm_name': 'storm', 'run_date': '2021-01-10', 'eligible_tracks': ['t1', 't2'], 'config': {'a': 1}})
+
+    assert mock_storm_db.compact_runs() == 1
+    assert 'eligible_tracks' not in mock_storm_db._runs.find_one({})
+    assert mock_storm_db.get_last_run('storm')['eligible_tracks'] == ['t1', 't2']
+    assert mock_storm_db.compact_runs() == 0
+
+def test_write_run_record_stores_id_sets_as_codes(mock_storm_db):
+    record = RunRecord({'storm_name': 's', 'run_date': '2021-01-02', 'input_tracks': ['t1', 't2', 't3'],
+                        'storm_tracks': ['t3', 't1'], 'removed_artists': []})
+
+    mock_storm_db.write_run_record(record, compact=True)
+    run = mock_storm_db.get_last_run('s')
+
+    assert run['input_tracks'] == ['t1', 't2', 't3']
+    assert run['storm_tracks'] == ['t3', 't1']
+    assert run['removed_artists'] == []
+    chunks = {x['field']: x['encoding'] for x in mock_storm_db._run_chunks.find()}
+    assert chunks == {'input_tracks': 'codes', 'storm_tracks': 'codes', StormDB.RUN_ID_TABLE: 'ids'}
+
+    # Inline records store the id fields as lists
+    mock_storm_db.write_run_record(RunRecord({'storm_name': 'i', 'run_date': '2021-01-02', 'storm_tracks': ['t1']}))
+    assert mock_storm_db._runs.find_one({'storm_name': 'i'})['storm_tracks'] == ['t1']
+
+def test_get_track_info_without_ids(mock_storm_db):
+    mock_storm_db._tracks.insert_one({'_id': 't1', 'name': 'Track'})
+
+    assert mock_storm_db.get_track_info([]) == []
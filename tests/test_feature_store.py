@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+import mongomock
+
+from storm.db import StormDB
+from storm.feature_store import FeatureStore, FEATURE_COLUMNS
+
+def features(track_id, value):
+    return {'id': track_id, **{x: value for x in FEATURE_COLUMNS}}
+
+@pytest.fixture
+def feature_store(tmp_path):
+    yield FeatureStore(str(tmp_path / 'features'), max_segments=3)
+
+def test_lookup_returns_blocks_in_request_order(feature_store):
+    feature_store.append([features('t1', 1.0), features('t2', 2.0)])
+    feature_store.append([features('t3', 3.0)])
+
+    block = feature_store.lookup(['t3', 't9', 't1'], columns=['energy', 'tempo'])
+
+    assert block.shape == (3, 2)
+    assert block[0].tolist() == [3.0, 3.0]
+    assert np.isnan(block[1]).all()
+    assert block[2].tolist() == [1.0, 1.0]
+    assert feature_store.missing(['t1', 't9']) == ['t9']
+
+def test_appends_replace_rows_and_compact(feature_store):
+    for i in range(4):
+        feature_store.append([features('t1', float(i)), features(f"t{i + 2}", float(i))])
+
+    # The fourth append went past max_segments and compacted the store
+    assert len(feature_store._segments) == 1
+    assert len(feature_store) == 5
+    assert feature_store.lookup(['t1'])[0, 0] == 3.0
+
+    # A fresh reader maps the same files
+    reopened = FeatureStore(feature_store.directory)
+    assert reopened.to_frame(['t1', 't5'], ['energy'])['energy'].tolist() == [3.0, 3.0]
+
+def test_readers_remap_after_another_store_compacts(feature_store):
+    reader = FeatureStore(feature_store.directory)
+    feature_store.append([features('t1', 1.0), features('t2', 2.0)])
+    feature_store.append([features('t3', 3.0)])
+    assert reader.lookup(['t1'])[0, 0] == 1.0
+
+    feature_store.append([features('t1', 5.0)])
+    feature_store.compact()
+    assert reader.lookup(['t1', 't2', 't3'])[:, 0].tolist() == [5.0, 2.0, 3.0]
+    assert len(reader._segments) == 1
+
+    feature_store.append([features('t4', 4.0)])
+    assert reader.lookup(['t4', 't1'])[:, 0].tolist() == [4.0, 5.0]
+
+def test_db_keeps_feature_store_updated(feature_store, monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient(), feature_store=feature_store)
+    sdb._tracks.insert_one({'_id': 't0', 'audio_features': True, 'energy': 0.5})
+
+    sdb.update_track_features([features('t1', 0.25)])
+
+    assert feature_store.lookup(['t1'], ['energy'])[0, 0] == 0.25
+    assert sdb._tracks.find_one({'_id': 't1'})['audio_features']
+
+    assert sdb.export_feature_store() == 2
+    assert feature_store.lookup(['t0'], ['energy'])[0, 0] == 0.5
+    assert np.isnan(feature_store.lookup(['t0'], ['tempo'])[0, 0])
+
+def test_clusterizer_scores_from_feature_store(feature_store, monkeypatch):
+    from sklearn.pipeline import Pipeline
+    from sklearn.cluster import KMeans
+    from storm.modeling import StormTrackClusterizer, FeatureSelector
+
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient(), feature_store=feature_store)
+    feature_store.append([features(f"t{i}", float(i % 2)) for i in range(6)])
+
+    model = StormTrackClusterizer(storm_db_client=sdb)
+    model._model = Pipeline([('select', FeatureSelector(['energy', 'tempo'])), ('kmeans', KMeans(2, n_init=1, random_state=0))])
+    model._model.fit(feature_store.to_frame([f"t{i}" for i in range(6)]))
+
+    # Mongo is never read, it holds no tracks
+    predicted = model.predict(['t0', 't1', 't2'])
+
+    assert predicted['_id'].tolist() == ['t0', 't1', 't2']
+    assert predicted['cluster'][0] == predicted['cluster'][2] != predicted['cluster'][1]
+
+def test_feature_store_scores_like_mongo(feature_store, monkeypatch):
+    from sklearn.pipeline import Pipeline
+    from sklearn.cluster import KMeans
+    from storm.modeling import StormTrackClusterizer, FeatureSelector
+
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient(), feature_store=feature_store)
+    rng = np.random.default_rng(0)
+    tracks = [{'id': f"t{i}", 'energy': rng.random(), 'tempo': 60 + 120 * rng.random()} for i in range(200)]
+    sdb.update_track_features([dict(x) for x in tracks])
+    track_ids = [x['id'] for x in tracks]
+
+    model = StormTrackClusterizer(storm_db_client=sdb)
+    model._model = Pipeline([('select', FeatureSelector(['energy', 'tempo'])), ('kmeans', KMeans(8, n_init=1, random_state=0))])
+    model._model.fit(feature_store.to_frame(track_ids))
+
+    from_store = model.score(track_ids)
+    sdb.feature_store = None
+    from_mongo = model.score(track_ids)
+
+    assert from_store['cluster'].tolist() == from_mongo['cluster'].tolist()
+    assert from_store['distance_to_cluster'].tolist() == from_mongo['distance_to_cluster'].tolist()
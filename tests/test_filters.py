@@ -0,0 +1,62 @@
+import pytest
+import mongomock
+
+from storm.db import StormDB
+from storm.filters import StormFilterEngine, AudioFeatureRule
+
+@pytest.fixture
+def mock_storm_db(monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+
+    sdb._artists.insert_many([
+        {'_id': 'a1', 'genres': ['rock']},
+        {'_id': 'a2', 'genres': ['pop']},
+        {'_id': 'a3', 'genres': ['pop']},
+    ])
+    sdb._blacklists.insert_one({'_id': 'bl', 'blacklist': ['a4']})
+    sdb._tracks.insert_many([
+        {'_id': 't1', 'artists': ['a1']},
+        {'_id': 't2', 'artists': ['a1', 'a2']},
+        {'_id': 't3', 'artists': ['a1', 'a5']},
+        {'_id': 't4', 'artists': ['a4']},
+    ])
+    yield sdb
+
+def test_artist_filters(mock_storm_db):
+    engine = StormFilterEngine(mock_storm_db, {'artist': {'genre': ['pop'], 'blacklist': 'bl'}})
+
+    storm_artists, removed = engine.apply_artist_filters(['a1', 'a2', 'a4', 'a5'])
+
+    assert storm_artists == ['a1', 'a5']
+    assert sorted(removed) == ['a2', 'a3', 'a4']
+
+@pytest.mark.parametrize('mode, expected', [('hard', ['t1']), ('soft', ['t1', 't3'])])
+def test_track_artist_filters(mock_storm_db, mode, expected):
+    engine = StormFilterEngine(mock_storm_db, {'track': {'artist_filter': mode}})
+
+    storm_tracks, removed = engine.apply_track_filters(['t1', 't2', 't3', 't4'], ['a1'], ['a2', 'a4'])
+
+    assert storm_tracks == expected
+    assert removed == sorted(set(['t1', 't2', 't3', 't4']) - set(expected))
+
+def test_audio_feature_filters(mock_storm_db):
+    mock_storm_db._tracks.update_one({'_id': 't1'}, {'$set': {'energy': 0.9, 'valence': 0.1}})
+    mock_storm_db._tracks.update_one({'_id': 't2'}, {'$set': {'energy': 0.2, 'valence': 0.5}})
+    mock_storm_db._tracks.update_one({'_id': 't3'}, {'$set': {'energy': 0.7, 'valence': 0.6}})
+    engine = StormFilterEngine(mock_storm_db, {'track': {'audio_features': {'energy': 'gte&&0.5', 'valence': 'lt&&0.55'}}})
+
+    assert engine.required_track_fields() == {'_id': 1, 'energy': 1, 'valence': 1}
+
+    storm_tracks, removed = engine.apply_track_filters(['t1', 't2', 't3', 't4'], [], [])
+
+    assert storm_tracks == ['t1']
+    # t4 has no features and fails every comparison
+    assert engine.rejections == {'energy': 2, 'valence': 2}
+
+def test_audio_feature_rule_parse():
+    rule = AudioFeatureRule.parse('energy', 'gte&&0.5')
+
+    assert rule.to_query() == {'energy': {'$gte': 0.5}}
+    with pytest.raises(ValueError):
+        AudioFeatureRule.parse('energy', 'between&&0.5')
@@ -0,0 +1,149 @@
+import json
+import time
+import joblib
+import mongomock
+import numpy as np
+import pandas as pd
+import pytest
+import spotipy
+from types import SimpleNamespace
+from sklearn.pipeline import Pipeline
+from sklearn.cluster import KMeans
+
+from benchmarks.fake_spotify import FakeSpotifyServer
+from storm import storm_client
+from storm.db import StormDB
+from storm.instrumentation import Instrumentation, MongoMetricsListener, MONGO_LISTENER
+from storm.modeling import FeatureSelector
+from storm.runner import StormRunner
+from storm.storm_client import RequestScheduler, SpotifyTokenManager, get_user_client
+
+def _flaky(failures: int):
+    calls = []
+
+    def artists(ids):
+        calls.append(ids)
+        if len(calls) <= failures:
+            raise spotipy.SpotifyException(503, -1, "unavailable")
+        return {'artists': ids}
+
+    return artists
+
+def test_scheduler_calls_attributed_to_stages():
+    instrumentation = Instrumentation()
+    scheduler = RequestScheduler(rate=100, backoff=0.001)
+
+    with instrumentation.observing(scheduler):
+        with instrumentation.stage('collect_artist_info'):
+            scheduler.call(_flaky(1), ['a'])
+            scheduler.call(_flaky(0), ['b'])
+        scheduler.call(_flaky(0), ['c'])
+    scheduler.call(_flaky(0), ['d'])  # detached
+
+    stages = instrumentation.report()['stages']
+    artists = stages['collect_artist_info']['api']['artists']
+    assert artists['calls'] == 2
+    assert artists['retries'] == 1
+    assert artists['errors'] == 0
+    assert artists['wait_seconds'] >= 0.001
+    assert artists['latency_histogram'][-1] == ['+Inf', 2]
+    assert stages['collect_artist_info']['seconds'] > 0
+    assert stages['unstaged']['api']['artists']['calls'] == 1
+    assert scheduler.listeners == []
+
+def test_failed_calls_are_recorded():
+    instrumentation = Instrumentation()
+    scheduler = RequestScheduler(rate=100, max_retries=0)
+
+    with instrumentation.observing(scheduler), instrumentation.stage('write_storm_tracks'):
+        with pytest.raises(spotipy.SpotifyException):
+            scheduler.call(_flaky(1), ['a'])
+
+    assert instrumentation.report()['stages']['write_storm_tracks']['api']['artists']['errors'] == 1
+
+def test_weatherboy_calls_attributed_to_its_stage(tmp_path, monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    monkeypatch.setenv('spotify_user_id', 'test')
+    monkeypatch.setattr(storm_client, '_USER_CLIENTS', {})
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+    sdb._storms.insert_one({'name': 'storm', 'config': {'user_id': 'test', 'filters': {}}})
+
+    tracks = pd.DataFrame(np.random.default_rng(0).random((10, 2)), columns=['energy', 'valence'])
+    tracks.insert(0, '_id', [f"t{i}" for i in range(10)])
+    sdb._tracks.insert_many(tracks.to_dict('records'))
+    model = Pipeline([('select', FeatureSelector(['energy', 'valence'])), ('kmeans', KMeans(2, n_init=1, random_state=0))])
+    joblib.dump(model.fit(tracks), tmp_path / 'test__track_feature__2__run.pkl')
+
+    with FakeSpotifyServer() as server:
+        server.add_playlist('cluster0', [], name='0 - Test')
+        token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+        get_user_client('test', api_prefix=server.prefix, token_manager=token_manager)
+
+        runner = StormRunner('storm', model_name='test__track_feature__2__run', model_friendly_name='{cluster_number} - Test',
+                             sdb=sdb, sc=object(), suc=object(), model_dir=str(tmp_path))
+        runner.run_record['storm_tracks'] = tracks['_id'].tolist()
+        with runner.instrumentation.observing(*runner.schedulers()), runner.instrumentation.stage('call_weatherboy'):
+            runner.call_weatherboy()
+
+    api = runner.instrumentation.report()['stages']['call_weatherboy']['api']
+    assert api['current_user_playlists']['calls'] == 1
+    assert sum(x['calls'] for x in api.values()) > 1
+
+def test_mongo_listener_counts_documents_and_bytes():
+    instrumentation = Instrumentation()
+    listener = MongoMetricsListener()
+    listener.subscribe(instrumentation)
+
+    def command(name, command, reply, request_id):
+        listener.started(SimpleNamespace(command_name=name, command=command, database_name='storm',
+                                         connection_id=('localhost', 27017), request_id=request_id))
+        listener.succeeded(SimpleNamespace(command_name=name, reply=reply, duration_micros=1500,
+                                           connection_id=('localhost', 27017), request_id=request_id))
+
+    with instrumentation.stage('load_last_run'):
+        command('find', {'find': 'runs', 'filter': {}}, {'cursor': {'firstBatch': [{'_id': 1}, {'_id': 2}]}, 'ok': 1}, 1)
+        command('getMore', {'getMore': 5, 'collection': 'runs'}, {'cursor': {'nextBatch': [{'_id': 3}]}, 'ok': 1}, 2)
+        command('insert', {'insert': 'tracks', 'documents': [{'_id': 'a'}]}, {'n': 1, 'ok': 1}, 3)
+
+    mongo = instrumentation.report()['stages']['load_last_run']['mongo']
+    assert mongo['runs']['find']['documents'] == 2
+    assert mongo['runs']['getMore']['documents'] == 1
+    assert mongo['tracks']['insert'] == {
+        'operations': 1, 'failures': 0, 'documents': 1, 'bytes_sent': mongo['tracks']['insert']['bytes_sent'],
+        'bytes_received': mongo['tracks']['insert']['bytes_received'], 'seconds': 0.0015,
+    }
+    assert mongo['tracks']['insert']['bytes_sent'] > 0
+    assert mongo['runs']['find']['bytes_received'] > mongo['runs']['getMore']['bytes_received']
+
+    # Unsubscribed, commands are not even sized
+    listener.unsubscribe(instrumentation)
+    command('find', {'find': 'runs'}, {'cursor': {'firstBatch': []}}, 4)
+    assert instrumentation.report()['stages']['load_last_run']['mongo']['runs']['find']['operations'] == 1
+
+def test_observing_subscribes_to_mongo():
+    instrumentation = Instrumentation()
+
+    with instrumentation.observing():
+        assert instrumentation in MONGO_LISTENER._subscribers
+    assert instrumentation not in MONGO_LISTENER._subscribers
+
+def test_exports(tmp_path):
+    instrumentation = Instrumentation()
+    with instrumentation.stage('call_weatherboy'):
+        instrumentation.api_call('playlist_add_items', 0.2, wait=1.0, throttled=1)
+        instrumentation.mongo_command('tracks', 'find', 0.01, documents=10, bytes_sent=100, bytes_received=1000)
+
+    text = instrumentation.to_prometheus({'storm': 'film'})
+    assert 'storm_stage_seconds{storm="film",stage="call_weatherboy"}' in text
+    assert 'storm_api_throttled_total{storm="film",stage="call_weatherboy",endpoint="playlist_add_items"} 1' in text
+    assert 'storm_api_latency_seconds_bucket{storm="film",stage="call_weatherboy",endpoint="playlist_add_items",le="0.1"} 0' in text
+    assert 'storm_api_latency_seconds_bucket{storm="film",stage="call_weatherboy",endpoint="playlist_add_items",le="0.25"} 1' in text
+    assert 'storm_mongo_bytes_received_total{storm="film",stage="call_weatherboy",collection="tracks",command="find"} 1000' in text
+
+    instrumentation.write(str(tmp_path / 'film.prom'), {'storm': 'film'})
+    instrumentation.write(str(tmp_path / 'metrics' / 'film.json'), {'storm': 'film'})
+
+    assert (tmp_path / 'film.prom').read_text() == text
+    exported = json.loads((tmp_path / 'metrics' / 'film.json').read_text())
+    assert exported['labels'] == {'storm': 'film'}
+    assert exported['stages']['call_weatherboy']['mongo']['tracks']['find']['documents'] == 10
@@ -0,0 +1,46 @@
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+import mongomock
+from sklearn.pipeline import Pipeline
+from sklearn.cluster import KMeans
+
+from storm.db import StormDB
+from storm.modeling import StormTrackClusterizer, FeatureSelector
+
+@pytest.fixture
+def clusterizer(tmp_path, monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+
+    rng = np.random.default_rng(0)
+    tracks = pd.DataFrame(rng.random((50, 2)), columns=['energy', 'valence'])
+    tracks.insert(0, '_id', [f"t{i:02d}" for i in range(50)])
+    sdb._tracks.insert_many(tracks.to_dict('records'))
+
+    model = Pipeline([('select', FeatureSelector(['energy', 'valence'])), ('kmeans', KMeans(3, n_init=1, random_state=0))])
+    model.fit(tracks)
+    joblib.dump(model, tmp_path / 'test__track_feature__3__run.pkl')
+
+    yield StormTrackClusterizer(dir=str(tmp_path), storm_db_client=sdb), tracks, model
+
+def test_score_matches_pipeline_predict(clusterizer):
+    clusterizer, tracks, model = clusterizer
+    clusterizer.load_model_by_name('test__track_feature__3__run')
+
+    scored = clusterizer.score(tracks['_id'].tolist(), chunk_size=7)
+
+    assert scored['_id'].tolist() == tracks['_id'].tolist()
+    assert scored['cluster'].tolist() == model.predict(tracks).tolist()
+    assert np.allclose(scored['distance_to_cluster'], model.transform(tracks).min(axis=1))
+
+def test_models_are_loaded_once(clusterizer, monkeypatch):
+    clusterizer, tracks, model = clusterizer
+    clusterizer.load_model_by_name('test__track_feature__3__run')
+
+    monkeypatch.setattr(joblib, 'load', lambda *args, **kwargs: pytest.fail("model reloaded from disk"))
+    other = StormTrackClusterizer(dir=clusterizer.dir, storm_db_client=clusterizer.storm_db)
+    other.load_model_by_name('test__track_feature__3__run')
+
+    assert other._model is clusterizer._model
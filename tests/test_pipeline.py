@@ -0,0 +1,79 @@
+import time
+import pytest
+import mongomock
+
+from storm.db import StormDB
+from storm.storm_client import StormClient, SpotifyTokenManager
+from storm.pipeline import StormIngestPipeline
+from benchmarks.fake_spotify import FakeSpotifyServer
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+    sdb._artists.insert_many([{'_id': f"artist{i}"} for i in range(5)])
+
+    with FakeSpotifyServer(albums_per_artist=6) as server:
+        token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+        sc = StormClient("test", api_prefix=server.prefix, token_manager=token_manager, rate_limit=1000)
+        yield server, StormIngestPipeline(sdb, sc, 'test_2021-01-01', '2021-01-01',
+                                          artist_batch_size=2, album_batch_size=4, feature_batch_size=10, queue_size=2)
+
+def test_pipeline_collects_everything(pipeline):
+    server, pipe = pipeline
+    sdb = pipe.sdb
+
+    stats = pipe.run([f"artist{i}" for i in range(5)])
+
+    assert stats['artists']['processed'] == 5
+    assert stats['albums']['processed'] == 30
+    assert list(sdb.get_albums_for_track_collection()) == []
+    assert sdb.get_tracks_for_feature_collection() == []
+    assert sdb._tracks.count_documents({}) == stats['features']['processed'] > 0
+    assert all(x['done'] for x in sdb.get_pipeline_checkpoint('test_2021-01-01').values())
+
+def test_pipeline_resumes_after_failure(pipeline, monkeypatch):
+    server, pipe = pipeline
+    sdb = pipe.sdb
+
+    def unavailable(tracks):
+        raise ConnectionError("feature endpoint down")
+
+    get_track_features = pipe.sc.get_track_features
+    monkeypatch.setattr(pipe.sc, 'get_track_features', unavailable)
+    with pytest.raises(ConnectionError):
+        pipe.run([f"artist{i}" for i in range(5)])
+
+    checkpoint = sdb.get_pipeline_checkpoint('test_2021-01-01')
+    assert not checkpoint.get('features', {}).get('done', False)
+
+    # Rerun only picks up what is still missing
+    monkeypatch.setattr(pipe.sc, 'get_track_features', get_track_features)
+    collected_artists = sdb._artists.count_documents({'album_last_collected': '2021-01-01'})
+    requests_before = server.request_count
+    stats = pipe.run([f"artist{i}" for i in range(5)])
+
+    assert stats['artists']['processed'] == 5 - collected_artists
+    assert sdb.get_tracks_for_feature_collection() == []
+    assert server.request_count - requests_before < 60
+
+def test_leftover_albums_are_read_before_collection(pipeline, monkeypatch):
+    server, pipe = pipeline
+    sdb = pipe.sdb
+    sdb._albums.insert_many([{'_id': f"leftover{i}"} for i in range(6)])
+
+    # The seed cursor has to be drained before any album tracks are requested
+    events = []
+    get_albums = sdb.get_albums_for_track_collection
+
+    def albums_for_track_collection(albums=None):
+        for x in get_albums(albums):
+            yield x
+        events.append('seed closed' if albums is None else 'batch checked')
+
+    get_album_tracks = pipe.sc.get_album_tracks
+    monkeypatch.setattr(sdb, 'get_albums_for_track_collection', albums_for_track_collection)
+    monkeypatch.setattr(pipe.sc, 'get_album_tracks', lambda albums: events.append('tracks') or get_album_tracks(albums))
+    pipe.run([])
+
+    assert events.index('seed closed') < events.index('tracks')
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.pipeline import Pipeline
+from sklearn.cluster import KMeans
+
+from storm.registry import ModelRegistry
+from storm.modeling import StormTrackClusterizer, FeatureSelector
+
+@pytest.fixture
+def pipeline():
+    X = pd.DataFrame(np.random.default_rng(0).random((20, 2)), columns=['energy', 'valence'])
+    yield Pipeline([('select', FeatureSelector(['energy', 'valence'])), ('kmeans', KMeans(2, n_init=1, random_state=0))]).fit(X)
+
+def test_register_writes_to_directory_and_index(tmp_path, pipeline):
+    name = StormTrackClusterizer.register_model('film_vg', pipeline, 2, directory=str(tmp_path))
+
+    assert os.path.exists(tmp_path / f"{name}.pkl")
+    entry = json.loads((tmp_path / 'index.json').read_text())[name]
+    assert entry['friendly_name'] == 'film_vg'
+    assert entry['model_class'] == 'track_feature'
+    assert entry['num_clusters'] == 2
+    assert entry['features'] == ['energy', 'valence']
+    assert len(entry['sha256']) == 64
+
+def test_latest_and_mmap_load(tmp_path, pipeline):
+    registry = ModelRegistry(str(tmp_path))
+    registry.register('film__distinct', pipeline, 2, run='a')
+    time.sleep(0.01)
+    later = registry.register('film__distinct', pipeline, 3, run='b')
+
+    assert registry.latest('film__distinct') == later
+
+    model = registry.load(later, verify=True)
+    assert isinstance(model.steps[1][1].cluster_centers_, np.memmap)
+
+def test_rebuild_indexes_existing_pickles(tmp_path, pipeline, monkeypatch):
+    import joblib
+    joblib.dump(pipeline, tmp_path / 'lyrical__distinct__track_feature__8__run.pkl')
+    joblib.dump(pipeline, tmp_path / 'base_all_features__dtc_test.pkl')
+
+    # Indexed from the file names, nothing is loaded
+    load = joblib.load
+    monkeypatch.setattr(joblib, 'load', lambda *args, **kwargs: pytest.fail("pickle loaded to index it"))
+    index = ModelRegistry(str(tmp_path)).index
+
+    assert index['lyrical__distinct__track_feature__8__run']['friendly_name'] == 'lyrical__distinct'
+    assert index['lyrical__distinct__track_feature__8__run']['features'] is None
+    assert index['base_all_features__dtc_test']['num_clusters'] is None
+
+    # Features and hash are filled in by the first load
+    monkeypatch.setattr(joblib, 'load', load)
+    ModelRegistry(str(tmp_path)).load('lyrical__distinct__track_feature__8__run')
+    entry = json.loads((tmp_path / 'index.json').read_text())['lyrical__distinct__track_feature__8__run']
+    assert entry['features'] == ['energy', 'valence']
+    assert len(entry['sha256']) == 64
+    with pytest.raises(FileNotFoundError):
+        ModelRegistry(str(tmp_path)).get('missing')
+
+def test_latest_ignores_file_times_of_rebuilt_pickles(tmp_path, pipeline):
+    import joblib
+    for run in ['b', 'a']:
+        path = tmp_path / f'film__distinct__track_feature__8__{run}.pkl'
+        joblib.dump(pipeline, path)
+        os.utime(path, (1600000000, 1600000000))
+
+    registry = ModelRegistry(str(tmp_path))
+    assert registry.index['film__distinct__track_feature__8__a']['created'] is None
+
+    # Same mtime, so the choice is by name rather than whichever file was listed last
+    assert registry.latest('film__distinct') == 'film__distinct__track_feature__8__b'
+
+    # A registered model wins over rebuilt ones
+    registered = registry.register('film__distinct', pipeline, 2, run='0')
+    assert registry.latest('film__distinct') == registered
@@ -0,0 +1,32 @@
+import numpy as np
+
+from storm.run_record import IdTable, IdSet, RunRecord
+
+def test_id_set_is_an_ordered_set():
+    table = IdTable()
+    ids = IdSet(table, ['t3', 't1', 't3', 't2'])
+
+    assert ids.extend(['t1', 't4']) == 1
+    assert list(ids) == ['t3', 't1', 't2', 't4']
+    assert 't4' in ids and 't5' not in ids
+    assert ids[0] == 't3' and ids[1:3] == ['t1', 't2']
+    assert ids.codes.dtype == np.int32 and ids.codes.tolist() == [0, 1, 2, 3]
+
+def test_id_table_round_trip():
+    table = IdTable(['a', 'b', 'c'])
+
+    unpacked = IdTable.unpack(table.pack())
+
+    assert unpacked.ids == ['a', 'b', 'c']
+    assert unpacked.decode(table.encode(['c', 'a'])) == ['c', 'a']
+    assert IdTable.unpack(IdTable().pack()).ids == []
+
+def test_run_record_fields_share_one_table():
+    record = RunRecord({'storm_name': 's', 'input_tracks': ['t1', 't2'], 'storm_tracks': []})
+    record['eligible_tracks'] = ['t2', 't3']
+    record['storm_tracks'].append('t3')
+
+    assert record['storm_name'] == 's'
+    assert record['input_tracks'] == ['t1', 't2']
+    assert len(record.table) == 3
+    assert all(record[x].table is record.table for x in ['input_tracks', 'eligible_tracks', 'storm_tracks'])
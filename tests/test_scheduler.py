@@ -0,0 +1,59 @@
+import pytest
+import mongomock
+
+from storm.db import StormDB
+from storm.runner import StormRunner
+from storm.scheduler import StormScheduler
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+    for name, artists in [('storm_a', ['a1', 'a2']), ('storm_b', ['a2', 'a3'])]:
+        sdb._storms.insert_one({'name': name, 'config': {'user_id': 'u1', 'filters': {}}})
+        sdb._runs.insert_one({'storm_name': name, 'run_date': '2021-01-01', 'input_tracks': [], 'storm_artists': artists})
+
+    # No API access, record what each phase is handed
+    calls = {'collected': [], 'written': []}
+    monkeypatch.setattr('storm.scheduler.get_user_client', lambda user_id, **kwargs: object())
+    monkeypatch.setattr(StormRunner, 'collect_playlist_info', lambda self: None)
+    monkeypatch.setattr(StormRunner, 'collect_artist_info', lambda self, artists=None: calls['collected'].append(artists))
+    monkeypatch.setattr(StormRunner, 'collect_album_info', lambda self, artists=None: None)
+    monkeypatch.setattr(StormRunner, 'collect_track_features', lambda self: None)
+    monkeypatch.setattr(StormRunner, 'filter_storm_tracks', lambda self: self.run_record.update(storm_tracks=self.run_record['input_artists']))
+    monkeypatch.setattr(StormRunner, 'call_weatherboy', lambda self: None)
+    monkeypatch.setattr(StormRunner, 'write_storm_tracks', lambda self: calls['written'].append(self.name))
+
+    yield StormScheduler({'storm_a': {}, 'storm_b': {}}, workers=2, sdb=sdb, sc=object()), calls
+
+def test_scheduler_collects_shared_artists_once(scheduler):
+    scheduler, calls = scheduler
+
+    timings = scheduler.Run()
+
+    assert calls['collected'] == [['a1', 'a2', 'a3']]
+    assert sorted(calls['written']) == ['storm_a', 'storm_b']
+    assert set(timings) == {'total', 'storm_a', 'storm_b'}
+    assert set(timings['storm_a']) == {'prepare', 'filter', 'model', 'write', 'total'}
+
+    # Runners share the scheduler's clients
+    runners = list(scheduler.runners.values())
+    assert runners[0].sdb is runners[1].sdb and runners[0].sc is runners[1].sc and runners[0].suc is runners[1].suc
+
+    last_run = scheduler.sdb.get_runs_by_storm('storm_b')[-1]
+    assert last_run['storm_tracks'] == ['a2', 'a3']
+    assert 'timings' in last_run
+
+def test_streaming_jobs_checkpoint_under_their_own_run_id(scheduler, monkeypatch):
+    scheduler, calls = scheduler
+    run_ids = []
+    monkeypatch.setattr(StormRunner, 'stream_album_info', lambda self, artists=None, run_id=None: run_ids.append(run_id))
+
+    # Same storms the same day, then another job
+    scheduler.streaming = True
+    scheduler.Run()
+    StormScheduler({'storm_a': {}, 'storm_b': {}}, streaming=True, sdb=scheduler.sdb, sc=object()).Run()
+    StormScheduler({'storm_a': {}}, streaming=True, sdb=scheduler.sdb, sc=object()).Run()
+
+    assert len(set(run_ids)) == 3
+    assert run_ids[0].startswith('scheduler_storm_a+storm_b_') and run_ids[2].startswith('scheduler_storm_a_')
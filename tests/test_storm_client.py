@@ -1,7 +1,16 @@
-from storm.storm_client import StormClient
+from storm import storm_client as client_module
+from storm.storm_client import StormClient, StormUserClient, SpotifyTokenManager, RequestScheduler, TokenBucket, plan_playlist_sync, get_user_client, user_scheduler
+from benchmarks.fake_spotify import FakeSpotifyServer
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
+import mongomock
 import pytest
+import spotipy
+import time
 import os
 
+from storm.db import StormDB
+
 @pytest.fixture
 def storm_client():
     yield StormClient(user_id=os.getenv('spotify_user_id'))
@@ -62,3 +71,159 @@ def test_get_track_audio_analysis(storm_client):
 
     assert isinstance(track_audio_analysis, list)
     assert len(track_audio_analysis) > 0
+
+
+def test_token_manager_refreshes_only_when_expiring():
+    expiries = [time.time() + 3600, time.time() + 3600]
+    manager = SpotifyTokenManager(lambda: {"access_token": f"token{len(expiries)}", "expires_at": expiries.pop()})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        tokens = set(executor.map(lambda x: manager.get_access_token(), range(100)))
+
+    assert tokens == {"token2"}
+    assert manager.refresh_count == 1
+
+    # Inside the margin a new token is fetched
+    manager._token_info["expires_at"] = time.time() + 10
+    assert manager.get_access_token() == "token1"
+    assert manager.refresh_count == 2
+
+
+@pytest.fixture
+def throttled_client():
+    with FakeSpotifyServer(albums_per_artist=120, rate_limit_every=8, retry_after=0.1) as server:
+        token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+        yield server, StormClient("test", workers=4, api_prefix=server.prefix, token_manager=token_manager, rate_limit=100)
+
+def test_scheduler_retries_only_throttled_requests(throttled_client):
+    server, client = throttled_client
+    artists = [f"artist{i}" for i in range(10)]
+
+    albums = client.get_artist_albums(artists)
+
+    assert len(albums) == 10 * 120
+    assert server.rate_limited_count > 0
+    assert client.scheduler.throttle_count == server.rate_limited_count
+    # 3 pages per artist, plus one resend per injected 429
+    assert server.request_count == 30 + server.rate_limited_count
+
+def test_scheduler_gives_up_on_client_errors():
+    scheduler = RequestScheduler(rate=100)
+
+    def missing():
+        raise spotipy.SpotifyException(404, -1, "not found")
+
+    with pytest.raises(spotipy.SpotifyException):
+        scheduler.call(missing)
+    assert scheduler.retry_count == 0
+
+def test_scheduler_counts_calls_from_many_threads():
+    scheduler = RequestScheduler(rate=100000, backoff=0)
+    attempts = []
+
+    def flaky(i):
+        attempts.append(i)
+        if attempts.count(i) == 1:
+            raise spotipy.SpotifyException(503, -1, "unavailable")
+        return i
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert list(executor.map(lambda i: scheduler.call(flaky, i), range(400))) == list(range(400))
+
+    assert scheduler.call_count == 800
+    assert scheduler.retry_count == 400
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+
+    start = time.monotonic()
+    for _ in range(26):
+        bucket.acquire()
+
+    assert time.monotonic() - start >= 0.45
+
+def test_plan_playlist_sync_moves_only_out_of_order_tracks():
+    current = [f"t{i}" for i in range(500)]
+    desired = [x for x in current if x != "t10"] + ["t999"]
+    desired.insert(0, desired.pop(250))
+
+    operations = plan_playlist_sync(current, desired)
+
+    assert operations == [("remove", ["t10"]), ("reorder", 250, 0, 1), ("add", ["t999"], 499)]
+    assert plan_playlist_sync(desired, desired) == []
+
+def test_plan_playlist_sync_replaces_when_cheaper():
+    operations = plan_playlist_sync(["a", "b", "c"], ["c", "b", "a"])
+
+    assert operations == [("replace", ["c", "b", "a"])]
+    assert plan_playlist_sync(["a", "a"], ["a"]) == [("replace", ["a"])]
+
+@pytest.fixture
+def user_client():
+    with FakeSpotifyServer() as server:
+        token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+        yield server, StormUserClient("test", api_prefix=server.prefix, token_manager=token_manager)
+
+def test_sync_playlist_tracks(user_client):
+    server, client = user_client
+    current = [f"track{i:04d}" for i in range(450)]
+    server.add_playlist("synced", current, name="Synced")
+    desired = current[:100] + current[101:] + ["track9999"]
+    desired[0], desired[300] = desired[300], desired[0]
+
+    client.write_playlist_tracks_by_name("Synced", desired)
+
+    assert server.playlists["synced"]["tracks"] == desired
+    # one remove, two moves and one add instead of five replace and add batches
+    assert server.playlist_writes == 4
+
+    # Names are listed once per client
+    requests = server.request_count
+    client.write_playlist_tracks_by_name("Synced", desired)
+    assert server.request_count - requests == 5
+
+def test_get_user_playlists_pages_once(user_client):
+    server, client = user_client
+    for i in range(130):
+        server.add_playlist(f"playlist{i}", [], name=f"Playlist {i}")
+
+    playlists = client.get_user_playlists()
+
+    assert [x['id'] for x in playlists] == [f"playlist{i}" for i in range(130)]
+    assert server.request_count == 3
+
+def test_playlist_index_is_shared_through_storm_db(user_client, monkeypatch):
+    server, client = user_client
+    server.add_playlist("p1", [], name="First")
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    client.sdb = StormDB(mongo_client=mongomock.MongoClient())
+
+    assert client.get_playlist_ids() == {"First": "p1"}
+
+    # A later client reads the stored index, until it expires
+    token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+    later = StormUserClient("test", api_prefix=server.prefix, token_manager=token_manager, sdb=client.sdb)
+    requests = server.request_count
+    assert later.get_playlist_ids() == {"First": "p1"}
+    assert server.request_count == requests
+
+    client.sdb._playlist_index.update_one({"_id": "test"}, {"$set": {"updated": dt.datetime.now() - dt.timedelta(hours=2)}})
+    assert client.sdb.get_playlist_index("test") is None
+
+    # Playlists missing from a stored index are looked up again
+    server.add_playlist("p2", [], name="Second")
+    later.write_playlist_tracks_by_name("Second", ["t1"])
+    assert server.playlists["p2"]["tracks"] == ["t1"]
+
+def test_user_clients_share_one_scheduler_per_process(monkeypatch):
+    monkeypatch.setattr(client_module, '_USER_CLIENTS', {})
+    token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+    sdb = object()
+
+    first = get_user_client("a", token_manager=token_manager)
+    assert get_user_client("a", sdb=sdb) is first
+    assert first.sdb is sdb  # picked up for the playlist index
+
+    other = get_user_client("b", token_manager=token_manager)
+    assert first.scheduler is other.scheduler is user_scheduler()
+    assert first.token_manager is token_manager
@@ -0,0 +1,61 @@
+import time
+import joblib
+import mongomock
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.pipeline import Pipeline
+from sklearn.cluster import KMeans
+
+from benchmarks.fake_spotify import FakeSpotifyServer
+from storm import storm_client
+from storm.db import StormDB
+from storm.modeling import FeatureSelector
+from storm.storm_client import SpotifyTokenManager, get_user_client
+from storm.weatherboy import WeatherBoy
+
+MODEL_NAME = 'test__track_feature__3__run'
+FRIENDLY_NAME = '{cluster_number} - Test'
+
+@pytest.fixture
+def weatherboy(tmp_path, monkeypatch):
+    monkeypatch.setenv('mongo_db', 'storm_test')
+    monkeypatch.setenv('spotify_user_id', 'test')
+    monkeypatch.setattr(storm_client, '_USER_CLIENTS', {})
+    sdb = StormDB(mongo_client=mongomock.MongoClient())
+
+    rng = np.random.default_rng(0)
+    tracks = pd.DataFrame(rng.random((30, 2)), columns=['energy', 'valence'])
+    tracks.insert(0, '_id', [f"t{i:02d}" for i in range(30)])
+    sdb._tracks.insert_many(tracks.to_dict('records'))
+
+    model = Pipeline([('select', FeatureSelector(['energy', 'valence'])), ('kmeans', KMeans(3, n_init=1, random_state=0))])
+    joblib.dump(model.fit(tracks), tmp_path / f"{MODEL_NAME}.pkl")
+
+    with FakeSpotifyServer() as server:
+        for i in range(3):
+            server.add_playlist(f"cluster{i}", [], name=FRIENDLY_NAME.format(cluster_number=i))
+        yield WeatherBoy(sdb, MODEL_NAME, model_dir=str(tmp_path), friendly_name=FRIENDLY_NAME), server, tracks['_id'].tolist()
+
+def _process_client(server: FakeSpotifyServer):
+    """
+    The process' user client as a fresh process would build it, without a playlist index in memory.
+    """
+    storm_client._USER_CLIENTS.clear()
+    token_manager = SpotifyTokenManager(lambda: {"access_token": "test", "expires_at": time.time() + 3600})
+    return get_user_client('test', api_prefix=server.prefix, token_manager=token_manager)
+
+def test_second_run_uses_stored_playlist_index(weatherboy):
+    wb, server, tracks = weatherboy
+
+    _process_client(server)
+    wb.run(tracks)
+    listed = server.path_counts['/v1/me/playlists']
+    assert listed > 0
+
+    client = _process_client(server)
+    wb.run(tracks)
+
+    assert client.sdb is wb.sdb
+    assert server.path_counts['/v1/me/playlists'] == listed
+    assert sum(len(server.playlists[f"cluster{i}"]['tracks']) for i in range(3)) == len(tracks)